@@ -0,0 +1,104 @@
+"""
+Fixtures for the pipeline benchmark suite. Each benchmark is parametrized over the
+message scales passed with --scales, and runs against a synthetic chat.db generated by
+`imessage-extractor synth` and cached in benchmarks/.data between runs.
+"""
+
+import logging
+import pandas as pd
+import pytest
+import shutil
+from imessage_extractor.src.chatdb.chatdb import ChatDb
+from imessage_extractor.src.helpers.config import WorkflowConfig
+from imessage_extractor.src.helpers.verbosity import logger_setup
+from imessage_extractor.src.quality_control.quality_control import create_qc_views
+from imessage_extractor.src.refresh_contacts.refresh_contacts import refresh_contacts
+from imessage_extractor.src.staging.staging import assemble_staging_order
+from imessage_extractor.src.static_tables.static_tables import build_static_tables
+from imessage_extractor.src.synth.synth import SyntheticChatDb
+from os.path import dirname, join, isfile, isdir
+
+
+data_dpath = join(dirname(__file__), '.data')
+
+
+def pytest_addoption(parser):
+    parser.addoption('--scales', default='10000',
+                     help='Comma-separated message counts to benchmark at, e.g. 10000,100000,1000000,10000000')
+    parser.addoption('--seed', default=0, type=int,
+                     help='Seed for synthetic data generation.')
+    parser.addoption('--rounds', default=3, type=int,
+                     help='Number of timed rounds per benchmark.')
+
+
+def pytest_generate_tests(metafunc):
+    if 'n_messages' in metafunc.fixturenames:
+        scales = [int(x) for x in metafunc.config.getoption('scales').split(',')]
+        metafunc.parametrize('n_messages', scales, ids=[f'{x}_messages' for x in scales], scope='session')
+
+
+@pytest.fixture(scope='session')
+def logger() -> logging.Logger:
+    return logger_setup(name='imessage-extractor-benchmarks', level=logging.ERROR)
+
+
+@pytest.fixture(scope='session')
+def rounds(request) -> int:
+    return request.config.getoption('rounds')
+
+
+@pytest.fixture(scope='session')
+def synthetic_source(request, n_messages, logger) -> dict:
+    """
+    Paths to a synthetic chat.db and AddressBook folder at the given scale. Generating
+    the largest scales takes minutes, so sources are only generated once per scale and seed.
+    """
+    seed = request.config.getoption('seed')
+    dpath = join(data_dpath, f'{n_messages}_messages_seed_{seed}')
+    chatdb_fpath = join(dpath, 'chat.db')
+    address_book_dpath = join(dpath, 'AddressBook')
+
+    if not isfile(chatdb_fpath):
+        if isdir(dpath):
+            shutil.rmtree(dpath)
+
+        synthetic_chatdb = SyntheticChatDb(n_messages=n_messages,
+                                           n_contacts=max(50, n_messages // 1000),
+                                           n_group_chats=max(5, n_messages // 20000),
+                                           n_tapbacks=n_messages // 20,
+                                           n_threads=n_messages // 100,
+                                           n_attachments=n_messages * 3 // 100,
+                                           seed=seed,
+                                           logger=logger)
+        synthetic_chatdb.write_address_book(join(address_book_dpath, 'Sources', 'synth', 'AddressBook-v22.abcddb'))
+        synthetic_chatdb.write_chatdb(chatdb_fpath)
+
+    return dict(chatdb_fpath=chatdb_fpath, address_book_dpath=address_book_dpath, dpath=dpath)
+
+
+@pytest.fixture(scope='session')
+def cfg(logger, tmp_path_factory) -> WorkflowConfig:
+    return WorkflowConfig(params=dict(static_table_dpath=str(tmp_path_factory.mktemp('static_tables'))), logger=logger)
+
+
+@pytest.fixture(scope='session')
+def contacts_df(synthetic_source, logger) -> pd.DataFrame:
+    return refresh_contacts(address_book_dpath=synthetic_source['address_book_dpath'], logger=logger, cache_dpath=None)
+
+
+@pytest.fixture(scope='session')
+def chatdb(synthetic_source, contacts_df, cfg, logger, tmp_path_factory) -> ChatDb:
+    """
+    Output database with every pipeline stage up to and including QC view definitions
+    run, against which individual stages are then benchmarked.
+    """
+    output_db_fpath = str(tmp_path_factory.mktemp('output') / 'imessage_extractor_chat.db')
+
+    chatdb = ChatDb(native_chatdb_path=synthetic_source['chatdb_fpath'], imessage_extractor_db_path=output_db_fpath, logger=logger)
+    build_static_tables(sqlite_con=chatdb.sqlite_con, logger=logger, cfg=cfg, contacts_df=contacts_df)
+    assemble_staging_order(chatdb=chatdb, cfg=cfg)
+    create_qc_views(chatdb=chatdb, cfg=cfg, logger=logger)
+
+    yield chatdb
+
+    chatdb.disconnect()
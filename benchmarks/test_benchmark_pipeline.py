@@ -0,0 +1,103 @@
+"""
+Benchmark each stage of the imessage-extractor pipeline against synthetic chat.db files.
+
+Run with `make bench`, which saves results as JSON under .benchmarks/ and fails if any
+stage's mean time regresses past the threshold relative to the previous saved run.
+"""
+
+import json
+import pytest
+from imessage_extractor.src.chatdb.chatdb import SQLiteDb
+from imessage_extractor.src.quality_control.quality_control import create_qc_views, run_quality_control
+from imessage_extractor.src.refresh_contacts.refresh_contacts import refresh_contacts
+from imessage_extractor.src.staging.staging import StagingTableOrViewSQLDefined, StagingTablePythonDefined
+from imessage_extractor.src.static_tables.static_tables import build_static_tables, hash_table_name
+from os.path import dirname, join
+
+
+staging_dpath = join(dirname(dirname(__file__)), 'imessage_extractor', 'src', 'staging')
+
+with open(join(staging_dpath, 'staging_sql_info.json'), 'r') as f:
+    staging_sql_objects = list(json.load(f).keys())
+
+with open(join(staging_dpath, 'staging_python_info.json'), 'r') as f:
+    staging_python_objects = list(json.load(f).keys())
+
+
+def test_chatdb_copy(benchmark, rounds, chatdb, synthetic_source, tmp_path):
+    target_fpath = str(tmp_path / 'copy.db')
+    benchmark.pedantic(chatdb.copy,
+                       kwargs=dict(native_chatdb_path=synthetic_source['chatdb_fpath'], imessage_extractor_chatdb_path=target_fpath),
+                       rounds=rounds)
+
+
+def test_refresh_contacts(benchmark, rounds, chatdb, synthetic_source, logger):
+    benchmark.pedantic(refresh_contacts,
+                       kwargs=dict(address_book_dpath=synthetic_source['address_book_dpath'], logger=logger, cache_dpath=None),
+                       rounds=rounds)
+
+
+def test_build_static_tables(benchmark, rounds, chatdb, contacts_df, cfg, logger):
+    benchmark.pedantic(build_static_tables,
+                       kwargs=dict(sqlite_con=chatdb.sqlite_con, logger=logger, cfg=cfg, contacts_df=contacts_df),
+                       # Forget content hashes, so that every round rebuilds every table
+                       setup=lambda: chatdb.execute(f'DROP TABLE IF EXISTS {hash_table_name}'),
+                       rounds=rounds)
+
+
+@pytest.mark.parametrize('table_name', staging_sql_objects)
+def test_staging_sql_object(benchmark, rounds, chatdb, cfg, logger, table_name):
+    """
+    Time (re)defining a SQL staging object and fully scanning it. Defining a view is
+    instant, so the scan is included to capture the cost of the view's query.
+    """
+    staging_sql_obj = StagingTableOrViewSQLDefined(table_name=table_name, logger=logger, cfg=cfg)
+
+    def build_and_scan():
+        chatdb.execute(staging_sql_obj.def_sql)
+        return chatdb.sqlite_con.execute(f'SELECT count(*) FROM `{table_name}`').fetchone()[0]
+
+    benchmark.pedantic(build_and_scan, rounds=rounds)
+
+
+@pytest.mark.parametrize('table_name', staging_python_objects)
+def test_staging_python_object(benchmark, rounds, chatdb, cfg, logger, table_name):
+    staging_python_obj = StagingTablePythonDefined(table_name=table_name, chatdb=chatdb, logger=logger, cfg=cfg)
+    benchmark.pedantic(staging_python_obj.refresh, rounds=rounds)
+
+
+def test_staging_rollups_duckdb(benchmark, rounds, chatdb, cfg, logger, tmp_path):
+    """
+    Time computing every rollup with the DuckDB engine. Comparable to the sum of the
+    SQLite scans of the same objects in test_staging_sql_object. Rollups replace their
+    views with tables, so this runs against a copy of the shared output database.
+    """
+    pytest.importorskip('duckdb')
+    from imessage_extractor.src.staging.duckdb_engine import run_rollups_duckdb
+
+    rollup_db = SQLiteDb(db_path=str(tmp_path / 'rollups.db'), logger=logger)
+    rollup_db.sqlite_con = rollup_db.connect()
+    chatdb.sqlite_con.backup(rollup_db.sqlite_con)
+
+    benchmark.pedantic(run_rollups_duckdb, kwargs=dict(chatdb=rollup_db, cfg=cfg, logger=logger), rounds=rounds)
+    rollup_db.disconnect()
+
+
+def test_quality_control(benchmark, rounds, chatdb, cfg, logger):
+    def quality_control():
+        create_qc_views(chatdb=chatdb, cfg=cfg, logger=logger)
+        return run_quality_control(chatdb=chatdb, cfg=cfg, logger=logger)
+
+    benchmark.pedantic(quality_control, rounds=rounds)
+
+
+def test_app_extract_load(benchmark, rounds, chatdb, logger):
+    pytest.importorskip('streamlit')
+    from imessage_extractor.src.app.data.extract import iMessageDataExtract
+
+    def load_datasets():
+        data = iMessageDataExtract(chatdb.db_path, logger)
+        data.load_datasets(dict.fromkeys(data.manifest))
+        return data
+
+    benchmark.pedantic(load_datasets, rounds=rounds)
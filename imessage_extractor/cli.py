@@ -1,6 +1,9 @@
 import click
 from imessage_extractor.src.go import go
 from imessage_extractor.src.app.run_app import run_app
+from imessage_extractor.src.synth.synth import synth
+from imessage_extractor.src.export.export import export
+from imessage_extractor.src.watch.watch import watch
 
 
 @click.group()
@@ -13,6 +16,9 @@ def cli():
 
 cli.add_command(go)
 cli.add_command(run_app)
+cli.add_command(synth)
+cli.add_command(export)
+cli.add_command(watch)
 
 
 def main(args=None):
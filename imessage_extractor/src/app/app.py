@@ -4,7 +4,8 @@ import streamlit as st
 from send2trash import send2trash
 import typing
 from imessage_extractor.src.app.data.extract import iMessageDataExtract
-from imessage_extractor.src.app.helpers import get_db_fpath, get_extract_fpath, extract_exists, get_tmp_dpath
+from imessage_extractor.src.app.data.refresh import write_refresh_progress
+from imessage_extractor.src.app.helpers import get_db_fpath, extract_exists, get_tmp_dpath
 from imessage_extractor.src.helpers.verbosity import logger_setup
 from os.path import join, expanduser, dirname, isfile, isdir
 from os import mkdir
@@ -62,18 +63,24 @@ class MultiApp(object):
                 self.data.load_data_extract(tmp_imessage_visualizer_dpath)
 
             else:
+                # There is no data to serve yet, so no page is written until the refresh
+                # finishes. Each run shows its progress, then reruns while it is running
                 self.data = iMessageDataExtract(chatdb_fpath, logger)
-                self.data.extract_data()
+                if not write_refresh_progress(self.data.extract_data(wait=False)) or not self.data.swap_refreshed_data():
+                    st.stop()
+
                 self.data.save_data_extract(tmp_imessage_visualizer_dpath)
 
-    def add_app(self, title: str, write_func: typing.Callable):
+    def add_app(self, title: str, write_func: typing.Callable, datasets: dict={}):
         """
         write_func: the python function to render this app.
         title: title of the app. Appears in the dropdown in the sidebar.
+        datasets: the datasets in manifest.json that the app reads, with the columns it reads.
         """
         self.apps.append({
             'title': title,
             'function': write_func,
+            'datasets': datasets,
         })
 
     def run(self):
@@ -91,6 +98,20 @@ class MultiApp(object):
             format_func=lambda app: app['title']
         )
 
+        # Data is refreshed in the background, while pages are written from the current
+        # data. Once a refresh finishes, the refreshed data replaces it here
+        if self.data.refresh_worker is not None:
+            if self.data.refresh_worker.succeeded:
+                with st.spinner('Loading refreshed iMessage data...'):
+                    self.data.swap_refreshed_data()
+                    self.data.save_data_extract(tmp_imessage_visualizer_dpath)
+            elif self.data.refresh_worker.running:
+                st.sidebar.info(f'Refreshing iMessage data: {self.data.refresh_worker.stage or "Starting"}...')
+
+        # Only the datasets this page needs are loaded before it is written
+        with st.spinner('Loading iMessage data...'):
+            self.data.load_datasets(app['datasets'])
+
         app['function'](data=self.data, logger=self.logger)
 
 
@@ -119,7 +140,7 @@ def main():
     app = MultiApp(logger=logger, chatdb_fpath=imessage_extractor_chatdb_path)
 
     for page_name, page_module in PAGES.items():
-        app.add_app(page_name, getattr(page_module, 'write'))
+        app.add_app(page_name, getattr(page_module, 'write'), getattr(page_module, 'datasets'))
 
     app.run()
 
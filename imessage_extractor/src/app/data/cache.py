@@ -0,0 +1,120 @@
+import datetime
+import pandas as pd
+import sys
+import typing
+from collections import OrderedDict
+
+
+def column_size(values: typing.Union[pd.Series, pd.Index]) -> int:
+    """
+    Memory used by a column or index in bytes. Only columns of Python objects (i.e.
+    strings) are measured deeply, as a deep measure visits every value, while the size of
+    a numeric, datetime or categorical column is known from its dtype.
+    """
+    deep = pd.api.types.is_object_dtype(values.dtype) or pd.api.types.is_string_dtype(values.dtype)
+    if isinstance(values, pd.Series):
+        return int(values.memory_usage(index=False, deep=deep))
+
+    return int(values.memory_usage(deep=deep))
+
+
+def estimate_size(value) -> int:
+    """
+    Estimate the memory used by a page data value in bytes, i.e. a dataframe, or a dict,
+    list or tuple of dataframes.
+    """
+    if isinstance(value, pd.DataFrame):
+        return column_size(value.index) + sum(column_size(value.iloc[:, i]) for i in range(value.shape[1]))
+    elif isinstance(value, pd.Series):
+        return column_size(value.index) + column_size(value)
+    elif isinstance(value, dict):
+        return sys.getsizeof(value) + sum(estimate_size(x) for x in value.values())
+    elif isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(x) for x in value)
+    else:
+        return sys.getsizeof(value)
+
+
+def make_key(value) -> typing.Hashable:
+    """
+    Convert page inputs to a hashable cache key. Lists become tuples, and dates are
+    normalized so that equal dates from different widgets produce the same key.
+    """
+    if isinstance(value, (list, tuple)):
+        return tuple(make_key(x) for x in value)
+    elif isinstance(value, dict):
+        return tuple(sorted((k, make_key(v)) for k, v in value.items()))
+    elif isinstance(value, (datetime.date, datetime.datetime, pd.Timestamp)):
+        return pd.Timestamp(value).isoformat()
+    else:
+        return value
+
+
+class PageDataCache(object):
+    """
+    Least-recently-used cache of page data, i.e. the dataframes a page queries and
+    aggregates for its current controls. Entries are evicted, least recently used first,
+    once their estimated size exceeds `max_bytes`. Keys include the version of the data
+    snapshot they were computed from, and the cache is cleared whenever datasets are
+    reloaded, so a refreshed extract is never served stale page data.
+    """
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, key: typing.Hashable, compute: typing.Callable) -> typing.Any:
+        """
+        Return the value cached for `key`, or else call `compute()`, cache its result and
+        return it. Dicts are returned as shallow copies, so that keys a page adds to its
+        page data are not added to the cached entry.
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            value = self.entries[key]
+        else:
+            self.misses += 1
+            value = compute()
+            self.put(key, value)
+
+        return dict(value) if isinstance(value, dict) else value
+
+    def put(self, key: typing.Hashable, value: typing.Any) -> None:
+        """
+        Cache `value` under `key`, then evict least recently used entries until the cache
+        fits in `max_bytes`. A value larger than `max_bytes` on its own is not cached.
+        """
+        self.pop(key)
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        self.entries[key] = value
+        self.sizes[key] = size
+        self.total_bytes += size
+
+        while self.total_bytes > self.max_bytes:
+            self.pop(next(iter(self.entries)))
+
+    def pop(self, key: typing.Hashable) -> None:
+        """
+        Remove an entry, if cached.
+        """
+        if key in self.entries:
+            del self.entries[key]
+            self.total_bytes -= self.sizes.pop(key)
+
+    def clear(self) -> None:
+        """
+        Remove all entries.
+        """
+        self.entries.clear()
+        self.sizes.clear()
+        self.total_bytes = 0
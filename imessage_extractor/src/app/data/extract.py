@@ -2,77 +2,284 @@ import emoji
 import json
 from send2trash import send2trash
 import logging
-import _pickle as cPickle
 import pandas as pd
+import shutil
 import streamlit as st
 import string
 import sqlite3
-from os.path import join, expanduser, dirname
+import typing
+from os import makedirs, rename, stat
+from os.path import join, expanduser, dirname, isdir, isfile
 from imessage_extractor.src.helpers.verbosity import code, path
-from imessage_extractor.src.app.helpers import extract_exists, get_extract_fpath, get_db_fpath
-import subprocess
+from imessage_extractor.src.helpers.utils import sqlite_uri
+from imessage_extractor.src.app.data.cache import PageDataCache, make_key
+from imessage_extractor.src.app.data.extract_io import read_extract_dataset, write_extract_dataset
+from imessage_extractor.src.app.data.query import PageDataQuery
+from imessage_extractor.src.app.data.refresh import RefreshWorker
+from imessage_extractor.src.app.helpers import extract_exists, get_extract_dpath, get_extract_dataset_fpath, get_extract_version_fpath, get_db_fpath
+
+
+# Nullable pandas dtypes, for declared 'bool' and integer columns that contain nulls
+nullable_dtypes = dict(bool='boolean', int8='Int8', int16='Int16', int32='Int32', int64='Int64')
+
+
+def apply_dtypes(dataset: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    """
+    Convert the columns of a dataset to the dtypes declared for it in manifest.json, one of
+    'category', 'bool', an integer type (i.e. 'int16') or 'datetime'. Timestamps are parsed
+    in a single vectorized call, dropping any timezone.
+    """
+    for col, dtype in dtypes.items():
+        if col not in dataset.columns:
+            raise KeyError(f'Column {code(col)} declared in {path("manifest.json")} not found in dataset')
+
+        if dtype == 'datetime':
+            values = pd.to_datetime(dataset[col])
+            dataset[col] = values.dt.tz_localize(None) if values.dt.tz is not None else values
+
+        elif dtype == 'category':
+            dataset[col] = dataset[col].astype('category')
+
+        elif dtype in nullable_dtypes:
+            dataset[col] = dataset[col].astype(nullable_dtypes[dtype] if dataset[col].isnull().any() else dtype)
+
+        else:
+            raise ValueError(f'Unsupported dtype {code(dtype)} declared for column {code(col)} in {path("manifest.json")}')
+
+    return dataset
 
 
 @st.cache(show_spinner=False, allow_output_mutation=True)
 class iMessageDataExtract(object):
     """
-    Store all dataframe extract objects accessed in the GUI.
+    Store all dataframe extract objects accessed in the GUI. Each dataset in manifest.json
+    is loaded with the columns pages declare they read by `load_datasets()`, or in full the
+    first time it is otherwise accessed as an attribute, and cached afterwards. Page data
+    computed from the datasets is cached in `page_cache`, up to `page_cache_max_mb`.
     """
-    def __init__(self, chatdb_fpath: str, logger: logging.Logger) -> None:
+    def __init__(self, chatdb_fpath: str, logger: logging.Logger, page_cache_max_mb: int=256) -> None:
         self.logger = logger
         self.chatdb_fpath = chatdb_fpath
+        self.manifest = self.read_manifest()
+        self.from_extract = False
+        self.extract_version = 0
+        self.sqlite_con = None
+        self.page_cache = PageDataCache(max_bytes=page_cache_max_mb * 1024 ** 2)
+        self.refresh_worker = None
+        self.loaded_columns = dict()
+        self._query = None
+        self._lst_contact_names_all = None
+        self._lst_contact_names_no_group_chats = None
+        self.define_lists()
+
+    def __getattr__(self, name: str):
+        """
+        Load a dataset in manifest.json on first access. Only called for attributes that
+        are not already set, so loaded datasets are returned as they are.
+        """
+        if name in self.__dict__.get('manifest', {}):
+            dataset = self.load_dataset(name)
+            setattr(self, name, dataset)
+            self.loaded_columns[name] = None
+            return dataset
 
-    def extract_data(self) -> None:
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def extract_data(self, wait: bool=True, restart: bool=False) -> 'RefreshWorker':
         """
-        Perform iMessage data extract.
+        Refresh the imessage-extractor output database from chat.db in a background
+        worker. The current output database and loaded datasets keep being served while it
+        runs, until `swap_refreshed_data()` replaces them. If `wait`, block until the
+        refresh finishes and swap in the refreshed data.
+
+        A refresh that is running, or that has succeeded but not been swapped in yet, is
+        returned rather than replaced. A failed refresh is only replaced if `restart`, i.e.
+        when the user asks for a refresh.
         """
-        #
-        # Call imessage-extractor
-        #
+        if self.refresh_worker is not None and restart and self.refresh_worker.done and not self.refresh_worker.succeeded:
+            self.refresh_worker = None
 
-        if hasattr(st.session_state, 'chatdb_fpath'):
-            system_chatdb_fpath = st.session_state.chatdb_fpath
-        else:
-            system_chatdb_fpath = expanduser('~/Library/Messages/chat.db')
+        if self.refresh_worker is None:
+            if hasattr(st.session_state, 'chatdb_fpath'):
+                system_chatdb_fpath = expanduser(st.session_state.chatdb_fpath)
+            else:
+                system_chatdb_fpath = expanduser('~/Library/Messages/chat.db')
 
-        self.logger.info(f'Running {code("imessage-extractor")} workflow', arrow='black')
-        subprocess.call(['imessage-extractor', 'go', '--chatdb-path', system_chatdb_fpath, '--output-db-path', get_db_fpath()])
+            self.refresh_worker = RefreshWorker(system_chatdb_fpath, get_db_fpath(), self.logger).start()
 
-        #
-        # Raw tables
-        #
+        worker = self.refresh_worker
+        if wait:
+            worker.thread.join()
+            self.swap_refreshed_data()
 
-        with open(join(dirname(__file__), 'manifest.json'), 'r') as f:
-            manifest = json.load(f)
+        return worker
+
+    def swap_refreshed_data(self) -> bool:
+        """
+        If a refresh has succeeded, atomically replace the output database with the
+        refreshed one, and unload datasets so they are read from it. Return True if data
+        was swapped. A failed refresh is left in `refresh_worker` to be reported.
+        """
+        if self.refresh_worker is None or not self.refresh_worker.succeeded:
+            return False
+
+        self.refresh_worker.swap()
+        self.refresh_worker = None
+        self.unload_datasets()
+        self.from_extract = False
+        self.logger.info('Swapped in refreshed iMessage data', arrow='black')
+        return True
+
+    @property
+    def snapshot_version(self) -> tuple:
+        """
+        Version of the data pages are computed from, i.e. the version of the datasets and
+        the modification time of the imessage-extractor output database that queries read,
+        which changes whenever it is refreshed. Datasets read from a data extract are
+        versioned by the modification time the output database had when the extract was
+        saved, and otherwise by its current modification time.
+        """
+        chatdb_version = stat(self.chatdb_fpath).st_mtime_ns if isfile(self.chatdb_fpath) else 0
+        return (self.extract_version if self.from_extract else chatdb_version, chatdb_version)
+
+    def page_data(self, func: typing.Callable, **inputs) -> typing.Any:
+        """
+        Return `func(self, **inputs)`, computing it only if it has not been computed for the
+        same inputs against the current data snapshot. Cached page data must be treated as
+        read-only.
+        """
+        key = (func.__module__, func.__qualname__, self.snapshot_version, make_key(inputs))
+        return self.page_cache.get(key, lambda: func(self, **inputs))
+
+    def load_datasets(self, datasets: dict) -> None:
+        """
+        Load the datasets a page declares it needs before the page is written, given as
+        {dataset_name: columns}, where columns is a list of the columns the page reads
+        besides the index, or None for all of them. A dataset already loaded with those
+        columns is kept, otherwise it is loaded again with the columns it was loaded with
+        before as well.
+        """
+        for dataset_name, columns in datasets.items():
+            if dataset_name in self.__dict__:
+                loaded_columns = self.loaded_columns.get(dataset_name)
+                if loaded_columns is None or (columns is not None and set(columns) <= set(loaded_columns)):
+                    continue
 
-        self.logger.info(f'Read {path("manifest.json")}, extracting {len(manifest)} total datasets', arrow='black')
+                if columns is not None:
+                    columns = loaded_columns + [x for x in columns if x not in loaded_columns]
 
-        for dataset_name, dataset_metadata in manifest.items():
-            self.logger.debug(f'Reading dataset {code(dataset_name)}...', arrow='black')
+            setattr(self, dataset_name, self.load_dataset(dataset_name, columns))
+            self.loaded_columns[dataset_name] = None if columns is None else list(columns)
 
-            with sqlite3.connect(self.chatdb_fpath) as con:
-                dataset = pd.read_sql(f'select * from {dataset_name}', con)
+    def unload_datasets(self) -> None:
+        """
+        Drop all loaded datasets and cached page data, so that they are loaded again on
+        next access.
+        """
+        for dataset_name in self.get_dataset_names():
+            delattr(self, dataset_name)
 
-            if 'dt' in dataset.columns:
-                dataset['dt'] = pd.to_datetime(dataset['dt'])
+        self.loaded_columns.clear()
 
-            if 'ts' in dataset.columns:
-                dataset['ts'] = dataset['ts'].apply(lambda x: pd.to_datetime(x).tz_localize(None))
+        self._lst_contact_names_all = None
+        self._lst_contact_names_no_group_chats = None
+        self.page_cache.clear()
 
-            # if dataset_metadata['index'] is not None:
-            #     dataset = dataset.set_index(dataset_metadata['index'])
+        # The output database may have been replaced, so connections to it are reopened
+        if self._query is not None:
+            self._query.close()
+            self._query = None
 
-            setattr(self, dataset_name, dataset)
+        if self.sqlite_con is not None:
+            self.sqlite_con.close()
+            self.sqlite_con = None
+
+    def load_dataset(self, dataset_name: str, columns: list=None) -> pd.DataFrame:
+        """
+        Read a dataset from the saved data extract if it has been loaded, or else from
+        the imessage-extractor output database. Only `columns` are read besides the
+        dataset's index, if given.
+        """
+        if self.from_extract:
+            dataset = read_extract_dataset(get_extract_dataset_fpath(dataset_name), columns=columns)
+            self.logger.info(f'Loaded {code(dataset_name)} from data extract, shape: {dataset.shape}', arrow='black')
+        else:
+            dataset = self.read_dataset(dataset_name, columns=columns)
             self.logger.info(f'Read {code(dataset_name)}, shape: {dataset.shape}', arrow='black')
 
-        #
-        # Lists
-        #
+        return dataset
+
+    def read_dataset(self, dataset_name: str, columns: list=None) -> pd.DataFrame:
+        """
+        Read a dataset from the imessage-extractor output database over a single,
+        read-only connection shared by all datasets, with the dtypes and index declared for
+        it in manifest.json. Only `columns` are read besides the index, if given.
+        """
+        self.logger.debug(f'Reading dataset {code(dataset_name)}...', arrow='black')
+
+        if self.sqlite_con is None:
+            self.sqlite_con = sqlite3.connect(sqlite_uri(self.chatdb_fpath, mode='ro'), uri=True, check_same_thread=False)
+
+        index = self.manifest[dataset_name].get('index')
+        dtypes = self.manifest[dataset_name].get('dtypes', {})
+
+        if columns is None:
+            select_list = '*'
+        else:
+            columns = (index or []) + [x for x in columns if x not in (index or [])]
+            select_list = ', '.join(f'"{x}"' for x in columns)
+            dtypes = {k: v for k, v in dtypes.items() if k in columns}
+
+        dataset = pd.read_sql(f'select {select_list} from {dataset_name}', self.sqlite_con)
+        dataset = apply_dtypes(dataset, dtypes)
+
+        # Indexes are sorted so that pages can select a contact or date range with .loc or
+        # .xs by binary search, rather than by scanning every row
+        if index is not None:
+            dataset = dataset.set_index(index).sort_index()
+
+        return dataset
+
+    @property
+    def query(self) -> 'PageDataQuery':
+        """
+        Query layer over the imessage-extractor output database, for page data filtered
+        and aggregated in SQL.
+        """
+        if self._query is None:
+            self._query = PageDataQuery(self.chatdb_fpath)
+
+        return self._query
 
-        self.lst_contact_names_all = sorted([x for x in self.message_user['contact_name'].combine_first(self.message_user['chat_identifier']).unique() if isinstance(x, str)])
-        self.lst_contact_names_no_group_chats = sorted(
-            [x for x in self.message_user.loc[self.message_user['is_group_chat'] == 0]['contact_name'].unique() if isinstance(x, str)]
-        )
+    @property
+    def lst_contact_names_all(self) -> list:
+        """
+        Contact names, or chat identifiers where there is no contact name, of all chats.
+        """
+        if self._lst_contact_names_all is None:
+            self._lst_contact_names_all = sorted(
+                [x for x in self.message_user['contact_name'].combine_first(self.message_user['chat_identifier']).unique() if isinstance(x, str)]
+            )
+
+        return self._lst_contact_names_all
+
+    @property
+    def lst_contact_names_no_group_chats(self) -> list:
+        """
+        Contact names of all one-on-one chats.
+        """
+        if self._lst_contact_names_no_group_chats is None:
+            self._lst_contact_names_no_group_chats = sorted(
+                [x for x in self.message_user.loc[self.message_user['is_group_chat'] == 0]['contact_name'].unique() if isinstance(x, str)]
+            )
+
+        return self._lst_contact_names_no_group_chats
+
+    def define_lists(self) -> None:
+        """
+        Define lists used throughout the app. Lists of contact names are computed from
+        `message_user` when first accessed.
+        """
         self.lst_punctuation_chars = list(string.punctuation + '’‘“”``')
         self.lst_contractions_w_apostrophe = [
             "i'm", "i'd", "i've", "i'll", "'s",
@@ -99,62 +306,64 @@ class iMessageDataExtract(object):
 
         self.logger.info('Defined lists', arrow='black')
 
+    def read_manifest(self) -> dict:
+        """
+        Read the datasets to extract, and their metadata, from manifest.json.
+        """
+        with open(join(dirname(__file__), 'manifest.json'), 'r') as f:
+            return json.load(f)
+
     def get_dataset_names(self) -> list:
         """
-        Get datasets pulled in the .extract_data() method.
+        Get the datasets that have been loaded so far.
         """
-        return [x for x in dir(self)  if not x.startswith('__') and not callable(getattr(self, x)) and x not in ['logger']]
+        return [x for x in self.manifest if x in self.__dict__]
 
     def save_data_extract(self, dpath: str) -> None:
         """
-        Save iMessage Data Extract to local using pickle.
+        Save iMessage Data Extract to local, one Arrow IPC file per dataset. Datasets that
+        have not been loaded are read and written one at a time, without being kept in
+        memory. Files are written to a staging directory that then replaces the existing
+        extract, so a partially written extract is never loaded.
         """
-        dataset_names_to_save = self.get_dataset_names()
+        extract_dpath = get_extract_dpath()
+        staging_dpath = extract_dpath + '.tmp'
+        if isdir(staging_dpath):
+            shutil.rmtree(staging_dpath)
 
-        # for dataset_name in dataset_names_to_save:
-        #     fpath = join(dpath, f'{dataset_name}.pkl')
-        #     with open(fpath, 'wb') as f:
-        #         cPickle.dump(getattr(self, dataset_name), f)
+        makedirs(staging_dpath)
+        extract_version = self.snapshot_version[0]
+        for dataset_name in self.manifest:
+            # Datasets loaded with only some of their columns are read again in full
+            if dataset_name in self.__dict__ and self.loaded_columns.get(dataset_name) is None:
+                dataset = self.__dict__[dataset_name]
+            else:
+                dataset = self.load_dataset(dataset_name)
 
-        if extract_exists():
-            send2trash(get_extract_fpath())
+            write_extract_dataset(dataset, get_extract_dataset_fpath(dataset_name, staging_dpath))
 
-        pickle_dict = {}
-        for dataset_name in dataset_names_to_save:
-            pickle_dict[dataset_name] = getattr(self, dataset_name)
+        with open(get_extract_version_fpath(staging_dpath), 'w') as f:
+            json.dump(dict(snapshot_version=extract_version), f)
 
-        with open(get_extract_fpath(), 'wb') as f:
-            cPickle.dump(pickle_dict, f)
+        if extract_exists():
+            send2trash(extract_dpath)
 
-        self.logger.info(f'Saved iMessage data extract to {path(dpath)}', arrow='black')
+        rename(staging_dpath, extract_dpath)
+        self.from_extract = True
+        self.extract_version = extract_version
+        self.logger.info(f'Saved iMessage data extract to {path(extract_dpath)}', arrow='black')
 
     def load_data_extract(self, dpath: str) -> None:
         """
-        Load iMessage Data Extract from local using pickle.
+        Load iMessage Data Extract from local. Each dataset's Arrow IPC file is
+        memory-mapped when the dataset is first accessed.
         """
         if extract_exists():
-            with open(get_extract_fpath(), 'rb') as f:
-                pickle_dict = cPickle.load(f)
-
-            for dataset_name, dataset in pickle_dict.items():
-                setattr(self, dataset_name, dataset)
-
-            self.logger.info(f'Loaded iMessage data extract from {path(dpath)}', arrow='black')
-
-        # dataset_fpaths_to_load = [splitext(x)[0] for x in listdir(dpath)]
-        # if len(dataset_fpaths_to_load):
-        #     for dataset_name in dataset_fpaths_to_load:
-        #         fpath = join(dpath, f'{dataset_name}.pkl')
-        #         if isfile(fpath):
-        #             with open(fpath, 'rb') as f:
-        #                 setattr(self, dataset_name, cPickle.load(f))
-        #         else:
-        #             raise FileNotFoundError(f'Attempting to load {path(fpath)} since {code("refresh_data")} is set to False, but the file does not exist')
-
-        #     self.logger.info(f'Loaded iMessage data extract from {path(dpath)}', arrow='black')
-
-        # else:
-        #     # Just extract data as usual
-        #     self.logger.info(f'{code("refresh_data")} is set to False, but no data extract files were found in {path(dpath)}, extracting data as normal', arrow='black')
-        #     self.extract_data()
-        #     self.save_data_extract(dpath)
+            self.unload_datasets()
+            self.from_extract = True
+            self.extract_version = 0
+            if isfile(get_extract_version_fpath()):
+                with open(get_extract_version_fpath()) as f:
+                    self.extract_version = json.load(f)['snapshot_version']
+
+            self.logger.info(f'Loading iMessage data extract from {path(get_extract_dpath())}', arrow='black')
@@ -0,0 +1,31 @@
+import pandas as pd
+import pyarrow as pa
+
+
+def write_extract_dataset(dataset: pd.DataFrame, fpath: str) -> None:
+    """
+    Write a dataset to an uncompressed Arrow IPC file, which can be memory-mapped
+    when it is read back. The dataset's index and dtypes (i.e. categoricals and nullable
+    integers) are stored in the file's pandas metadata.
+    """
+    table = pa.Table.from_pandas(dataset)
+    with pa.OSFile(fpath, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+def read_extract_dataset(fpath: str, columns: list=None) -> pd.DataFrame:
+    """
+    Read a dataset written by `write_extract_dataset()`, with the index and dtypes it was
+    written with. The file is memory-mapped, so only the columns that are read (all of
+    them, unless `columns` is given, along with the index columns) are paged in and
+    converted to pandas.
+    """
+    with pa.memory_map(fpath, 'r') as source:
+        table = pa.ipc.open_file(source).read_all()
+
+    if columns is not None:
+        index_columns = [x for x in (table.schema.pandas_metadata or {}).get('index_columns', []) if isinstance(x, str)]
+        table = table.select(index_columns + [x for x in columns if x not in index_columns])
+
+    return table.to_pandas(split_blocks=True)
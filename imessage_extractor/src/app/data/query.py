@@ -0,0 +1,176 @@
+import datetime
+import pandas as pd
+import sqlite3
+import typing
+from imessage_extractor.src.helpers.utils import ensurelist, sqlite_uri
+from imessage_extractor.src.helpers.verbosity import code
+
+
+# Expressions that truncate a 'YYYY-MM-DD' date to the start of its period, matching the
+# labels of the pandas resample rules previously used by the app ('W-SUN', 'MS', 'AS'). A
+# week is labeled by the Sunday it ends on
+dt_gran_sql = {
+    'Day': 'dt',
+    'Week': "date(dt, 'weekday 0')",
+    'Month': "date(dt, 'start of month')",
+    'Year': "date(dt, 'start of year')",
+}
+
+# Periods of each date granularity, labeled as in `dt_gran_sql`
+dt_gran_offsets = {
+    'Day': pd.offsets.Day(),
+    'Week': pd.offsets.Week(weekday=6),
+    'Month': pd.offsets.MonthBegin(),
+    'Year': pd.offsets.YearBegin(),
+}
+
+# Columns of daily summaries that identify a row rather than count messages
+dimension_columns = ['dt', 'contact_name', 'is_from_me']
+
+
+def to_dt_str(dt: typing.Union[datetime.date, str]) -> str:
+    """
+    Format a date as stored in the output database, i.e. 'YYYY-MM-DD'.
+    """
+    return pd.to_datetime(dt).strftime('%Y-%m-%d')
+
+
+def fill_empty_periods(df: pd.DataFrame, dt_gran: str, by: list) -> pd.DataFrame:
+    """
+    Add a row of zeros for each `dt_gran` period without messages between the first and
+    last period of each combination of the `by` columns, as a pandas resample of the daily
+    summary would, so that charts show a gap in messages as zero rather than skipping it.
+    """
+    if not len(df):
+        return df
+
+    measures = [x for x in df.columns if x != 'dt' and x not in by]
+    dtypes = df[measures].dtypes.to_dict()
+
+    if len(by):
+        bounds = df.groupby(by, dropna=False)['dt'].agg(['min', 'max']).reset_index()
+        periods = pd.concat([
+            pd.DataFrame(dict(dt=pd.date_range(row['min'], row['max'], freq=dt_gran_offsets[dt_gran]), **{x: row[x] for x in by}))
+            for _, row in bounds.iterrows()
+        ])
+    else:
+        periods = pd.DataFrame(dict(dt=pd.date_range(df['dt'].min(), df['dt'].max(), freq=dt_gran_offsets[dt_gran])))
+
+    df = periods[['dt'] + by].merge(df, on=['dt'] + by, how='left')
+    df[measures] = df[measures].fillna(0).astype(dtypes)
+    return df.sort_values(['dt'] + by).reset_index(drop=True)
+
+
+class PageDataQuery(object):
+    """
+    Read page data from the imessage-extractor output database, with the page controls
+    (contact, date range, message types and date granularity) applied as parameterized
+    SQL, so only the rows a chart needs are read into memory.
+    """
+    def __init__(self, db_fpath: str) -> None:
+        self.db_fpath = db_fpath
+        self.sqlite_con = sqlite3.connect(sqlite_uri(db_fpath, mode='ro'), uri=True, check_same_thread=False)
+        self.table_columns = {}
+
+    def list_columns(self, table_name: str) -> list:
+        """
+        List the columns of a table or view.
+        """
+        if table_name not in self.table_columns:
+            cursor = self.sqlite_con.execute(f'SELECT * FROM `{table_name}` LIMIT 0')
+            self.table_columns[table_name] = [x[0] for x in cursor.description]
+
+        return self.table_columns[table_name]
+
+    def count_expression(self, table_name: str, include_type_columns: list) -> str:
+        """
+        Return a SQL expression summing the message type columns selected in the page
+        controls, which must be columns of `table_name`.
+        """
+        unknown = [x for x in include_type_columns if x not in self.list_columns(table_name)]
+        if len(unknown):
+            raise ValueError(f'Message type column(s) {unknown} not found in {code(table_name)}')
+
+        if not len(include_type_columns):
+            return '0'
+
+        return ' + '.join(f'coalesce(`{x}`, 0)' for x in include_type_columns)
+
+    def read(self, sql: str, params: list) -> pd.DataFrame:
+        """
+        Execute a parameterized query, parsing `dt` as a date if selected.
+        """
+        df = pd.read_sql(sql, self.sqlite_con, params=params)
+        if 'dt' in df.columns:
+            df['dt'] = pd.to_datetime(df['dt'])
+
+        return df
+
+    def date_range(self, table_name: str, contact_name: str=None) -> tuple:
+        """
+        Return the first and last `dt` in a daily summary, optionally for one contact.
+        """
+        where, params = ('WHERE contact_name = ?', [contact_name]) if contact_name is not None else ('', [])
+        first_dt, last_dt = self.sqlite_con.execute(f'SELECT min(dt), max(dt) FROM `{table_name}` {where}', params).fetchone()
+        return pd.to_datetime(first_dt), pd.to_datetime(last_dt)
+
+    def summary(self, table_name: str, include_type_columns: list, contact_name: str=None) -> pd.DataFrame:
+        """
+        Read a summary, optionally for one contact, with a `display_message_count` column
+        summing the selected message types.
+        """
+        where, params = ('WHERE contact_name = ?', [contact_name]) if contact_name is not None else ('', [])
+        count_expr = self.count_expression(table_name, include_type_columns)
+        return self.read(f'SELECT *, {count_expr} AS display_message_count FROM `{table_name}` {where}', params)
+
+    def daily_summary(self,
+                      table_name: str,
+                      filter_start_dt: datetime.date,
+                      filter_stop_dt: datetime.date,
+                      include_type_columns: list,
+                      dt_gran: str='Day',
+                      by: typing.Union[str, list]=None,
+                      contact_name: str=None) -> pd.DataFrame:
+        """
+        Read a daily summary between two dates (inclusive), optionally for one contact,
+        summed to `dt_gran` periods for each combination of the `by` columns, with a
+        `display_message_count` column summing the selected message types. Periods without
+        messages are filled with zeros.
+        """
+        assert dt_gran in dt_gran_sql, f'Invalid date granularity: {dt_gran}'
+
+        by = [x for x in ensurelist(by) if x is not None]
+        columns = self.list_columns(table_name)
+        measures = [x for x in columns if x not in dimension_columns]
+        dt_expr = dt_gran_sql[dt_gran]
+        count_expr = self.count_expression(table_name, include_type_columns)
+
+        select_list = [f'{dt_expr} AS dt'] + [f'`{x}`' for x in by] + [f'sum(`{x}`) AS `{x}`' for x in measures]
+        select_list.append(f'sum({count_expr}) AS display_message_count')
+
+        where = ['dt >= ?', 'dt <= ?']
+        params = [to_dt_str(filter_start_dt), to_dt_str(filter_stop_dt)]
+        if contact_name is not None:
+            where.append('contact_name = ?')
+            params.append(contact_name)
+
+        group_by = ', '.join([dt_expr] + [f'`{x}`' for x in by])
+        sql = f"""
+        SELECT {', '.join(select_list)}
+        FROM `{table_name}`
+        WHERE {' AND '.join(where)}
+        GROUP BY {group_by}
+        ORDER BY {group_by}
+        """
+        return fill_empty_periods(self.read(sql, params), dt_gran, by)
+
+    def top_tokens(self, table_name: str, is_from_me: bool, contact_name: str=None) -> pd.DataFrame:
+        """
+        Read the most used tokens, already cleaned and without stopwords, in messages from
+        me or from them, with one contact or (if `contact_name` is None) all contacts.
+        """
+        sql = f'SELECT token, usages FROM `{table_name}` WHERE contact_name IS ? AND is_from_me = ? ORDER BY `rank`'
+        return self.read(sql, [contact_name, int(is_from_me)])
+
+    def close(self) -> None:
+        self.sqlite_con.close()
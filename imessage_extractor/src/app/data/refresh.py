@@ -0,0 +1,168 @@
+import collections
+import logging
+import re
+import shutil
+import streamlit as st
+import subprocess
+import threading
+import time
+from imessage_extractor.src.helpers.verbosity import code
+from os import remove, replace
+from os.path import isfile
+
+
+# Section headings logged by `imessage-extractor go`, in order, used to report the
+# progress of a refresh
+pipeline_stages = [
+    'Configure Workflow',
+    'Refresh Contacts',
+    'Establish Database Connections',
+    'Copy Source Data to Target',
+    'Build Static Tables',
+    'Staging Tables and Views',
+    'Quality Control',
+]
+
+ansi_escape = re.compile(r'\x1b\[[0-9;]*m')
+
+# Format of lines logged by logger_setup(), i.e. '<asctime> : <levelname> : <name> :<message>'
+log_line_pattern = re.compile(r'^.+? : [A-Z]+ : .+? :\s?(.*)$')
+
+
+def parse_log_line(line: str) -> tuple:
+    """
+    Parse a line logged by the imessage-extractor workflow into its message, without
+    terminal styling, and whether it is a section heading (logged in bold).
+    """
+    match = log_line_pattern.match(line.rstrip('\n'))
+    message = match.group(1) if match is not None else line.rstrip('\n')
+    is_heading = message.startswith('\x1b[1m')
+    return ansi_escape.sub('', message).strip(), is_heading
+
+
+class RefreshWorker(object):
+    """
+    Refresh the imessage-extractor output database in a background thread. The workflow
+    writes to a copy of the output database, updated incrementally, so the current one can
+    be read until `swap()` atomically replaces it with the copy. Stage progress is parsed
+    from the workflow's log as it runs.
+    """
+    def __init__(self, chatdb_fpath: str, db_fpath: str, logger: logging.Logger) -> None:
+        self.chatdb_fpath = chatdb_fpath
+        self.db_fpath = db_fpath
+        self.refresh_db_fpath = db_fpath + '.refresh'
+        self.logger = logger
+        self.stage = None
+        self.message = ''
+        self.lines = collections.deque(maxlen=100)
+        self.returncode = None
+        self.error = None
+        self.start_ts = None
+        self.thread = threading.Thread(target=self.run, name='imessage-extractor-refresh', daemon=True)
+
+    def start(self) -> 'RefreshWorker':
+        self.start_ts = time.time()
+        self.thread.start()
+        return self
+
+    def run(self) -> None:
+        """
+        Run `imessage-extractor go` against the refresh copy of the output database. A
+        refresh copy left without an output database to replace (i.e. a refresh that
+        succeeded but was never swapped in) is refreshed incrementally rather than removed.
+        """
+        try:
+            cmd = ['imessage-extractor', 'go', '--chatdb-path', self.chatdb_fpath, '--output-db-path', self.refresh_db_fpath, '-v']
+            if isfile(self.db_fpath):
+                shutil.copyfile(self.db_fpath, self.refresh_db_fpath)
+                cmd.append('--incremental')
+            elif isfile(self.refresh_db_fpath):
+                cmd.append('--incremental')
+
+            self.logger.info(f'Running {code("imessage-extractor")} workflow in the background', arrow='black')
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+            for line in process.stdout:
+                self.read_line(line)
+
+            self.returncode = process.wait()
+            if self.returncode != 0:
+                self.error = '\n'.join(list(self.lines)[-10:])
+
+        except Exception as e:
+            self.error = str(e)
+            self.returncode = -1
+
+        if self.error is not None:
+            self.logger.error(f'Refresh failed, current data is kept: {self.error}')
+            if isfile(self.refresh_db_fpath):
+                remove(self.refresh_db_fpath)
+
+    def read_line(self, line: str) -> None:
+        """
+        Record a line logged by the workflow, updating the current stage on headings.
+        """
+        message, is_heading = parse_log_line(line)
+        if not len(message):
+            return
+
+        if is_heading and message in pipeline_stages:
+            self.stage = message
+
+        self.message = message
+        self.lines.append(message)
+
+    @property
+    def running(self) -> bool:
+        return self.thread.is_alive()
+
+    @property
+    def done(self) -> bool:
+        return self.returncode is not None and not self.running
+
+    @property
+    def succeeded(self) -> bool:
+        return self.done and self.returncode == 0
+
+    @property
+    def progress(self) -> float:
+        """
+        Fraction of workflow stages started so far.
+        """
+        if self.succeeded:
+            return 1.0
+        elif self.stage is None:
+            return 0.0
+        else:
+            return (pipeline_stages.index(self.stage) + 1) / (len(pipeline_stages) + 1)
+
+    def swap(self) -> None:
+        """
+        Replace the output database with the refreshed one. Connections already open to
+        the output database keep reading the file they opened until they are closed.
+        """
+        assert self.succeeded, 'Refresh has not completed successfully'
+        replace(self.refresh_db_fpath, self.db_fpath)
+
+
+def write_refresh_progress(worker: 'RefreshWorker', interval: float=0.5) -> bool:
+    """
+    Show a snapshot of the progress of a refresh, and return whether it has finished.
+    While it runs, the script is rerun after `interval` seconds to show the next snapshot,
+    so the refresh never blocks the script. A rerun that does not show the progress (e.g.
+    navigating to another page) stops updating it, but not the refresh.
+    """
+    progress_bar = st.progress(worker.progress)
+    status_text = st.empty()
+
+    if not worker.done:
+        elapsed = int(time.time() - worker.start_ts)
+        status_text.markdown(f'Refreshing iMessage data ({elapsed}s): **{worker.stage or "Starting"}**, {worker.message}')
+        time.sleep(interval)
+        st.experimental_rerun()
+
+    if worker.succeeded:
+        status_text.markdown('Refreshed iMessage data')
+    else:
+        status_text.error(f'Refresh failed, current data is kept:\n\n{worker.error}')
+
+    return worker.done
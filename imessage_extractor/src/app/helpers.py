@@ -1,7 +1,8 @@
 import logging
 import datetime
 import humanize
-from os.path import isfile, join, expanduser
+import pandas as pd
+from os.path import isdir, join, expanduser
 from send2trash import send2trash
 
 
@@ -74,11 +75,34 @@ def get_db_fpath() -> str:
     return join(get_tmp_dpath(), 'imessage_extractor.db')
 
 
-def get_extract_fpath() -> str:
+def get_extract_dpath() -> str:
     """
-    Define the expected filepath.
+    Define the expected directory of the data extract, which holds one Arrow IPC file per
+    dataset.
     """
-    return join(get_tmp_dpath(), 'imessage_visualizer_extract.pkl')
+    return join(get_tmp_dpath(), 'imessage_visualizer_extract')
+
+
+def get_extract_dataset_fpath(dataset_name: str, dpath: str=None) -> str:
+    """
+    Define the expected filepath of a dataset in the data extract.
+    """
+    return join(dpath or get_extract_dpath(), f'{dataset_name}.arrow')
+
+
+def get_extract_version_fpath(dpath: str=None) -> str:
+    """
+    Define the expected filepath of the data extract's snapshot version, i.e. the
+    modification time of the output database its datasets were read from.
+    """
+    return join(dpath or get_extract_dpath(), 'snapshot_version.json')
+
+
+def get_wordcloud_dpath() -> str:
+    """
+    Define the directory of rendered wordcloud PNGs, cached by content.
+    """
+    return join(get_tmp_dpath(), 'wordclouds')
 
 
 def extract_exists() -> bool:
@@ -86,7 +110,7 @@ def extract_exists() -> bool:
     Check whether an iMessage Visualizer extract already exists. It should always be
     at the same file location.
     """
-    return isfile(get_extract_fpath())
+    return isdir(get_extract_dpath())
 
 
 def remove_extract(logger: logging.Logger) -> None:
@@ -94,5 +118,17 @@ def remove_extract(logger: logging.Logger) -> None:
     Remove iMessage Visualizer extract if it exists.
     """
     if extract_exists():
-        send2trash(get_extract_fpath())
-        logger.info('Deleted old data extract .pkl', arrow='black')
+        send2trash(get_extract_dpath())
+        logger.info('Deleted old data extract', arrow='black')
+
+
+def xs(df: pd.DataFrame, key, level: str, drop_level: bool=True) -> pd.DataFrame:
+    """
+    Select the rows of `df` whose index `level` equals `key`, like DataFrame.xs(), but
+    return an empty dataframe rather than raising a KeyError if there are none.
+    """
+    try:
+        return df.xs(key, level=level, drop_level=drop_level)
+    except KeyError:
+        empty = df.iloc[0:0]
+        return empty.droplevel(level) if drop_level else empty
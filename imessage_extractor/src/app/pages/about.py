@@ -5,6 +5,10 @@ import logging
 from os.path import join, dirname
 
 
+# Datasets in manifest.json read by this page
+datasets = {}
+
+
 # pylint: disable=line-too-long
 def write(data: 'iMessageDataExtract', logger: logging.Logger) -> None:
     """
@@ -2,13 +2,20 @@ import humanize
 import logging
 import streamlit as st
 from imessage_extractor.src.app.data.extract import iMessageDataExtract
-from imessage_extractor.src.app.helpers import to_date_str, remove_extract
+from imessage_extractor.src.app.data.refresh import write_refresh_progress
+from imessage_extractor.src.app.helpers import to_date_str
 from imessage_extractor.src.helpers.verbosity import code
 from os.path import dirname, join
 
 
 root_dir = dirname(dirname(dirname(dirname(dirname(__file__)))))
 
+# Datasets in manifest.json read by this page, with the columns it reads besides their
+# index (None for all of them)
+datasets = {
+    'message_user': ['ts', 'dt'],
+}
+
 
 def write(data: 'iMessageDataExtract', logger: logging.Logger) -> None:
     """
@@ -43,14 +50,21 @@ def write(data: 'iMessageDataExtract', logger: logging.Logger) -> None:
 
     def refresh_app_data():
         """
-        Remove the existing extract and completely re-extract data from the original chat.db.
+        Re-extract data from the original chat.db in the background. The current data is
+        shown until the refresh finishes.
         """
-        remove_extract(logger=logger)
-        st.session_state.chatdb_fpath = chatdb_fpath  # To make sure iMessageDataExtract is re-initialized pointing to this chat.db path
+        st.session_state.chatdb_fpath = chatdb_fpath  # To make sure the refresh reads this chat.db path
+        data.extract_data(wait=False, restart=True)
+
 
+    st.button(label='Refresh', help='Refreshes your iMessage data.', on_click=refresh_app_data)
 
-    if st.button(label='Refresh', help='Refreshes your iMessage data.', on_click=refresh_app_data):
-        pass
+    if data.refresh_worker is not None:
+        # Reruns the page until the refresh finishes
+        write_refresh_progress(data.refresh_worker)
+        if data.refresh_worker.succeeded:
+            # Rerun so the app swaps in the refreshed data
+            st.experimental_rerun()
 
 
     logger.info('Done', arrow='black')
@@ -6,125 +6,59 @@ import numpy as np
 import pandas as pd
 import plotly.express as px
 import streamlit as st
-import stylecloud
 from imessage_extractor.src.app.color_theme import iMessageVisualizerColors
 from imessage_extractor.src.app.data.extract import iMessageDataExtract
 from imessage_extractor.src.app.helpers import intword, csstext
 from imessage_extractor.src.app.helpers import to_date_str
+from imessage_extractor.src.app.wordclouds import get_wordclouds
 from imessage_extractor.src.helpers.utils import strip_ws
 from imessage_extractor.src.helpers.verbosity import code
 from nltk.corpus import stopwords
-from os import remove
-from os.path import dirname, join, isfile
+from os.path import dirname, join
 
 
 root_dir = dirname(dirname(dirname(dirname(dirname(__file__)))))
-color = iMessageVisualizerColors()
-
-
-def pull_page_data(data) -> dict:
-    """
-    Pull necessary data for the My Stats page.
-    """
-    pdata = {}
 
-    pdata['daily_summary'] = data.daily_summary_vw
-    pdata['daily_summary_from_who'] = data.daily_summary_from_who_vw
-    pdata['daily_summary_contact_from_who'] = data.daily_summary_contact_from_who_vw
-
-    pdata['daily_summary']['dt'] = pd.to_datetime(pdata['daily_summary']['dt'])
-    pdata['daily_summary_from_who']['dt'] = pd.to_datetime(pdata['daily_summary_from_who']['dt'])
-    pdata['daily_summary_contact_from_who']['dt'] = pd.to_datetime(pdata['daily_summary_contact_from_who']['dt'])
-
-    return pdata
-
-
-def filter_page_data(pdata: dict, filter_start_dt: datetime.datetime, filter_stop_dt: datetime.datetime) -> dict:
-    """
-    Apply controls filters to page data.
-    """
-    pdata['daily_summary'] = (
-        pdata['daily_summary']
-        .loc[
-            (pdata['daily_summary']['dt'] >= pd.to_datetime(filter_start_dt))
-            & (pdata['daily_summary']['dt'] <= pd.to_datetime(filter_stop_dt))
-        ]
-    )
-
-    if len(pdata['daily_summary']) == 0:
-        raise ValueError('Dataframe `daily_summary` has no records, there must be a mistake!')
-
-    pdata['daily_summary_from_who'] = (
-        pdata['daily_summary_from_who']
-        .loc[
-            (pdata['daily_summary_from_who']['dt'] >= pd.to_datetime(filter_start_dt))
-            & (pdata['daily_summary_from_who']['dt'] <= pd.to_datetime(filter_stop_dt))
-        ]
-    )
-
-    if len(pdata['daily_summary_from_who']) == 0:
-        raise ValueError('Dataframe `daily_summary_from_who` has no records, there must be a mistake!')
-
-    pdata['daily_summary_contact_from_who'] = (
-        pdata['daily_summary_contact_from_who']
-        .loc[
-            (pdata['daily_summary_contact_from_who']['dt'] >= pd.to_datetime(filter_start_dt))
-            & (pdata['daily_summary_contact_from_who']['dt'] <= pd.to_datetime(filter_stop_dt))
-        ]
-    )
-
-    if len(pdata['daily_summary_contact_from_who']) == 0:
-        raise ValueError('Dataframe `daily_summary_contact_from_who` has no records, there must be a mistake!')
-
-    return pdata
+# Datasets in manifest.json read by this page, with the columns it reads besides their
+# index (None for all of them)
+datasets = {
+    'summary_vw': ['imessages', 'sms'],
+    'summary_contact_from_who_vw': ['contact_name', 'sms'],
+    'contact_group_chat_map_vw': None,
+    'message_user': ['ts', 'dt', 'is_from_me', 'is_emote', 'message_special_type'],
+}
+color = iMessageVisualizerColors()
 
 
-def resample_page_data(pdata: dict, dt_gran: str) -> pd.DataFrame:
+def query_page_data(data: 'iMessageDataExtract',
+                    filter_start_dt: datetime.datetime,
+                    filter_stop_dt: datetime.datetime,
+                    dt_gran: str,
+                    include_type_columns: list) -> dict:
     """
-    Resample page dataframes based on selected date granularity.
+    Query page data for the selected dates and message types. Each daily summary is also
+    read summed by the selected date granularity, as '*_resample'. Filters and aggregations
+    run in SQL against the output database.
     """
-    assert dt_gran in ['Day', 'Week', 'Month', 'Year'], f'Invalid date granularity: {dt_gran}'
-
-    if dt_gran == 'Day':
-        pdata['summary_resample'] = pdata['daily_summary']
-        pdata['summary_from_who_resample'] = pdata['daily_summary_from_who']
-        return pdata
-
-    # Must apply some resampling
+    def query_daily_summaries(gran: str) -> tuple:
+        dt_range = dict(filter_start_dt=filter_start_dt, filter_stop_dt=filter_stop_dt, include_type_columns=include_type_columns, dt_gran=gran)
+        return (
+            data.query.daily_summary('daily_summary_vw', **dt_range),
+            data.query.daily_summary('daily_summary_from_who_vw', by='is_from_me', **dt_range),
+            data.query.daily_summary('daily_summary_contact_from_who_vw', by=['contact_name', 'is_from_me'], **dt_range),
+        )
 
-    elif dt_gran == 'Week':
-        resample_identifier = 'W-SUN'
+    pdata = {}
 
-    elif dt_gran == 'Month':
-        resample_identifier = 'MS'
+    daily_summaries = query_daily_summaries('Day')
+    pdata['daily_summary'], pdata['daily_summary_from_who'], pdata['daily_summary_contact_from_who'] = daily_summaries
 
-    elif dt_gran == 'Year':
-        resample_identifier = 'AS'
-
-    pdata['summary_resample'] = pdata['daily_summary'].set_index('dt').resample(resample_identifier).sum().reset_index()
-
-    pdata['summary_from_who_resample'] = (
-        pdata['daily_summary_from_who']
-        .set_index(['is_from_me', 'dt'])
-        .groupby([
-            pdata['daily_summary_from_who'].set_index(['is_from_me', 'dt']).index.get_level_values('is_from_me'),
-            pd.Grouper(freq=resample_identifier, level=1),
-        ])
-        .sum()
-        .reset_index()
-    )
+    for name in ['daily_summary', 'daily_summary_from_who', 'daily_summary_contact_from_who']:
+        if len(pdata[name]) == 0:
+            raise ValueError(f'Dataframe `{name}` has no records, there must be a mistake!')
 
-    pdata['summary_contact_from_who_resample'] = (
-        pdata['daily_summary_contact_from_who']
-        .set_index(['contact_name', 'is_from_me', 'dt'])
-        .groupby([
-            pdata['daily_summary_contact_from_who'].set_index(['contact_name', 'is_from_me', 'dt']).index.get_level_values('contact_name'),
-            pdata['daily_summary_contact_from_who'].set_index(['contact_name', 'is_from_me', 'dt']).index.get_level_values('is_from_me'),
-            pd.Grouper(freq=resample_identifier, level=2),
-        ])
-        .sum()
-        .reset_index()
-    )
+    resampled = daily_summaries if dt_gran == 'Day' else query_daily_summaries(dt_gran)
+    pdata['summary_resample'], pdata['summary_from_who_resample'], pdata['summary_contact_from_who_resample'] = resampled
 
     return pdata
 
@@ -176,7 +110,7 @@ def adaptive_date_input(use_exact_dates: bool, first_message_dt: datetime.dateti
     return filter_start_dt, filter_stop_dt
 
 
-def message_type_input(pdata: dict) -> list:
+def message_type_input() -> list:
     """
     Add message type filter.
     """
@@ -383,59 +317,28 @@ class Visuals(object):
             st.markdown(csstext(intword(total_tokens), cls='large-text-green-center'), unsafe_allow_html=True)
 
         def wordcloud_word_volume():
-            # Pull data
-            df_word_counts = (
-                self.data.contact_token_usage_from_who_vw
-                .loc[self.data.contact_token_usage_from_who_vw['is_from_me'] == 1]
-                [['token', 'usages']]
-                .groupby('token')
-                .sum()
-                .sort_values('usages', ascending=False)
-                .reset_index()
-            )
-
-            # Filter stopwords and punctuation
-            df_word_counts['token'] = df_word_counts['token'].str.lower()
-            df_word_counts['token'] = (
-                df_word_counts['token']
-                .str.replace(r'[^\w\s]+', '', regex=True)
-                .str.replace(r'^(s|d)$', '', regex=True)
-            )
-            df_word_counts = df_word_counts.loc[df_word_counts['token'] > '']
-
-            expected_stylecloud_fpath = 'stylecloud_my_stats.png'
+            # Pull data, cleaned and with stopwords removed in staging
+            df_word_counts = self.data.query.top_tokens('wordcloud_token_usage', is_from_me=True)
 
-            tmp_wordcloud_fpath = 'tmp_imessage_extractor_app_pick_a_contact_wordcloud.csv'
-            (
-                df_word_counts
-                [['token', 'usages']]
-                .to_csv(tmp_wordcloud_fpath, index=False)
-            )
+            wordcloud_style = dict(icon_name='fas fa-comment',
+                                   colors=[color.imessage_green, '#a6e0a6', '#dcecdc', '#ffffff'],
+                                   background_color=color.background_main,
+                                   gradient='horizontal',
+                                   max_words=500,
+                                   stopwords=True,
+                                   custom_stopwords=self.data.lst_contractions_wo_apostrophe + stopwords.words('english'),
+                                   size=(1024, 800))
 
-            icon_name = 'fas fa-comment'
-
-            stylecloud.gen_stylecloud(file_path=tmp_wordcloud_fpath,
-                                        icon_name=icon_name,
-                                        colors=[color.imessage_green, '#a6e0a6', '#dcecdc', '#ffffff'],
-                                        background_color=color.background_main,
-                                        output_name=expected_stylecloud_fpath,
-                                        gradient='horizontal',
-                                        max_words=500,
-                                        stopwords=True,
-                                        custom_stopwords=self.data.lst_contractions_wo_apostrophe + stopwords.words('english'),
-                                        size=(1024, 800),)
+            # Rendered only if these word counts have not been rendered before
+            stylecloud_fpath, = get_wordclouds([df_word_counts], style=wordcloud_style, logger=self.data.logger)
 
             st.markdown("Here's a wordcloud of the most common words (excluding stopwords) used by me:")
 
-            if isfile(expected_stylecloud_fpath):
-                st.image(expected_stylecloud_fpath)
-                remove(expected_stylecloud_fpath)
+            if stylecloud_fpath is not None:
+                st.image(stylecloud_fpath)
             else:
                 st.markdown(csstext('Wordcloud not available 😔', cls='medium-text-center'), unsafe_allow_html=True)
 
-            if isfile(tmp_wordcloud_fpath):
-                remove(tmp_wordcloud_fpath)
-
 
         st.markdown(csstext('Words', cls='medium-text-bold', header=True), unsafe_allow_html=True)
 
@@ -571,7 +474,7 @@ class Visuals(object):
                     (self.data.message_user.reset_index()['is_from_me'] == 1)
                     & (self.data.message_user.reset_index()['is_emote'] == 1)
                 ]
-                .groupby(['is_from_me', 'message_special_type'])
+                .groupby(['is_from_me', 'message_special_type'], observed=True)
                 .agg({'message_id': 'count'})
                 .reset_index()
                 .rename(columns={'message_id': 'count', 'message_special_type': 'tapback'})
@@ -1008,9 +911,6 @@ def write(data: 'iMessageDataExtract', logger: logging.Logger) -> None:
     # Page preparation
     #
 
-    # Pull page data
-    pdata = pull_page_data(data)
-
     # Add date granularity selection
     dt_options = ['Day', 'Week', 'Month', 'Year']
     dt_gran = st.selectbox(
@@ -1021,8 +921,7 @@ def write(data: 'iMessageDataExtract', logger: logging.Logger) -> None:
     )
 
     # Get max and min message dates
-    first_message_dt = pdata['daily_summary']['dt'].min()
-    last_message_dt = pdata['daily_summary']['dt'].max()
+    first_message_dt, last_message_dt = data.query.date_range('daily_summary_vw')
 
     # Add filters now that first and last message dates are known
     use_exact_dates = st.checkbox(
@@ -1034,20 +933,18 @@ def write(data: 'iMessageDataExtract', logger: logging.Logger) -> None:
     # Create adaptive date input
     filter_start_dt, filter_stop_dt = adaptive_date_input(use_exact_dates, first_message_dt, last_message_dt)
 
-    # Filter page data
-    pdata = filter_page_data(pdata, filter_start_dt, filter_stop_dt)
-
     # Add control for types of messages to display
-    selected_include_type_columns = message_type_input(pdata)
+    selected_include_type_columns = message_type_input()
 
-    # Add column that reflects sum of selected message types
+    # Query page data for the selected dates and message types. The sum of selected message
+    # types is column `count_col`. Page data is cached, so reruns with the same
+    # controls are not queried again
     count_col = 'display_message_count'
-    pdata['daily_summary'][count_col] = pdata['daily_summary'][selected_include_type_columns].sum(axis=1)
-    pdata['daily_summary_from_who'][count_col] = pdata['daily_summary_from_who'][selected_include_type_columns].sum(axis=1)
-    pdata['daily_summary_contact_from_who'][count_col] = pdata['daily_summary_contact_from_who'][selected_include_type_columns].sum(axis=1)
-
-    # Add a dataframe called 'summary_resample' to page data dictionary based on selected date granularity
-    pdata = resample_page_data(pdata, dt_gran)
+    pdata = data.page_data(query_page_data,
+                           filter_start_dt=filter_start_dt,
+                           filter_stop_dt=filter_stop_dt,
+                           dt_gran=dt_gran,
+                           include_type_columns=selected_include_type_columns)
 
     # Clean up variables not used in the rest of the function
     del dt_options, use_exact_dates, selected_include_type_columns
@@ -6,130 +6,63 @@ import numpy as np
 import pandas as pd
 import plotly.express as px
 import streamlit as st
-import stylecloud
 from imessage_extractor.src.app.color_theme import iMessageVisualizerColors
 from imessage_extractor.src.app.data.extract import iMessageDataExtract
 from imessage_extractor.src.app.helpers import intword, csstext
-from imessage_extractor.src.app.helpers import to_date_str
+from imessage_extractor.src.app.helpers import to_date_str, xs
+from imessage_extractor.src.app.wordclouds import get_wordclouds
 from imessage_extractor.src.helpers.utils import strip_ws
 from imessage_extractor.src.helpers.verbosity import code
 from nltk.corpus import stopwords
-from os import remove
-from os.path import dirname, join, isfile
+from os.path import dirname, join
 
 
 root_dir = dirname(dirname(dirname(dirname(dirname(dirname(__file__))))))
 color = iMessageVisualizerColors()
 
+# Datasets in manifest.json read by this page, with the columns it reads besides their
+# index (None for all of them)
+datasets = {
+    'message_user': ['contact_name', 'chat_identifier', 'is_group_chat', 'is_from_me', 'is_emote', 'message_special_type'],
+    'contact_token_usage_from_who_vw': None,
+}
 
-def pull_page_data(data: 'iMessageDataExtract') -> dict:
+
+def query_page_data(data: 'iMessageDataExtract',
+                    filter_start_dt: datetime.datetime,
+                    filter_stop_dt: datetime.datetime,
+                    contact_name: str,
+                    dt_gran: str,
+                    include_type_columns: list) -> dict:
     """
-    Pull necessary data for the Pick a Contact page.
+    Query page data for the selected contact, dates and message types. Each daily summary
+    is also read summed by the selected date granularity, as '*_resample'. Filters and
+    aggregations run in SQL against the output database.
     """
-    pdata = {}
-
-    pdata['summary'] = data.summary_contact_vw
-    pdata['summary_from_who'] = data.summary_contact_from_who_vw
-
-    pdata['daily_summary'] = data.daily_summary_contact_vw  # Will get filtered for contact
-    pdata['daily_summary_all_contacts'] = data.daily_summary_contact_vw  # Will not get filtered for contact
-    pdata['daily_summary_from_who'] = data.daily_summary_contact_from_who_vw
-
-    pdata['daily_summary']['dt'] = pd.to_datetime(pdata['daily_summary']['dt'])
-    pdata['daily_summary_all_contacts']['dt'] = pd.to_datetime(pdata['daily_summary_all_contacts']['dt'])
-    pdata['daily_summary_from_who']['dt'] = pd.to_datetime(pdata['daily_summary_from_who']['dt'])
+    def query_daily_summaries(gran: str) -> tuple:
+        dt_range = dict(filter_start_dt=filter_start_dt, filter_stop_dt=filter_stop_dt, include_type_columns=include_type_columns, dt_gran=gran)
+        return (
+            data.query.daily_summary('daily_summary_contact_vw', by='contact_name', contact_name=contact_name, **dt_range),
+            data.query.daily_summary('daily_summary_contact_vw', by='contact_name', **dt_range),
+            data.query.daily_summary('daily_summary_contact_from_who_vw', by=['contact_name', 'is_from_me'], contact_name=contact_name, **dt_range),
+        )
 
-    return pdata
+    pdata = {}
 
+    pdata['summary'] = data.query.summary('summary_contact_vw', include_type_columns, contact_name=contact_name)
+    pdata['summary_from_who'] = data.query.summary('summary_contact_from_who_vw', include_type_columns, contact_name=contact_name)
 
-def filter_page_data(pdata: dict, filter_start_dt: datetime.datetime, filter_stop_dt: datetime.datetime, contact_name: str) -> dict:
-    """
-    Apply controls filters to page data.
-    """
-    pdata['summary'] = pdata['summary'].loc[pdata['summary']['contact_name'] == contact_name].copy()
-    pdata['summary_from_who'] = pdata['summary_from_who'].loc[pdata['summary_from_who']['contact_name'] == contact_name].copy()
-
-    pdata['daily_summary'] = (
-        pdata['daily_summary']
-        .loc[
-            (pdata['daily_summary']['contact_name'] == contact_name)
-            & (pdata['daily_summary']['dt'] >= pd.to_datetime(filter_start_dt))
-            & (pdata['daily_summary']['dt'] <= pd.to_datetime(filter_stop_dt))
-        ]
-    ).copy()
+    daily_summaries = query_daily_summaries('Day')
+    pdata['daily_summary'], pdata['daily_summary_all_contacts'], pdata['daily_summary_from_who'] = daily_summaries
 
     if len(pdata['daily_summary']) == 0:
         raise ValueError('Dataframe `daily_summary` has no records, there must be a mistake! Perhaps something went wrong with filtering the dataframe?')
 
-    pdata['daily_summary_all_contacts'] = (
-        pdata['daily_summary_all_contacts']
-        .loc[
-            (pdata['daily_summary_all_contacts']['dt'] >= pd.to_datetime(filter_start_dt))
-            & (pdata['daily_summary_all_contacts']['dt'] <= pd.to_datetime(filter_stop_dt))
-        ]
-    ).copy()
-
-    pdata['daily_summary_from_who'] = (
-        pdata['daily_summary_from_who']
-        .loc[
-            (pdata['daily_summary_from_who']['contact_name'] == contact_name)
-            & (pdata['daily_summary_from_who']['dt'] >= pd.to_datetime(filter_start_dt))
-            & (pdata['daily_summary_from_who']['dt'] <= pd.to_datetime(filter_stop_dt))
-        ]
-    ).copy()
-
     if len(pdata['daily_summary_from_who']) == 0:
         raise ValueError('Dataframe `daily_summary_from_who` has no records, there must be a mistake!')
 
-    return pdata
-
-
-def resample_page_data(pdata: dict, dt_gran: str) -> pd.DataFrame:
-    """
-    Resample page dataframes based on selected date granularity.
-    """
-    assert dt_gran in ['Day', 'Week', 'Month', 'Year'], f'Invalid date granularity: {dt_gran}'
-
-    if dt_gran == 'Day':
-        pdata['summary_resample'] = pdata['daily_summary']
-        pdata['summary_all_contacts_resample'] = pdata['daily_summary_all_contacts']
-        pdata['summary_from_who_resample'] = pdata['daily_summary_from_who']
-        return pdata
-
-    # Must apply some resampling
-
-    elif dt_gran == 'Week':
-        resample_identifier = 'W-SUN'
-
-    elif dt_gran == 'Month':
-        resample_identifier = 'MS'
-
-    elif dt_gran == 'Year':
-        resample_identifier = 'AS'
-
-    pdata['summary_resample'] = pdata['daily_summary'].set_index('dt').resample(resample_identifier).sum().reset_index()
-
-    pdata['summary_all_contacts_resample'] = (
-        pdata['daily_summary_all_contacts']
-        .set_index(['contact_name', 'dt'])
-        .groupby([
-            pdata['daily_summary_all_contacts'].set_index(['contact_name', 'dt']).index.get_level_values('contact_name'),
-            pd.Grouper(freq=resample_identifier, level=1),
-        ])
-        .sum()
-        .reset_index()
-    )
-
-    pdata['summary_from_who_resample'] = (
-        pdata['daily_summary_from_who']
-        .set_index(['is_from_me', 'dt'])
-        .groupby([
-            pdata['daily_summary_from_who'].set_index(['is_from_me', 'dt']).index.get_level_values('is_from_me'),
-            pd.Grouper(freq=resample_identifier, level=1),
-        ])
-        .sum()
-        .reset_index()
-    )
+    resampled = daily_summaries if dt_gran == 'Day' else query_daily_summaries(dt_gran)
+    pdata['summary_resample'], pdata['summary_all_contacts_resample'], pdata['summary_from_who_resample'] = resampled
 
     return pdata
 
@@ -192,7 +125,7 @@ def adaptive_date_input(use_exact_dates: bool, first_message_dt: datetime.dateti
     return filter_start_dt, filter_stop_dt
 
 
-def message_type_input(pdata: dict) -> list:
+def message_type_input() -> list:
     """
     Add message type filter.
     """
@@ -302,9 +235,6 @@ def write(data: 'iMessageDataExtract', logger: logging.Logger) -> None:
         help="Choose a contact you'd like to analyze data for!"
     )
 
-    # Pull page data
-    pdata = pull_page_data(data)
-
     # Add date granularity selection
     dt_options = ['Day', 'Week', 'Month', 'Year']
     dt_gran = st.selectbox(
@@ -315,8 +245,7 @@ def write(data: 'iMessageDataExtract', logger: logging.Logger) -> None:
     )
 
     # Get max and min message dates
-    first_message_dt = pdata['daily_summary']['dt'].min()
-    last_message_dt = pdata['daily_summary']['dt'].max()
+    first_message_dt, last_message_dt = data.query.date_range('daily_summary_contact_vw', contact_name=contact_name)
 
     # Add filters now that first and last message dates are known
     use_exact_dates = st.checkbox(
@@ -328,22 +257,19 @@ def write(data: 'iMessageDataExtract', logger: logging.Logger) -> None:
     # Create adaptive date input
     filter_start_dt, filter_stop_dt = adaptive_date_input(use_exact_dates, first_message_dt, last_message_dt)
 
-    # Filter page data
-    pdata = filter_page_data(pdata, filter_start_dt, filter_stop_dt, contact_name)
-
     # Add control for types of messages to display
-    selected_include_type_columns = message_type_input(pdata)
+    selected_include_type_columns = message_type_input()
 
-    # Add column that reflects sum of selected message types
+    # Query page data for the selected contact, dates and message types. The sum of selected
+    # message types is column `count_col`. Page data is cached, so reruns with the same
+    # controls are not queried again
     count_col = 'display_message_count'
-    pdata['summary'][count_col] = pdata['summary'][selected_include_type_columns].sum(axis=1)
-    pdata['summary_from_who'][count_col] = pdata['summary_from_who'][selected_include_type_columns].sum(axis=1)
-    pdata['daily_summary'][count_col] = pdata['daily_summary'][selected_include_type_columns].sum(axis=1)
-    pdata['daily_summary_all_contacts'][count_col] = pdata['daily_summary_all_contacts'][selected_include_type_columns].sum(axis=1)
-    pdata['daily_summary_from_who'][count_col] = pdata['daily_summary_from_who'][selected_include_type_columns].sum(axis=1)
-
-    # Add a dataframe called 'summary_resample' to page data dictionary based on selected date granularity
-    pdata = resample_page_data(pdata, dt_gran)
+    pdata = data.page_data(query_page_data,
+                           filter_start_dt=filter_start_dt,
+                           filter_stop_dt=filter_stop_dt,
+                           contact_name=contact_name,
+                           dt_gran=dt_gran,
+                           include_type_columns=selected_include_type_columns)
 
     # Clean up variables not used in the rest of the function
     del dt_options, use_exact_dates, selected_include_type_columns
@@ -538,100 +464,49 @@ def write(data: 'iMessageDataExtract', logger: logging.Logger) -> None:
                 st.markdown(csstext(intword(total), cls='large-text-green-center'), unsafe_allow_html=True)
 
             def wordcloud_word_volume():
-                # Pull data
-                df_word_counts = (
-                    self.data.contact_token_usage_from_who_vw
-                    .loc[self.data.contact_token_usage_from_who_vw['contact_name'] == self.contact_name]
-                    [['token', 'usages']]
-                    .groupby('token')
-                    .sum()
-                    .sort_values('usages', ascending=False)
-                    .reset_index()
+                # Pull data, cleaned and with stopwords removed in staging
+                df_word_counts_from_me = self.data.query.top_tokens('wordcloud_token_usage', is_from_me=True, contact_name=self.contact_name)
+                df_word_counts_from_them = self.data.query.top_tokens('wordcloud_token_usage', is_from_me=False, contact_name=self.contact_name)
+
+                wordcloud_style = dict(icon_name='fas fa-comment',
+                                       colors=[color.imessage_green, '#a6e0a6', '#dcecdc', '#ffffff'],
+                                       background_color=color.background_main,
+                                       gradient='horizontal',
+                                       max_words=500,
+                                       stopwords=True,
+                                       custom_stopwords=self.data.lst_contractions_wo_apostrophe + stopwords.words('english'),
+                                       size=(1024, 800))
+
+                # Both wordclouds are rendered in parallel, and only if their word counts
+                # have not been rendered before
+                stylecloud_from_me_fpath, stylecloud_from_them_fpath = get_wordclouds(
+                    [df_word_counts_from_me, df_word_counts_from_them],
+                    style=wordcloud_style,
+                    logger=self.data.logger,
                 )
 
-                # Filter stopwords and punctuation
-                df_word_counts['token'] = df_word_counts['token'].str.lower()
-                df_word_counts['token'] = (
-                    df_word_counts['token']
-                    .str.replace(r'[^\w\s]+', '', regex=True)
-                    .str.replace(r'^(s|d)$', '', regex=True)
-                )
-                df_word_counts = df_word_counts.loc[df_word_counts['token'] > '']
-
-                tmp_wordcloud_from_me_fpath = 'tmp_imessage_extractor_app_pick_a_contact_wordcloud_from_me.csv'
-                tmp_wordcloud_from_them_fpath = 'tmp_imessage_extractor_app_pick_a_contact_wordcloud_from_them.csv'
-
-                (
-                    df_word_counts
-                     .loc[self.data.contact_token_usage_from_who_vw['is_from_me'] == 1]
-                    [['token', 'usages']]
-                    .to_csv(tmp_wordcloud_from_me_fpath, index=False)
-                )
-
-                (
-                    df_word_counts
-                     .loc[self.data.contact_token_usage_from_who_vw['is_from_me'] == 0]
-                    [['token', 'usages']]
-                    .to_csv(tmp_wordcloud_from_them_fpath, index=False)
-                )
-
-                icon_name = 'fas fa-comment'
-                expected_stylecloud_from_me_fpath = 'stylecloud_pick_a_contact_from_me.png'
-                expected_stylecloud_from_them_fpath = 'stylecloud_pick_a_contact_from_them.png'
-
-                stylecloud.gen_stylecloud(file_path=tmp_wordcloud_from_me_fpath,
-                                          icon_name=icon_name,
-                                          colors=[color.imessage_green, '#a6e0a6', '#dcecdc', '#ffffff'],
-                                          background_color=color.background_main,
-                                          output_name=expected_stylecloud_from_me_fpath,
-                                          gradient='horizontal',
-                                          max_words=500,
-                                          stopwords=True,
-                                          custom_stopwords=self.data.lst_contractions_wo_apostrophe + stopwords.words('english'),
-                                          size=(1024, 800))
-
-                stylecloud.gen_stylecloud(file_path=tmp_wordcloud_from_them_fpath,
-                                          icon_name=icon_name,
-                                          colors=[color.imessage_green, '#a6e0a6', '#dcecdc', '#ffffff'],
-                                          background_color=color.background_main,
-                                          output_name=expected_stylecloud_from_them_fpath,
-                                          gradient='horizontal',
-                                          max_words=500,
-                                          stopwords=True,
-                                          custom_stopwords=self.data.lst_contractions_wo_apostrophe + stopwords.words('english'),
-                                          size=(1024, 800))
-
                 st.markdown(f"Here's a set of wordclouds of our most common words (excluding stopwords):")
 
                 col1, col2 = st.columns(2)
 
-                if isfile(expected_stylecloud_from_them_fpath):
+                if stylecloud_from_them_fpath is not None:
                     col1.markdown(csstext(contact_name, cls='small22-text-center'), unsafe_allow_html=True)
-                    col1.image(expected_stylecloud_from_them_fpath)
-                    remove(expected_stylecloud_from_them_fpath)
+                    col1.image(stylecloud_from_them_fpath)
                 else:
                     col1.markdown(csstext('Wordcloud not available 😔', cls='medium-text-center'), unsafe_allow_html=True)
 
-                if isfile(tmp_wordcloud_from_them_fpath):
-                    remove(tmp_wordcloud_from_them_fpath)
-
-                if isfile(expected_stylecloud_from_me_fpath):
+                if stylecloud_from_me_fpath is not None:
                     col2.markdown(csstext('Me', cls='small22-text-center'), unsafe_allow_html=True)
-                    col2.image(expected_stylecloud_from_me_fpath)
-                    remove(expected_stylecloud_from_me_fpath)
+                    col2.image(stylecloud_from_me_fpath)
                 else:
                     col2.markdown(csstext('Wordcloud not available 😔', cls='medium-text-center'), unsafe_allow_html=True)
 
-                if isfile(tmp_wordcloud_from_me_fpath):
-                    remove(tmp_wordcloud_from_me_fpath)
-
             def favorite_words_by_length():
                 st.markdown(csstext('Favorite words by length', cls='small22-text-center'), unsafe_allow_html=True)
                 col1, col2 = st.columns(2)
 
                 token_usage_from_who_ranked_by_length = (
-                    self.data.contact_token_usage_from_who_vw
-                    .loc[self.data.contact_token_usage_from_who_vw['contact_name'] == contact_name]
+                    xs(self.data.contact_token_usage_from_who_vw, contact_name, level='contact_name', drop_level=False)
                     .reset_index()
                 )
 
@@ -1030,7 +905,7 @@ def write(data: 'iMessageDataExtract', logger: logging.Logger) -> None:
                     self.data.message_user
                     .reset_index()
                     .loc[self.data.message_user.reset_index()['is_emote'] == 1]
-                    .groupby(['is_from_me', 'message_special_type'])
+                    .groupby(['is_from_me', 'message_special_type'], observed=True)
                     .agg({'message_id': 'count'})
                     .reset_index()
                     .rename(columns={'message_id': 'count', 'message_special_type': 'tapback'})
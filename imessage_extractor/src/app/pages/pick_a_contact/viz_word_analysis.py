@@ -31,7 +31,7 @@ def viz_word_analysis(data, self.pdata, stats, contact_name) -> None:
             (data.message_user.reset_index()['contact_name'] == contact_name)
             & (data.message_user.reset_index()['is_emote'] == True)
         ]
-        .groupby(['is_from_me', 'message_special_type'])
+        .groupby(['is_from_me', 'message_special_type'], observed=True)
         .agg({'message_id': 'count'})
         .reset_index()
         .rename(columns={'message_id': 'count', 'message_special_type': 'tapback'})
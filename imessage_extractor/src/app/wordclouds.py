@@ -0,0 +1,92 @@
+import hashlib
+import json
+import logging
+import pandas as pd
+import stylecloud
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from imessage_extractor.src.app.helpers import get_wordcloud_dpath
+from imessage_extractor.src.helpers.verbosity import code
+from os import cpu_count, listdir, makedirs, remove, replace, utime
+from os.path import getmtime, isfile, join
+
+
+def wordcloud_key(df_word_counts: pd.DataFrame, style: dict) -> str:
+    """
+    Content address of a wordcloud, i.e. a hash of the token counts it is drawn from and
+    the stylecloud options (colors, icon, size, etc.) it is drawn with.
+    """
+    sha = hashlib.sha256()
+    sha.update(df_word_counts[['token', 'usages']].to_csv(index=False).encode('utf-8'))
+    sha.update(json.dumps(style, sort_keys=True, default=str).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def render_wordcloud(df_word_counts: pd.DataFrame, style: dict, fpath: str) -> str:
+    """
+    Render a wordcloud PNG with stylecloud from a dataframe of `token` and `usages`. The
+    PNG is written to a temporary file then renamed to `fpath`, so a partially written
+    wordcloud is never read from the cache.
+    """
+    with tempfile.TemporaryDirectory(dir=get_wordcloud_dpath()) as tmp_dpath:
+        csv_fpath = join(tmp_dpath, 'word_counts.csv')
+        png_fpath = join(tmp_dpath, 'wordcloud.png')
+        df_word_counts[['token', 'usages']].to_csv(csv_fpath, index=False)
+        stylecloud.gen_stylecloud(file_path=csv_fpath, output_name=png_fpath, **style)
+        replace(png_fpath, fpath)
+
+    return fpath
+
+
+def prune_wordclouds(max_files: int) -> None:
+    """
+    Remove the least recently used wordclouds in the cache beyond the `max_files` most
+    recently used.
+    """
+    dpath = get_wordcloud_dpath()
+    fpaths = [join(dpath, x) for x in listdir(dpath) if x.endswith('.png')]
+    for fpath in sorted(fpaths, key=getmtime, reverse=True)[max_files:]:
+        remove(fpath)
+
+
+def get_wordclouds(word_counts: list, style: dict, logger: logging.Logger, max_files: int=100) -> list:
+    """
+    Return the filepath of a wordcloud PNG for each dataframe of token counts in
+    `word_counts`, all drawn with stylecloud options `style`. Wordclouds are cached on
+    disk under the hash of their token counts and style, so each is only rendered again
+    when its token counts change. Wordclouds not yet cached are rendered in parallel worker
+    processes. The filepath is None for a wordcloud that could not be rendered.
+    """
+    makedirs(get_wordcloud_dpath(), exist_ok=True)
+    fpaths = [join(get_wordcloud_dpath(), wordcloud_key(x, style) + '.png') for x in word_counts]
+
+    to_render = {}
+    cached = set()
+    for df_word_counts, fpath in zip(word_counts, fpaths):
+        if isfile(fpath):
+            utime(fpath)  # Mark as recently used
+            cached.add(fpath)
+        elif len(df_word_counts) and fpath not in to_render:
+            to_render[fpath] = df_word_counts
+
+    if len(to_render) == 1:
+        [(fpath, df_word_counts)] = to_render.items()
+        try:
+            render_wordcloud(df_word_counts, style, fpath)
+        except Exception as e:
+            logger.error(f'Unable to render wordcloud {code(fpath)}: {e}')
+
+    elif len(to_render) > 1:
+        with ProcessPoolExecutor(max_workers=min(len(to_render), cpu_count() or 1)) as executor:
+            futures = {fpath: executor.submit(render_wordcloud, df_word_counts, style, fpath) for fpath, df_word_counts in to_render.items()}
+            for fpath, future in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f'Unable to render wordcloud {code(fpath)}: {e}')
+
+    if len(to_render):
+        logger.info(f'Rendered {len(to_render)} wordcloud(s), {len(cached)} cached', arrow='black')
+        prune_wordclouds(max_files=max(max_files, len(fpaths)))
+
+    return [x if isfile(x) else None for x in fpaths]
@@ -1,12 +1,15 @@
 import json
 import logging
 import pandas as pd
+import shlex
 import sqlite3
 import subprocess
+import time
+import typing
 from imessage_extractor.src.helpers.config import WorkflowConfig
-from imessage_extractor.src.helpers.utils import strip_ws
+from imessage_extractor.src.helpers.utils import strip_ws, ensurelist, sqlite_uri
 from imessage_extractor.src.helpers.verbosity import bold, path, code
-from os import mkdir, remove
+from os import mkdir
 from os.path import isfile, join, expanduser, isdir, dirname
 
 
@@ -16,6 +19,27 @@ sqlite_failed_connection_string = strip_ws("""Unable to connect to SQLite! Could
     Access to that application or script might be a potential option""")
 
 
+copy_state_table_name = 'meta_copy_state'
+
+
+def read_copy_state(sqlite_con: sqlite3.Connection) -> dict:
+    """
+    Return the state recorded by previous copies of chat.db into this database, i.e. when
+    every table was last copied in full.
+    """
+    if sqlite_con.execute(f"SELECT count(*) FROM sqlite_master WHERE type='table' AND name='{copy_state_table_name}'").fetchone()[0] == 0:
+        return dict()
+
+    return {k: json.loads(v) for k, v in sqlite_con.execute(f'SELECT key, value FROM {copy_state_table_name}')}
+
+
+def write_copy_state(sqlite_con: sqlite3.Connection, state: dict) -> None:
+    sqlite_con.execute(f'CREATE TABLE IF NOT EXISTS {copy_state_table_name} (key text PRIMARY KEY, value text)')
+    sqlite_con.executemany(f'INSERT OR REPLACE INTO {copy_state_table_name} (key, value) VALUES (?, ?)',
+                           [(k, json.dumps(v)) for k, v in state.items()])
+    sqlite_con.commit()
+
+
 class SQLiteDb(object):
     """
     Manage database connection to SQLite chat.db.
@@ -38,7 +62,8 @@ class SQLiteDb(object):
         Establish connection to SQLite chat.db.
         """
         try:
-            sqlite_con = sqlite3.connect(self.db_path)
+            # URI filenames let other databases be attached read-only
+            sqlite_con = sqlite3.connect(sqlite_uri(self.db_path), uri=True)
             return sqlite_con
         except Exception as e:
             raise Exception(self.sqlite_failed_connection_string)
@@ -123,16 +148,47 @@ class SQLiteDb(object):
 
 
 class ChatDb(SQLiteDb):
-    def __init__(self, native_chatdb_path: str, imessage_extractor_db_path: str, logger: logging.Logger) -> None:
+    """
+    Copy the native chat.db to the output database and manage the connection to it.
+
+    With `copy_mode='full'` every chat.db table is copied from scratch, replacing those in an
+    existing output database, whose static tables and staging objects are kept so that
+    unchanged ones need not be rebuilt. With `copy_mode='incremental'`, an existing output
+    database is brought up to date in place: tables with `write_mode` "append" in
+    chatdb_table_info.json only receive rows above the target's current primary key
+    high-water mark, and "replace" tables are recopied if they differ from the source.
+    Rows that change or are deleted after they are copied (i.e. edited, read or unsent
+    messages) are only picked up when every table is recopied, which happens once the last
+    full copy is more than `resync_hours` old. Staging objects already in the output
+    database are left alone. With `copy_mode='none'`, an existing output database is
+    connected to as-is (i.e. to resume a run that failed after its copy completed).
+
+    The chat.db tables whose rows the copy changed are listed in `changed_tables`.
+    """
+    def __init__(self,
+                 native_chatdb_path: typing.Union[str, list],
+                 imessage_extractor_db_path: str,
+                 logger: logging.Logger,
+                 copy_mode: str='full',
+                 resync_hours: float=24) -> None:
         self.logger = logger
         self.sqlite_failed_connection_string = sqlite_failed_connection_string
 
-        # Find native chat.db
-        self.native_chatdb_path = expanduser(native_chatdb_path)
-        if not isfile(self.native_chatdb_path):
-            raise FileNotFoundError(f'chat.db not found at {path(self.native_chatdb_path)}')
+        # Find native chat.db(s). When several are given, the first is copied and the rest
+        # are merged into it
+        self.native_chatdb_paths = [expanduser(x) for x in ensurelist(native_chatdb_path)]
+        for fpath in self.native_chatdb_paths:
+            if not isfile(fpath):
+                raise FileNotFoundError(f'chat.db not found at {path(fpath)}')
+
+        if len(self.native_chatdb_paths) > 1 and copy_mode == 'incremental':
+            raise ValueError(f'Incremental copies support a single chat.db, but {len(self.native_chatdb_paths)} were given')
+
+        self.native_chatdb_path = self.native_chatdb_paths[0]
+
+        for fpath in self.native_chatdb_paths:
+            self.logger.info(f'Native chat.db (source): {path(fpath)}', arrow='black')
 
-        self.logger.info(f'Native chat.db (source): {path(self.native_chatdb_path)}', arrow='black')
         self.logger.info(f'Output chat.db (target): {path(imessage_extractor_db_path)}', arrow='black')
 
         self.chatdb_cfg = self._load_config()
@@ -140,7 +196,19 @@ class ChatDb(SQLiteDb):
         # Copy chat.db to a separate location to prevent damage
         self.logger.info('Copy Source Data to Target', bold=True)
         self.logger.info('Querying source chat.db...', arrow='black')
-        self.copy(native_chatdb_path=self.native_chatdb_path, imessage_extractor_chatdb_path=imessage_extractor_db_path)
+        if copy_mode == 'none':
+            self.logger.info('Using the target as-is, without copying', arrow='black')
+            self.changed_tables = []
+        elif copy_mode == 'incremental' and isfile(imessage_extractor_db_path):
+            self.changed_tables = self.copy_incremental(native_chatdb_path=self.native_chatdb_path,
+                                                        imessage_extractor_chatdb_path=imessage_extractor_db_path,
+                                                        resync_hours=resync_hours)
+        elif copy_mode in ['full', 'incremental']:
+            self.copy(native_chatdb_path=self.native_chatdb_path, imessage_extractor_chatdb_path=imessage_extractor_db_path)
+            self.changed_tables = [x for x in self.chatdb_cfg if not x.startswith('sqlite_')]
+        else:
+            raise ValueError(f'Unknown copy mode {code(copy_mode)}, expected one of {code("full")}, {code("incremental")} or {code("none")}')
+
         if isfile(imessage_extractor_db_path):
             self.chatdb_path = imessage_extractor_db_path
         else:
@@ -154,6 +222,10 @@ class ChatDb(SQLiteDb):
 
         self._validate_config_chatdb_alignment()
 
+        if copy_mode != 'none':
+            for fpath in self.native_chatdb_paths[1:]:
+                self.merge(native_chatdb_path=fpath)
+
     def _load_config(self):
         """
         Load the chat.db table configuration.
@@ -168,7 +240,12 @@ class ChatDb(SQLiteDb):
         JSON config, and no tables in chat.db that are unaccounted for in the JSON.
         """
         cfg_tables = list(self.chatdb_cfg.keys())
-        chatdb_tables = self.list_tables()
+
+        # Compare against the source rather than the target, which also holds staging
+        # tables when it has been updated incrementally
+        native_chatdb_con = sqlite3.connect(sqlite_uri(self.native_chatdb_path, mode='ro'), uri=True)
+        chatdb_tables = [x[0] for x in native_chatdb_con.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall()]
+        native_chatdb_con.close()
 
         extra_cfg_tables = [x for x in cfg_tables if x not in chatdb_tables]
         extra_chatdb_tables = [x for x in chatdb_tables if x not in cfg_tables]
@@ -181,13 +258,34 @@ class ChatDb(SQLiteDb):
 
         self.logger.info(f'Validated data schema of target against {path("chatdb_table_info.json")}', arrow='black')
 
+    def drop_chatdb_tables(self, copied_chatdb_con: sqlite3.Connection, table_names: list) -> None:
+        """
+        Drop the chat.db tables in `table_names` from a previously copied chat.db, along with
+        their indexes, triggers and statistics, so they can be copied again. Tables that
+        SQLite maintains itself are emptied instead.
+        """
+        cursor = copied_chatdb_con.cursor()
+        copied_tables = [x[0] for x in cursor.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall()]
+
+        for table_name in [x for x in table_names if x in copied_tables and not x.startswith('sqlite_')]:
+            cursor.execute(f'DROP TABLE `{table_name}`;')
+
+        if 'sqlite_sequence' in copied_tables:
+            cursor.execute('DELETE FROM sqlite_sequence;')
+
+        if 'sqlite_stat1' in copied_tables:
+            cursor.executemany('DELETE FROM sqlite_stat1 WHERE tbl = ?;', [(x,) for x in table_names])
+
+        copied_chatdb_con.commit()
+
     def copy(self, native_chatdb_path: str, imessage_extractor_chatdb_path: str) -> None:
         """
-        Copy the entire SQLite database to a separate directory.
+        Copy the entire SQLite database to a separate directory. If the output database
+        already exists, only its chat.db tables are replaced. Static tables, staging objects
+        and the hashes they were built from are kept, so that those that are unchanged can
+        be skipped.
         """
-        if isfile(imessage_extractor_chatdb_path):
-            remove(imessage_extractor_chatdb_path)
-        else:
+        if not isfile(imessage_extractor_chatdb_path):
             if not isdir(dirname(imessage_extractor_chatdb_path)):
                 mkdir(dirname(imessage_extractor_chatdb_path))
 
@@ -200,14 +298,192 @@ class ChatDb(SQLiteDb):
         native_chatdb_tables = [x[0] for x in cursor.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall()]
 
         copied_chatdb_con = sqlite3.connect(imessage_extractor_chatdb_path)
+        self.drop_chatdb_tables(copied_chatdb_con, native_chatdb_tables)
         copy_command_template = 'sqlite3 {native_chatdb_path} ".dump {table_name}" | sqlite3 {imessage_extractor_chatdb_path}'
 
         for table_name in native_chatdb_tables:
-            copy_sql = copy_command_template.format(**locals())
+            copy_sql = copy_command_template.format(native_chatdb_path=shlex.quote(native_chatdb_path),
+                                                    table_name=table_name,
+                                                    imessage_extractor_chatdb_path=shlex.quote(imessage_extractor_chatdb_path))
             subprocess.call(copy_sql, shell=True)
 
 
         native_chatdb_con.close()
+        write_copy_state(copied_chatdb_con, dict(last_full_copy_ts=time.time()))
         copied_chatdb_con.close()
 
         self.logger.info('Copied chat.db tables to target', arrow='black')
+
+    def copy_incremental(self, native_chatdb_path: str, imessage_extractor_chatdb_path: str, resync_hours: float=24) -> list:
+        """
+        Update a previously copied chat.db in place from the native chat.db. Rows are copied
+        with SQL over an ATTACHed, read-only source, so only new data is read and written.
+        If the last full copy is more than `resync_hours` old, "append" tables are recopied
+        like "replace" tables, picking up rows that were changed or deleted in chat.db since
+        they were copied. Return the names of the tables whose rows changed.
+        """
+        # URI filenames let the source be attached read-only
+        copied_chatdb_con = sqlite3.connect(sqlite_uri(imessage_extractor_chatdb_path), uri=True)
+        cursor = copied_chatdb_con.cursor()
+        copied_tables = [x[0] for x in cursor.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall()]
+
+        missing_tables = [x for x in self.chatdb_cfg if not x.startswith('sqlite_') and x not in copied_tables]
+        if len(missing_tables):
+            copied_chatdb_con.close()
+            self.logger.info(f'Target is missing chat.db table(s) {missing_tables}, copying in full', arrow='black')
+            self.copy(native_chatdb_path=native_chatdb_path, imessage_extractor_chatdb_path=imessage_extractor_chatdb_path)
+            return [x for x in self.chatdb_cfg if not x.startswith('sqlite_')]
+
+        last_full_copy_ts = read_copy_state(copied_chatdb_con).get('last_full_copy_ts')
+        resync = last_full_copy_ts is None or time.time() - last_full_copy_ts >= resync_hours * 3600
+        if resync:
+            self.logger.info(f'Last full copy is more than {resync_hours} hour(s) old, recopying every table that changed', arrow='black')
+
+        # chat.db triggers call functions registered by Messages.app, which do not exist
+        # in this process and would fail on insert
+        for trigger_name in [x[0] for x in cursor.execute("SELECT name FROM sqlite_master WHERE type='trigger';").fetchall()]:
+            cursor.execute(f'DROP TRIGGER IF EXISTS `{trigger_name}`;')
+
+        cursor.execute('ATTACH DATABASE ? AS native', (sqlite_uri(native_chatdb_path, mode='ro'),))
+        total_rows = 0
+        changed_tables = []
+
+        for table_name, table_info in self.chatdb_cfg.items():
+            if table_name.startswith('sqlite_'):
+                # Maintained by SQLite itself
+                continue
+
+            columns = ', '.join(f'`{x[1]}`' for x in cursor.execute(f'PRAGMA main.table_info(`{table_name}`)').fetchall())
+
+            if table_info['write_mode'] == 'append' and not resync:
+                # Composite keys are tracked by their leading column, which increases with
+                # each new row in chat.db (i.e. message_id in message_attachment_join)
+                hwm_column = ensurelist(table_info['primary_key'])[0]
+                hwm = cursor.execute(f'SELECT coalesce(max(`{hwm_column}`), -1) FROM main.`{table_name}`').fetchone()[0]
+                cursor.execute(strip_ws(
+                    f"""INSERT OR REPLACE INTO main.`{table_name}` ({columns})
+                    SELECT {columns} FROM native.`{table_name}` WHERE `{hwm_column}` > ?"""), (hwm,))
+                n_rows = max(cursor.rowcount, 0)
+                total_rows += n_rows
+                self.logger.debug(f'Copied {n_rows} new row(s) of {code(table_name)}')
+            else:
+                # Recopied only if any row was added, changed or deleted, so that tables
+                # read from unchanged chat.db tables are not rebuilt
+                n_rows = cursor.execute(strip_ws(
+                    f"""SELECT (SELECT count(*) FROM (SELECT {columns} FROM native.`{table_name}` EXCEPT SELECT {columns} FROM main.`{table_name}`))
+                    + (SELECT count(*) FROM (SELECT {columns} FROM main.`{table_name}` EXCEPT SELECT {columns} FROM native.`{table_name}`))""")).fetchone()[0]
+                if n_rows > 0:
+                    cursor.execute(f'DELETE FROM main.`{table_name}`')
+                    cursor.execute(f'INSERT INTO main.`{table_name}` ({columns}) SELECT {columns} FROM native.`{table_name}`')
+
+                self.logger.debug(f'Recopied {code(table_name)}, {n_rows} row(s) differed')
+
+            if n_rows > 0:
+                changed_tables.append(table_name)
+
+        copied_chatdb_con.commit()
+        cursor.execute('DETACH DATABASE native')
+
+        if resync:
+            write_copy_state(copied_chatdb_con, dict(last_full_copy_ts=time.time()))
+
+        copied_chatdb_con.close()
+
+        self.logger.info(f'Incrementally copied {bold(total_rows)} new row(s) to target', arrow='black')
+        if len(changed_tables):
+            self.logger.info(f'Changed chat.db table(s): {", ".join(changed_tables)}', arrow='black')
+
+        return changed_tables
+
+    def merge(self, native_chatdb_path: str) -> None:
+        """
+        Merge an additional chat.db (i.e. from another Mac or an old backup) into the copied
+        chat.db. Rows are deduplicated on each table's `merge_key` in chatdb_table_info.json,
+        using the unique indexes chat.db already defines on those columns. New rows get new
+        ROWIDs, and the columns listed in each table's `merge_remap` are translated from the
+        source's ROWIDs to the target's. All work is done with SQL over an ATTACHed source,
+        so rows stream through SQLite rather than Python.
+        """
+        cursor = self.sqlite_con.cursor()
+        cursor.execute('ATTACH DATABASE ? AS native', (sqlite_uri(native_chatdb_path, mode='ro'),))
+        native_tables = [x[0] for x in cursor.execute("SELECT name FROM native.sqlite_master WHERE type='table';").fetchall()]
+
+        # Triggers defined by Messages.app call functions that do not exist in this process
+        for trigger_name in self.list_triggers():
+            cursor.execute(f'DROP TRIGGER IF EXISTS `{trigger_name}`;')
+
+        remap_targets = {t for info in self.chatdb_cfg.values() for t in info.get('merge_remap', {}).values()}
+
+        # Tables must be merged after the tables their remapped columns point to
+        merge_order = []
+        def visit(table_name: str) -> None:
+            if table_name not in merge_order:
+                for ref_table_name in self.chatdb_cfg[table_name].get('merge_remap', {}).values():
+                    visit(ref_table_name)
+
+                merge_order.append(table_name)
+
+        for table_name in self.chatdb_cfg:
+            if not table_name.startswith('sqlite_'):
+                visit(table_name)
+
+        for table_name in merge_order:
+            if table_name not in native_tables:
+                self.logger.debug(f'Table {code(table_name)} not in {path(native_chatdb_path)}, skipping')
+                continue
+
+            table_info = self.chatdb_cfg[table_name]
+            merge_key = table_info.get('merge_key', [])
+            merge_remap = table_info.get('merge_remap', {})
+
+            native_columns = [x[1] for x in cursor.execute(f'PRAGMA native.table_info(`{table_name}`)').fetchall()]
+            columns = [x[1] for x in cursor.execute(f'PRAGMA main.table_info(`{table_name}`)').fetchall()
+                       if x[1] in native_columns and not (len(merge_key) and x[1] == 'ROWID')]
+
+            select_exprs = []
+            for col in columns:
+                if col in merge_remap:
+                    # ID 0 stands for "no row" in chat.db (i.e. handle_id of messages from me)
+                    select_exprs.append(strip_ws(
+                        f"""coalesce((SELECT new_rowid FROM temp.`merge_map_{merge_remap[col]}` WHERE old_rowid = s.`{col}`),
+                        CASE WHEN s.`{col}` = 0 THEN 0 END)"""))
+                else:
+                    select_exprs.append(f's.`{col}`')
+
+            column_list = ', '.join(f'`{x}`' for x in columns)
+            select_list = ', '.join(select_exprs)
+
+            if len(merge_key):
+                key_match = ' AND '.join(f'm.`{k}` = s.`{k}`' for k in merge_key)
+                cursor.execute(strip_ws(
+                    f"""INSERT INTO main.`{table_name}` ({column_list})
+                    SELECT {select_list} FROM native.`{table_name}` s
+                    WHERE NOT EXISTS (SELECT 1 FROM main.`{table_name}` m WHERE {key_match})"""))
+                n_inserted = cursor.rowcount
+
+                if table_name in remap_targets:
+                    cursor.execute(f'DROP TABLE IF EXISTS temp.`merge_map_{table_name}`')
+                    cursor.execute(f'CREATE TEMP TABLE `merge_map_{table_name}` (old_rowid INTEGER PRIMARY KEY, new_rowid INTEGER)')
+                    cursor.execute(strip_ws(
+                        f"""INSERT INTO temp.`merge_map_{table_name}` (old_rowid, new_rowid)
+                        SELECT s.ROWID, m.ROWID FROM native.`{table_name}` s
+                        JOIN main.`{table_name}` m ON {key_match}"""))
+            else:
+                # Join tables: keep rows whose references all resolved, and let the primary
+                # key drop rows that are already present
+                remapped_not_null = ' AND '.join(f'{select_exprs[columns.index(c)]} IS NOT NULL' for c in merge_remap if c in columns) or '1'
+                cursor.execute(strip_ws(
+                    f"""INSERT OR IGNORE INTO main.`{table_name}` ({column_list})
+                    SELECT {select_list} FROM native.`{table_name}` s
+                    WHERE {remapped_not_null}"""))
+                n_inserted = cursor.rowcount
+
+            self.logger.debug(f'Merged {n_inserted} new row(s) into {code(table_name)}')
+
+        self.sqlite_con.commit()
+
+        for table_name in remap_targets:
+            cursor.execute(f'DROP TABLE IF EXISTS temp.`merge_map_{table_name}`')
+
+        cursor.execute('DETACH DATABASE native')
+        self.logger.info(f'Merged {path(native_chatdb_path)} into target', arrow='black')
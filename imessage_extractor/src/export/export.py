@@ -0,0 +1,260 @@
+import base64
+import click
+import csv
+import json
+import logging
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shutil
+import sqlite3
+import time
+import typing
+from imessage_extractor.src.helpers.utils import fmt_seconds, sqlite_uri, strip_ws
+from imessage_extractor.src.helpers.verbosity import logger_setup, path, code, bold
+from os import makedirs
+from os.path import join, expanduser, isfile, isdir
+
+
+export_formats = ['parquet', 'csv', 'jsonl']
+
+sqlite_typeof_arrow_types = dict(integer='int64', real='float64', text='string', blob='binary')
+
+
+def encode_value(value):
+    """
+    Encode BLOB values (i.e. `attributedBody`) as base64 strings for text-based formats.
+    """
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode('ascii')
+
+    return value
+
+
+class CsvBatchWriter(object):
+    """
+    Append batches of rows to a .csv file.
+    """
+    ext = 'csv'
+
+    def __init__(self, fpath: str, columns: list) -> None:
+        self.f = open(fpath, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.f)
+        self.writer.writerow(columns)
+
+    def write(self, rows: list) -> None:
+        self.writer.writerows([[encode_value(x) for x in row] for row in rows])
+
+    def close(self) -> None:
+        self.f.close()
+
+
+class JsonlBatchWriter(object):
+    """
+    Append batches of rows to a newline-delimited .jsonl file.
+    """
+    ext = 'jsonl'
+
+    def __init__(self, fpath: str, columns: list) -> None:
+        self.f = open(fpath, 'w', encoding='utf-8')
+        self.columns = columns
+
+    def write(self, rows: list) -> None:
+        self.f.writelines(
+            json.dumps(dict(zip(self.columns, [encode_value(x) for x in row])), ensure_ascii=False) + '\n'
+            for row in rows
+        )
+
+    def close(self) -> None:
+        self.f.close()
+
+
+def sqlite_affinity_arrow_type(decltype: str) -> typing.Optional[str]:
+    """
+    Map a declared SQLite column type to an Arrow type alias, following SQLite's type
+    affinity rules. Return None for types with NUMERIC affinity or no declared type (i.e.
+    view columns computed from expressions), whose values' storage class may vary.
+    """
+    decltype = (decltype or '').upper()
+    if 'INT' in decltype:
+        return 'int64'
+    elif any(x in decltype for x in ['CHAR', 'CLOB', 'TEXT']):
+        return 'string'
+    elif 'BLOB' in decltype:
+        return 'binary'
+    elif any(x in decltype for x in ['REAL', 'FLOA', 'DOUB']):
+        return 'float64'
+    else:
+        return None
+
+
+def sqlite_arrow_schema(sqlite_con: sqlite3.Connection, table_name: str) -> pa.Schema:
+    """
+    Build the Arrow schema of a SQLite table or view from its declared column types, so
+    that it does not depend on which values come first. Columns without a usable declared
+    type are typed by the storage class of their first non-null value, or as strings if
+    they are entirely null.
+    """
+    fields = []
+    for _, col, decltype, *_ in sqlite_con.execute(f'PRAGMA table_info(`{table_name}`)').fetchall():
+        arrow_type = sqlite_affinity_arrow_type(decltype)
+        if arrow_type is None:
+            row = sqlite_con.execute(f'SELECT typeof(`{col}`) FROM `{table_name}` WHERE `{col}` IS NOT NULL LIMIT 1').fetchone()
+            arrow_type = sqlite_typeof_arrow_types[row[0]] if row is not None else 'string'
+
+        fields.append(pa.field(col, pa.type_for_alias(arrow_type)))
+
+    return pa.schema(fields)
+
+
+class ParquetBatchWriter(object):
+    """
+    Append batches of rows to a .parquet file, one row group per batch, with the Arrow
+    schema of the exported table (see `sqlite_arrow_schema()`).
+    """
+    ext = 'parquet'
+
+    def __init__(self, fpath: str, columns: list, schema: pa.Schema) -> None:
+        self.schema = schema
+        self.writer = pq.ParquetWriter(fpath, self.schema)
+
+    def write(self, rows: list) -> None:
+        column_values = list(zip(*rows))
+        arrays = [pa.array(values, type=field.type) for values, field in zip(column_values, self.schema)]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+batch_writers = dict(parquet=ParquetBatchWriter, csv=CsvBatchWriter, jsonl=JsonlBatchWriter)
+
+
+def export_table(sqlite_con: sqlite3.Connection,
+                 table_name: str,
+                 export_dpath: str,
+                 fmt: str,
+                 batch_size: int,
+                 partition_by_year: bool,
+                 logger: logging.Logger) -> int:
+    """
+    Stream a table or view from SQLite to files in `export_dpath`/`table_name`, reading
+    `batch_size` rows at a time so that memory use does not depend on the size of the table.
+    If `partition_by_year` and the table has a `dt` column, rows are written to one file per
+    year, in Hive-style `year=YYYY` subfolders. Return the number of rows exported.
+    """
+    cursor = sqlite_con.cursor()
+    cursor.execute(f'SELECT * FROM `{table_name}`')
+    columns = [x[0] for x in cursor.description]
+
+    table_dpath = join(export_dpath, table_name)
+    if isdir(table_dpath):
+        shutil.rmtree(table_dpath)
+
+    makedirs(table_dpath)
+
+    if partition_by_year and 'dt' in columns:
+        dt_idx = columns.index('dt')
+        partition_key = lambda row: f'year={str(row[dt_idx])[:4]}' if row[dt_idx] is not None else 'year=__null__'
+    else:
+        if partition_by_year:
+            logger.debug(f'{code(table_name)} has no {code("dt")} column, exporting to a single file')
+
+        partition_key = lambda row: None
+
+    writer_kwargs = dict(schema=sqlite_arrow_schema(sqlite_con, table_name)) if fmt == 'parquet' else dict()
+
+    writers = {}
+    n_rows = 0
+    try:
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not len(rows):
+                break
+
+            partitions = {}
+            for row in rows:
+                partitions.setdefault(partition_key(row), []).append(row)
+
+            for key, partition_rows in partitions.items():
+                if key not in writers:
+                    partition_dpath = table_dpath if key is None else join(table_dpath, key)
+                    makedirs(partition_dpath, exist_ok=True)
+                    writer_class = batch_writers[fmt]
+                    writers[key] = writer_class(join(partition_dpath, f'part-0.{writer_class.ext}'), columns, **writer_kwargs)
+
+                writers[key].write(partition_rows)
+
+            n_rows += len(rows)
+            logger.debug(f'Exported {n_rows} rows of {code(table_name)}', arrow='black')
+
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    n_partitions = len([k for k in writers if k is not None])
+    partition_str = f' in {n_partitions} yearly partitions' if n_partitions else ''
+    logger.info(f'Exported {bold(n_rows)} rows of {code(table_name)}{partition_str} to {path(table_dpath)}', arrow='black')
+
+    return n_rows
+
+
+@click.option('--output-db-path', type=str, required=True, default=expanduser('~/Desktop/imessage_extractor_chat.db'),
+              help='Path to the imessage-extractor output .db SQLite database file to export from.')
+@click.option('--table', 'table_names', type=str, required=True, multiple=True,
+              help='Table or view to export. May be passed multiple times.')
+@click.option('--format', 'fmt', type=click.Choice(export_formats), default='parquet', show_default=True,
+              help='Export file format.')
+@click.option('--export-dpath', type=str, required=True, default=expanduser('~/Desktop/imessage_extractor_export'),
+              help='Directory to export to. Each table is written to a subdirectory of the same name.')
+@click.option('--batch-size', type=int, default=50000, show_default=True,
+              help='Number of rows read from SQLite and written per batch.')
+@click.option('--no-partition', is_flag=True, default=False,
+              help='Write a single file per table instead of partitioning by year of `dt`.')
+@click.option('-v', '--verbose', is_flag=True, default=False,
+              help='Set logging level to INFO.')
+@click.option('-d', '--debug', is_flag=True, default=False,
+              help='Set logging level to DEBUG.')
+
+@click.command()
+def export(output_db_path, table_names, fmt, export_dpath, batch_size, no_partition, verbose, debug) -> None:
+    """
+    Export tables or views from the output database to Parquet, CSV or JSONL.
+    """
+    if debug:
+        logging_level = logging.DEBUG
+    elif verbose:
+        logging_level = logging.INFO
+    else:
+        logging_level = logging.ERROR
+
+    logger = logger_setup(name='imessage-extractor', level=logging_level)
+    start_ts = time.time()
+
+    output_db_path = expanduser(output_db_path)
+    if not isfile(output_db_path):
+        raise FileNotFoundError(f'Output database not found at {path(output_db_path)}, run {code("imessage-extractor go")} first')
+
+    sqlite_con = sqlite3.connect(sqlite_uri(output_db_path, mode='ro'), uri=True)
+
+    logger.info('Export', bold=True)
+    for table_name in table_names:
+        exists = sqlite_con.execute(
+            "SELECT count(*) FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?", (table_name,)
+        ).fetchone()[0]
+
+        if not exists:
+            raise ValueError(strip_ws(f'Table or view {code(table_name)} does not exist in {path(output_db_path)}'))
+
+        export_table(sqlite_con=sqlite_con,
+                     table_name=table_name,
+                     export_dpath=expanduser(export_dpath),
+                     fmt=fmt,
+                     batch_size=batch_size,
+                     partition_by_year=not no_partition,
+                     logger=logger)
+
+    sqlite_con.close()
+
+    diff_formatted = fmt_seconds(time.time() - start_ts, units='auto', round_digits=2)
+    elapsed_time = f"{diff_formatted['value']} {diff_formatted['units']}"
+    logger.info(f'Exported {len(table_names)} table(s) in {bold(elapsed_time)}')
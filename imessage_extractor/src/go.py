@@ -1,29 +1,67 @@
 import click
+import json
 import logging
 import time
 from imessage_extractor.src.chatdb.chatdb import ChatDb
 from imessage_extractor.src.helpers.config import WorkflowConfig
-from imessage_extractor.src.helpers.utils import fmt_seconds
+from imessage_extractor.src.helpers.utils import fmt_seconds, strip_ws
 from imessage_extractor.src.helpers.verbosity import bold
 from imessage_extractor.src.helpers.verbosity import print_startup_message, logger_setup
 from imessage_extractor.src.quality_control.quality_control import create_qc_views, run_quality_control
 from imessage_extractor.src.refresh_contacts.refresh_contacts import refresh_contacts
-from imessage_extractor.src.staging.staging import assemble_staging_order
+from imessage_extractor.src.staging.duckdb_engine import list_rollups, run_rollups_duckdb, run_rollups_sqlite
+from imessage_extractor.src.run_state.run_state import RunState, chatdb_fingerprint, find_resumable_run
+from imessage_extractor.src.staging.staging import assemble_staging_order, drop_incomplete_staging_objects, drop_stale_staging_objects
+from imessage_extractor.src.staging.staging import rebuild_staging_objects, select_staging_objects, staging_object_hashes, write_staging_hashes
+from imessage_extractor.src.staging.staging import update_chatdb_table_versions
 from imessage_extractor.src.static_tables.static_tables import build_static_tables
-from os.path import expanduser
+from os.path import expanduser, isfile
 
 
-@click.option('--chatdb-path', type=str, default=expanduser('~/Library/Messages/chat.db'), required=True,
-              help='Path to working chat.db, should be in ~/Library/Messages.')
+@click.option('--chatdb-path', type=str, default=[expanduser('~/Library/Messages/chat.db')], required=True, multiple=True,
+              help=strip_ws("""Path to working chat.db, should be in ~/Library/Messages. May be passed multiple
+              times to merge several chat.db files (i.e. from other Macs or backups) into one output database."""))
 @click.option('--output-db-path', type=str, required=True, default=expanduser('~/Desktop/imessage_extractor_chat.db'),
               help='Desired path to output .db SQLite database file.')
+@click.option('--address-book-dpath', type=str, default=expanduser('~/Library/Application Support/AddressBook'), required=True,
+              help='Path to the Contacts app AddressBook folder, searched for .abcddb files.')
+@click.option('--contacts-csv-path', type=str, default=None,
+              help='Also save the contact map read from the Contacts app to this .csv file.')
+@click.option('--static-table-dpath', type=str, default=None,
+              help=strip_ws("""Folder of user-maintained static table .csv files (i.e. contacts_manual.csv and
+              contacts_ignored.csv). Defaults to ~/.cache/imessage_extractor/static_tables."""))
+@click.option('--engine', type=click.Choice(['sqlite', 'duckdb']), default='sqlite', show_default=True,
+              help=strip_ws("""Engine for the rollup staging objects, which are stored as indexed SQLite tables.
+              `duckdb` computes them with DuckDB, `sqlite` with SQLite."""))
+@click.option('--incremental', is_flag=True, default=False,
+              help='Update an existing output database in place, copying only new chat.db rows, instead of rebuilding it.')
+@click.option('--resync-every', type=float, default=24, show_default=True,
+              help=strip_ws("""With --incremental, recopy every chat.db table that changed, picking up edited, read,
+              unsent and deleted messages, if the last full copy is older than this many hours."""))
+@click.option('--resume', is_flag=True, default=False,
+              help=strip_ws("""Resume the previous run against the output database from its first incomplete
+              stage, if it failed and chat.db has not changed since. Otherwise, start over."""))
+@click.option('--only', type=str, multiple=True,
+              help='Rebuild only this staging object in an existing output database. May be passed multiple times.')
+@click.option('--from', 'from_', type=str, multiple=True,
+              help=strip_ws("""Rebuild this staging object and every staging object downstream of it in an
+              existing output database. May be passed multiple times."""))
+@click.option('--skip', type=str, multiple=True,
+              help=strip_ws("""Leave this staging object as it is when rebuilding staging objects in an
+              existing output database. May be passed multiple times."""))
+@click.option('--qc-report-path', type=str, default=None,
+              help='Save a JSON report of quality control check results to this path.')
+@click.option('--qc-full', is_flag=True, default=False,
+              help='With --incremental, check every row in quality control rather than only new messages.')
+@click.option('--qc-full-every', type=float, default=24, show_default=True,
+              help='With --incremental, check every row in quality control if the last full check is older than this many hours.')
 @click.option('-v', '--verbose', is_flag=True, default=False,
               help='Set logging level to INFO.')
 @click.option('-d', '--debug', is_flag=True, default=False,
               help='Set logging level to DEBUG.')
 
 @click.command()
-def go(chatdb_path, output_db_path, verbose, debug) -> None:
+def go(chatdb_path, output_db_path, address_book_dpath, contacts_csv_path, static_table_dpath, engine, incremental, resync_every, resume, only, from_, skip, qc_report_path, qc_full, qc_full_every, verbose, debug) -> None:
     """
     Run the imessage-extractor!
     """
@@ -53,12 +91,30 @@ def go(chatdb_path, output_db_path, verbose, debug) -> None:
     logger.info('Configure Workflow', bold=True)
     cfg = WorkflowConfig(params=params, logger=logger)
 
+    # With --only, --from or --skip, just the selected staging objects are rebuilt in an
+    # existing output database, and chat.db, contacts and static tables are left as they are
+    selective = len(only) > 0 or len(from_) > 0 or len(skip) > 0
+    if selective:
+        if resume or incremental:
+            raise click.UsageError('--only, --from and --skip cannot be combined with --resume or --incremental')
+
+        if not isfile(expanduser(output_db_path)):
+            raise click.UsageError(f'--only, --from and --skip rebuild staging objects in an existing output database, but none exists at {output_db_path}')
+
+        try:
+            selected = select_staging_objects(cfg=cfg, only=only, from_=from_, skip=skip)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+
+        logger.info(f'Selected staging objects: {", ".join(selected)}', arrow='black')
+
     #
     # Refresh contacts
     #
 
-    logger.info('Refresh Contacts', bold=True)
-    refresh_contacts(logger=logger)
+    if not selective:
+        logger.info('Refresh Contacts', bold=True)
+        contacts_df = refresh_contacts(address_book_dpath=address_book_dpath, logger=logger, csv_fpath=contacts_csv_path)
 
     #
     # Establish database connections and copy data from source to target
@@ -67,7 +123,27 @@ def go(chatdb_path, output_db_path, verbose, debug) -> None:
     logger.info('Establish Database Connections', bold=True)
 
     output_db_path = expanduser(output_db_path)
-    chatdb = ChatDb(native_chatdb_path=chatdb_path, imessage_extractor_db_path=output_db_path, logger=logger)
+    fingerprint = chatdb_fingerprint(chatdb_path)
+    resume_run_id = find_resumable_run(output_db_path, fingerprint, logger) if resume else None
+
+    if resume_run_id is not None or selective:
+        copy_mode = 'none'
+    elif incremental:
+        copy_mode = 'incremental'
+    else:
+        copy_mode = 'full'
+
+    chatdb = ChatDb(native_chatdb_path=list(chatdb_path),
+                    imessage_extractor_db_path=output_db_path,
+                    logger=logger,
+                    copy_mode=copy_mode,
+                    resync_hours=resync_every)
+
+    # Progress of full runs is recorded in the output database, so that a failed run can
+    # be resumed
+    if not selective:
+        run_state = RunState(chatdb=chatdb, logger=logger, fingerprint=fingerprint, run_id=resume_run_id)
+        run_state.complete('copy')
 
     logger.info('All subsequent actions apply to the target chat.db', arrow='black')
 
@@ -75,15 +151,17 @@ def go(chatdb_path, output_db_path, verbose, debug) -> None:
     # Static tables
     #
 
-    build_static_tables(sqlite_con=chatdb.sqlite_con, logger=logger, cfg=cfg)
+    if not selective and not run_state.is_complete('static_tables'):
+        build_static_tables(sqlite_con=chatdb.sqlite_con, logger=logger, cfg=cfg, contacts_df=contacts_df)
+        run_state.complete('static_tables')
 
     #
     # Staging tables and views
     #
 
     # At this point in the workflow, all data from chat.db has been loaded into SQLite
-    # and static tables (which are overwritten with each run of the workflow) have been
-    # build. In addition all views that are reliant ONLY on those chat.db tables have
+    # and static tables (which are rebuilt whenever their data or definition changes) have
+    # been built. In addition all views that are reliant ONLY on those chat.db tables have
     # been defined.
     #
     # We'll now begin the process of defining staging tables and views, the dependencies
@@ -94,7 +172,29 @@ def go(chatdb_path, output_db_path, verbose, debug) -> None:
 
     logger.info(f'Staging Tables and Views', bold=True)
 
-    assemble_staging_order(chatdb=chatdb, cfg=cfg)
+    if selective:
+        # Selected objects are rebuilt regardless of their definition hash, and their
+        # recorded hash is left as it was, as the output database may not be current
+        rebuild_staging_objects(chatdb=chatdb, cfg=cfg, names=selected)
+    else:
+        # Rollups are stored as tables, so they are rebuilt when their input data changes,
+        # unlike the views they are first defined as
+        materialized = list_rollups(cfg)[0]
+        data_versions = update_chatdb_table_versions(chatdb=chatdb, data_version=json.dumps(fingerprint))
+        staging_hashes = staging_object_hashes(chatdb=chatdb, cfg=cfg, data_versions=data_versions, materialized=materialized)
+
+        if resume_run_id is not None:
+            # Objects the failed run did not complete may be partially built
+            drop_incomplete_staging_objects(chatdb=chatdb, cfg=cfg, completed=run_state.completed('staging'))
+        else:
+            # Objects whose definition, references and input data are unchanged since they
+            # were last built are kept, and skipped below
+            drop_stale_staging_objects(chatdb=chatdb, cfg=cfg, hashes=staging_hashes)
+
+        if not run_state.is_complete('staging'):
+            assemble_staging_order(chatdb=chatdb, cfg=cfg, run_state=run_state)
+            write_staging_hashes(chatdb=chatdb, hashes=staging_hashes)
+            run_state.complete('staging')
     # logger.debug(f'Staging order: {" > ".join(list(staging_order.keys()))}')
 
     # build_staging_tables_and_views(staging_order=staging_order,
@@ -102,13 +202,33 @@ def go(chatdb_path, output_db_path, verbose, debug) -> None:
     #                                logger=logger,
     #                                cfg=cfg)
 
+    run_rollups = run_rollups_duckdb if engine == 'duckdb' else run_rollups_sqlite
+    if selective:
+        run_rollups(chatdb=chatdb, cfg=cfg, logger=logger, only=selected)
+    elif not run_state.is_complete('rollups'):
+        # Rollups are defined as SQLite views above, then replaced with indexed tables
+        # computed by the engine. Views that reference a rollup resolve to the table by
+        # name. Rollups that are still tables were kept as unchanged, and are not recomputed
+        rollups, _ = list_rollups(cfg)
+        run_rollups(chatdb=chatdb, cfg=cfg, logger=logger, only=[x for x in rollups if not chatdb.table_exists(x)])
+        run_state.complete('rollups')
+
     #
     # Quality control views
     #
 
     logger.info('Quality Control', bold=True)
     create_qc_views(chatdb=chatdb, cfg=cfg, logger=logger)
-    total_warnings = run_quality_control(chatdb=chatdb, cfg=cfg, logger=logger)
+    total_warnings = run_quality_control(chatdb=chatdb,
+                                         cfg=cfg,
+                                         logger=logger,
+                                         report_fpath=qc_report_path,
+                                         incremental=incremental,
+                                         full_sweep=qc_full,
+                                         full_sweep_hours=qc_full_every)
+    if not selective:
+        run_state.complete('quality_control')
+        run_state.finish()
 
     #
     # End
@@ -1,7 +1,11 @@
 import logging
 from imessage_extractor.src.helpers.verbosity import path, bold
 from imessage_extractor.src.helpers.utils import listfiles, ensurelist, duplicated
-from os.path import dirname, basename, join, isdir, isfile, splitext
+from os.path import dirname, basename, expanduser, join, isdir, isfile, splitext
+
+
+# Static table data is user-maintained, so it is kept outside of the installed package
+default_static_table_dpath = expanduser('~/.cache/imessage_extractor/static_tables')
 
 
 class Attribute():
@@ -32,12 +36,14 @@ class WorkflowConfig(object):
 
         self.dir.static_tables = join(self.dir.home, 'static_tables')
         self.file.static_table_info = join(self.dir.static_tables, 'static_table_info.json')
-        self.dir.static_table_data = join(self.dir.static_tables, 'data')
-        self.file.static_table_csv = listfiles(path=self.dir.static_table_data, full_names=True, ext='.csv')
+        # Created by `build_static_tables()`, so it may not exist yet
+        self.dir.static_table_data = expanduser(params.get('static_table_dpath') or default_static_table_dpath)
+        self.file.static_table_csv = listfiles(path=self.dir.static_table_data, full_names=True, ext='.csv') if isdir(self.dir.static_table_data) else []
 
         self.dir.helpers = join(self.dir.home, 'helpers')
         self.dir.qc = join(self.dir.home, 'quality_control')
         self.dir.qc_views = join(self.dir.qc, 'views')
+        self.file.qc_info = join(self.dir.qc, 'qc_info.json')
 
         self.dir.staging = join(self.dir.home, 'staging')
         self.dir.staging_python = join(self.dir.staging, 'python_definitions')
@@ -60,7 +66,7 @@ class WorkflowConfig(object):
             thing = getattr(self.dir, item)
             thing = ensurelist(thing)
             for subthing in thing:
-                if subthing != self.dir.home:
+                if subthing not in [self.dir.home, self.dir.static_table_data]:
                     if not isdir(subthing):
                         raise FileNotFoundError(f'Directory {path(subthing)} is expected but does not exist')
                     else:
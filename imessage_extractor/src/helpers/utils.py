@@ -4,6 +4,16 @@ import re
 import typing
 
 
+def sqlite_uri(fpath: str, mode: str=None) -> str:
+    """
+    Build a SQLite URI filename for a database file, optionally with an access `mode` (i.e.
+    'ro' for read-only). Characters that are legal in paths but meaningful in a URI, such
+    as '?', '#' and '%', are percent-encoded, so they are read as part of the path.
+    """
+    uri = pathlib.Path(fpath).absolute().as_uri()
+    return uri if mode is None else f'{uri}?mode={mode}'
+
+
 def fmt_seconds(time_in_sec: int, units: str='auto', round_digits: int=4) -> dict:
     """
     Format time in seconds to a custom string. `units` parameter can be
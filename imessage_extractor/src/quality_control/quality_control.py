@@ -1,9 +1,15 @@
+import datetime
+import json
 import logging
+import pandas as pd
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 from imessage_extractor.src.chatdb.chatdb import ChatDb
 from imessage_extractor.src.helpers.config import WorkflowConfig
-from imessage_extractor.src.helpers.utils import listfiles
+from imessage_extractor.src.helpers.utils import listfiles, sqlite_uri
 from imessage_extractor.src.helpers.verbosity import code, path
-from os.path import splitext, basename
+from os.path import splitext, basename, expanduser
 
 
 def create_qc_views(chatdb: 'ChatDb', cfg: WorkflowConfig, logger: logging.Logger) -> None:
@@ -20,59 +26,249 @@ def create_qc_views(chatdb: 'ChatDb', cfg: WorkflowConfig, logger: logging.Logge
         logger.info(f'Defined view {code(view_name)}', arrow='black')
 
 
-def run_quality_control(chatdb: 'ChatDb', cfg: WorkflowConfig, logger: logging.Logger) -> None:
+qc_state_table_name = 'meta_qc_state'
+
+# Restrict a QC view to the rows of messages above a message_id high-water mark, by the
+# view's scope key
+scope_filters = dict(
+    message_id='WHERE message_id > {message_id_hwm}',
+    chat_identifier='WHERE chat_identifier IN (SELECT chat_identifier FROM message_user WHERE message_id > {message_id_hwm})',
+)
+
+
+class QCCheck(object):
     """
-    Query each QC view and check for any data integrity issues.
+    Count the rows of one QC view, each of which is a data integrity issue, and keep a
+    bounded sample of them. The view is never read in full.
+
+    If the view declares a `scope_key`, the check can be limited to rows of messages
+    added since a given message_id (see `scope_filters`).
     """
-    logger.info('Checking data integrity...', bold=True, arrow='black')
+    severities = ['info', 'warning', 'error']
+
+    def __init__(self,
+                 view_name: str,
+                 threshold: int=0,
+                 severity: str='warning',
+                 sample_size: int=10,
+                 scope_key: str=None) -> None:
+        if severity not in self.severities:
+            raise ValueError(f'Severity of QC check {code(view_name)} must be one of {self.severities}, not "{severity}"')
+        if scope_key is not None and scope_key not in scope_filters:
+            raise ValueError(f'Scope key of QC check {code(view_name)} must be one of {list(scope_filters)}, not "{scope_key}"')
+
+        self.view_name = view_name
+        self.threshold = threshold
+        self.severity = severity
+        self.sample_size = sample_size
+        self.scope_key = scope_key
+
+        self.scoped = False
+        self.n_issues = None
+        self.sample = []
+        self.elapsed_seconds = None
+
+    @property
+    def failed(self) -> bool:
+        return self.n_issues is not None and self.n_issues > self.threshold
+
+    def run(self, db_path: str, message_id_hwm: int=None) -> 'QCCheck':
+        """
+        Run the check on its own read-only connection, so that checks may run concurrently.
+        If `message_id_hwm` is given and the view has a scope key, only rows of messages
+        above it are checked.
+        """
+        start_ts = time.time()
+        self.scoped = message_id_hwm is not None and self.scope_key is not None
+        where_sql = scope_filters[self.scope_key].format(message_id_hwm=int(message_id_hwm)) if self.scoped else ''
+        sqlite_con = sqlite3.connect(sqlite_uri(db_path, mode='ro'), uri=True, check_same_thread=False)
+
+        try:
+            cursor = sqlite_con.cursor()
+            self.n_issues = cursor.execute(f'SELECT count(*) FROM `{self.view_name}` {where_sql}').fetchone()[0]
+
+            if self.n_issues > 0 and self.sample_size > 0:
+                cursor.execute(f'SELECT * FROM `{self.view_name}` {where_sql} LIMIT {int(self.sample_size)}')
+                columns = [x[0] for x in cursor.description]
+                self.sample = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+        finally:
+            sqlite_con.close()
+
+        self.elapsed_seconds = round(time.time() - start_ts, 4)
+        return self
+
+    def to_dict(self) -> dict:
+        return dict(name=self.view_name,
+                    severity=self.severity,
+                    threshold=self.threshold,
+                    scope_key=self.scope_key,
+                    scoped=self.scoped,
+                    n_issues=self.n_issues,
+                    failed=self.failed,
+                    elapsed_seconds=self.elapsed_seconds,
+                    sample=self.sample)
+
+
+def load_qc_checks(cfg: WorkflowConfig) -> list:
+    """
+    Return a QCCheck for each QC view, configured with its threshold, severity and sample
+    size in qc_info.json. Views without an entry use the defaults, in which any row is a
+    warning.
+    """
+    with open(cfg.file.qc_info, 'r') as f:
+        qc_info = json.load(f)
 
     vw_names = [splitext(basename(f))[0] for f in listfiles(cfg.dir.qc_views, ext='.sql')]
-    total_warnings = 0
+    return [QCCheck(view_name=view_name, **qc_info.get(view_name, dict())) for view_name in vw_names]
 
-    for view_name in vw_names:
-        # Validate the view was successfully defined
-        if not chatdb.view_exists(view_name):
-            raise Exception(f'View {code(view_name)} expected, but does not exist in SQLite')
 
-        qc_df = chatdb.read_table(view_name)
+def log_qc_check(qc_check: QCCheck, logger: logging.Logger) -> None:
+    """
+    Describe a failed QC check at the log level of its severity.
+    """
+    view_name = qc_check.view_name
+    log = dict(info=logger.info, warning=logger.warning, error=logger.error)[qc_check.severity]
 
-        if len(qc_df):
-            # At least one data integrity issue to report
-            total_warnings += 1
+    if view_name == 'qc_duplicate_chat_identifier_defs':
+        log(f"""The following {code('chat_identifier')} values
+        are mapped to multiple names/sources, and only 1 is allowed. Please
+        check the {code('chat_identifier')} in each source, and make sure it is only
+        mapped to one value of {code('contact_name')} in one source.""", arrow='black')
+
+        qc_df = pd.DataFrame(qc_check.sample)
+        chat_ids = qc_df['normalized_identifier'].unique()
+        for chat_id in chat_ids:
+            mapped_names = qc_df[qc_df['normalized_identifier'] == chat_id]['contact_name'].tolist()
+            mapped_sources = qc_df[qc_df['normalized_identifier'] == chat_id]['source'].tolist()
+
+            mappings = [f'name: "{name}" (source: "{source}")' for name, source in zip(mapped_names, mapped_sources)]
+            mappings_str = ' | '.join(mappings)
+
+            log(f'Chat Identifier {code(chat_id)} mapped to: {mappings_str}', arrow='yellow', indent=1)
 
-            if view_name == 'qc_duplicate_chat_identifier_defs':
-                logger.warning(f"""The following {code('chat_identifier')} values
-                are mapped to multiple names/sources, and only 1 is allowed. Please
-                check the {code('chat_identifier')} in each source, and make sure it is only
-                mapped to one value of {code('contact_name')} in one source.""", arrow='black')
+        if qc_check.n_issues > len(qc_check.sample):
+            log(f'...and {qc_check.n_issues - len(qc_check.sample)} more, check {code(view_name)}', arrow='yellow', indent=1)
 
-                chat_ids = qc_df['chat_identifier'].unique()
-                for chat_id in chat_ids:
-                    mapped_names = qc_df[qc_df['chat_identifier'] == chat_id]['contact_name'].tolist()
-                    mapped_sources = qc_df[qc_df['chat_identifier'] == chat_id]['source'].tolist()
+    elif view_name == 'qc_missing_contact_names':
+        log(f'Unmapped {code("chat_identifier")} value(s) found, please check {code(view_name)}', arrow='yellow')
 
-                    mappings = [f'name: "{name}" (source: "{source}")' for name, source in zip(mapped_names, mapped_sources)]
-                    mappings_str = ' | '.join(mappings)
+    elif view_name == 'qc_null_flags':
+        log(
+            f"""{qc_check.n_issues} records found with one or more flag columns as
+            null (should be either True or False). Check {code(view_name)} for
+            more information.""", arrow='yellow', indent=1)
 
-                    logger.warning(f'Chat Identifier {code(chat_id)} mapped to: {mappings_str}', arrow='yellow', indent=1)
+    elif view_name == 'qc_duplicate_message_id':
+        log(f"{qc_check.n_issues} duplicate {code('message_id')} values found in {code('message_user')}", arrow='yellow', indent=1)
 
-            elif view_name == 'qc_missing_contact_names':
-                logger.warning(f'Unmapped {code("chat_identifier")} value(s) found, please check {code(view_name)}', arrow='yellow')
+    elif view_name == 'qc_message_special_types':
+        log(f"{qc_check.n_issues} missing {code('message_special_type')} values found in {code('message_user')}", arrow='yellow', indent=1)
 
-            elif view_name == 'qc_null_flags':
-                logger.warning(
-                    f"""{len(qc_df)} records found with one or more flag columns as
-                    null (should be either True or False). Check {code(view_name)} for
-                    more information.""", arrow='yellow', indent=1)
+    else:
+        log(f'{qc_check.n_issues} QC issue(s) found in {code(view_name)}', arrow='yellow', indent=1)
 
-            elif view_name == 'qc_duplicate_message_id':
-                logger.warning(f"{len(qc_df)} duplicate {code('message_id')} values found in {code('message_user')}", arrow='yellow', indent=1)
 
-            elif view_name == 'qc_message_special_types':
-                logger.warning(f"{len(qc_df)} missing {code('message_special_type')} values found in {code('message_user')}", arrow='yellow', indent=1)
+def read_qc_state(sqlite_con: sqlite3.Connection) -> dict:
+    """
+    Return the state recorded by the previous QC run in this database, i.e. the message_id
+    high-water mark it checked up to and when it last checked every row.
+    """
+    if sqlite_con.execute(f"SELECT count(*) FROM sqlite_master WHERE type='table' AND name='{qc_state_table_name}'").fetchone()[0] == 0:
+        return dict()
+
+    return {k: json.loads(v) for k, v in sqlite_con.execute(f'SELECT key, value FROM {qc_state_table_name}')}
+
+
+def write_qc_state(sqlite_con: sqlite3.Connection, state: dict) -> None:
+    sqlite_con.execute(f'CREATE TABLE IF NOT EXISTS {qc_state_table_name} (key text PRIMARY KEY, value text)')
+    sqlite_con.executemany(f'INSERT OR REPLACE INTO {qc_state_table_name} (key, value) VALUES (?, ?)',
+                           [(k, json.dumps(v)) for k, v in state.items()])
+    sqlite_con.commit()
+
+
+def run_quality_control(chatdb: 'ChatDb',
+                        cfg: WorkflowConfig,
+                        logger: logging.Logger,
+                        report_fpath: str=None,
+                        max_workers: int=4,
+                        incremental: bool=False,
+                        full_sweep: bool=False,
+                        full_sweep_hours: float=24) -> int:
+    """
+    Query each QC view and check for any data integrity issues. Checks count issues
+    rather than reading them, and run concurrently. Return the number of failed checks
+    of warning or error severity, and write a JSON report to `report_fpath`, if given.
+
+    If `incremental`, checks with a scope key only look at messages added since the
+    previous successful QC run, that is one without any failed error-severity checks.
+    Every row is still checked if `full_sweep`, if there is no previous run, or if the
+    last full sweep is more than `full_sweep_hours` old.
+    """
+    logger.info('Checking data integrity...', bold=True, arrow='black')
+
+    qc_checks = load_qc_checks(cfg)
+
+    for qc_check in qc_checks:
+        # Validate the view was successfully defined
+        if not chatdb.view_exists(qc_check.view_name):
+            raise Exception(f'View {code(qc_check.view_name)} expected, but does not exist in SQLite')
+
+    # Checks read the database on their own connections, so must see everything written so far
+    chatdb.sqlite_con.commit()
+
+    qc_state = read_qc_state(chatdb.sqlite_con)
+    last_full_sweep_ts = qc_state.get('last_full_sweep_ts')
+    if chatdb.table_or_view_exists('message_user'):
+        max_message_id = chatdb.sqlite_con.execute('SELECT max(message_id) FROM message_user').fetchone()[0]
+    else:
+        max_message_id = None
+
+    if (incremental
+            and not full_sweep
+            and qc_state.get('message_id_hwm') is not None
+            and last_full_sweep_ts is not None
+            and time.time() - last_full_sweep_ts < full_sweep_hours * 3600):
+        message_id_hwm = qc_state['message_id_hwm']
+        logger.info(f'Checking messages since {code("message_id")} {message_id_hwm}', arrow='black')
+    else:
+        message_id_hwm = None
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(qc_checks)))) as executor:
+        list(executor.map(lambda qc_check: qc_check.run(chatdb.db_path, message_id_hwm=message_id_hwm), qc_checks))
+
+    total_warnings = 0
+    for qc_check in qc_checks:
+        if qc_check.failed:
+            # At least one data integrity issue to report
+            if qc_check.severity != 'info':
+                total_warnings += 1
+
+            log_qc_check(qc_check, logger)
 
         else:
             # No QC issues to report
-            logger.info(f'No QC issues found in {code(view_name)}', arrow='black')
+            logger.info(f'No QC issues found in {code(qc_check.view_name)}', arrow='black')
+
+    # Failed error-severity checks are reported again by the next run, until resolved
+    if not any(qc_check.failed and qc_check.severity == 'error' for qc_check in qc_checks):
+        qc_state['message_id_hwm'] = max_message_id
+        if message_id_hwm is None:
+            qc_state['last_full_sweep_ts'] = time.time()
+
+        write_qc_state(chatdb.sqlite_con, qc_state)
+
+    if report_fpath is not None:
+        report_fpath = expanduser(report_fpath)
+        report = dict(created_at=datetime.datetime.now().isoformat(timespec='seconds'),
+                      db_path=chatdb.db_path,
+                      scope='full' if message_id_hwm is None else f'message_id > {message_id_hwm}',
+                      total_warnings=total_warnings,
+                      checks=[qc_check.to_dict() for qc_check in qc_checks])
+
+        with open(report_fpath, 'w') as f:
+            json.dump(report, f, indent=4, default=str)
+
+        logger.info(f'Saved QC report to {path(report_fpath)}', arrow='black')
 
-    return total_warnings
\ No newline at end of file
+    return total_warnings
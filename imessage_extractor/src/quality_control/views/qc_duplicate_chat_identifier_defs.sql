@@ -1,6 +1,7 @@
 /*
 Find chat identifiers, if any, that are defined in any two or more
-of the following source:
+of the following source (compared by their normalized form, so that
+'(415) 555-0100' and '+14155550100' are the same identifier):
 
   1. Contact group names view (based on the `group_title`) column
      of the 'message' chat.db table
@@ -23,29 +24,31 @@ drop view if exists qc_duplicate_chat_identifier_defs;
 create view qc_duplicate_chat_identifier_defs as
 
 with all_contacts as (
-    select chat_identifier, group_name as contact_name, 1 as priority, 'contact_group_names' as source
+    select chat_identifier, chat_identifier as normalized_identifier, group_name as contact_name, 1 as priority, 'contact_group_names' as source
     from contact_group_names
 
     union
 
-    select chat_identifier, contact_name, 2 as priority, 'contacts_manual' as source
-    from contacts_manual
+    select cm.chat_identifier, coalesce(n.normalized_identifier, cm.chat_identifier) as normalized_identifier, cm.contact_name, 2 as priority, 'contacts_manual' as source
+    from contacts_manual cm
+    left join normalized_identifiers n
+      on cm.chat_identifier = n.chat_identifier
 
     union
 
-    select chat_identifier, contact_name, 3 as priority, 'contacts' as source
+    select chat_identifier, normalized_identifier, contact_name, 3 as priority, 'contacts' as source
     from contacts
 ),
 
 duplicate_contacts as (
-    select chat_identifier, count(*) as n
+    select normalized_identifier, count(*) as n
     from all_contacts
-    group by chat_identifier
+    group by normalized_identifier
     having count(*) > 1
 )
 
-select ac.chat_identifier, ac.contact_name, ac.priority, ac.source
+select ac.normalized_identifier, ac.chat_identifier, ac.contact_name, ac.priority, ac.source
 from all_contacts ac
 join duplicate_contacts dc
-  on ac.chat_identifier = dc.chat_identifier
-order by ac.chat_identifier, priority
+  on ac.normalized_identifier = dc.normalized_identifier
+order by ac.normalized_identifier, priority
\ No newline at end of file
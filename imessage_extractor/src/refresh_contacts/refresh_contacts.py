@@ -1,39 +1,72 @@
+import functools
+import hashlib
+import json
 import logging
-import numpy as np
 import pandas as pd
 import phonenumbers
+import re
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+from imessage_extractor.src.helpers.utils import sqlite_uri
 from imessage_extractor.src.helpers.verbosity import logger_setup, path, code
-from os import walk
-from os.path import expanduser, abspath, join, dirname, splitext
+from os import makedirs, remove, stat
+from os.path import expanduser, abspath, join, isfile
 
 
-target_fpath = abspath(join(dirname(dirname(__file__)), 'static_tables', 'data', 'contacts.csv'))
+default_cache_dpath = expanduser('~/.cache/imessage_extractor/address_book')
+
+phone_number_pattern = re.compile(r'^\+?[\d\s().\-]+$')
 
 
 def list_address_book_db_fpaths(dpath: str) -> list:
     """
     Search the address book home filepath for .abcddb files and return the filepaths
-    as a list.
+    as a list. Sources live at most two folders deep (i.e. Sources/<uuid>/AddressBook-v22.abcddb),
+    so the rest of the tree, such as contact images, is not walked.
     """
     db_fpaths = []
-    for root, dpaths, filenames in walk(dpath):
-        for f in filenames:
-            if splitext(f)[1] == '.abcddb':
-                db_fpaths.append(join(root, f).replace('./', ''))
+    for pattern in ['*.abcddb', join('*', '*.abcddb'), join('Sources', '*', '*.abcddb')]:
+        for fpath in sorted(glob(join(dpath, pattern))):
+            if fpath not in db_fpaths:
+                db_fpaths.append(fpath)
 
     return db_fpaths
 
 
+def source_fingerprint(db_fpath: str) -> list:
+    """
+    Return the path, mtime and size of an address book database and of its -wal file, if
+    any, which together change whenever Contacts.app writes to it.
+    """
+    fingerprint = [db_fpath]
+    for fpath in [db_fpath, db_fpath + '-wal']:
+        if isfile(fpath):
+            stat_result = stat(fpath)
+            fingerprint += [stat_result.st_mtime, stat_result.st_size]
+
+    return fingerprint
+
+
+def read_address_book_db(db_fpath: str, sep: str=';') -> pd.DataFrame:
+    """
+    Read contacts from one address book database, opened read-only.
+    """
+    db_con = sqlite3.connect(sqlite_uri(db_fpath, mode='ro'), uri=True)
+    df = get_contacts_from_db(db_con, sep=sep)
+    db_con.close()
+    return df
+
+
 def get_contacts_from_db(db_con: sqlite3.Connection, sep: str=';') -> pd.DataFrame:
     """
     Get a dataframe with columns first_name, last_name, email, phone number
     from a given database connection.
     """
-    db_record = pd.read_sql('select * from ZABCDRECORD', con=db_con)
+    db_record = pd.read_sql('select Z_PK, ZFIRSTNAME, ZLASTNAME from ZABCDRECORD', con=db_con)
     db_record = db_record.fillna('').set_index('Z_PK')
-    db_phone_number = pd.read_sql('select * from ZABCDPHONENUMBER', con=db_con)
-    db_email = pd.read_sql('select * from ZABCDEMAILADDRESS', con=db_con)
+    db_phone_number = pd.read_sql('select ZOWNER, ZFULLNUMBER from ZABCDPHONENUMBER', con=db_con)
+    db_email = pd.read_sql('select ZOWNER, ZADDRESS from ZABCDEMAILADDRESS', con=db_con)
 
     emails = (
         db_record
@@ -77,139 +110,231 @@ def get_contacts_from_db(db_con: sqlite3.Connection, sep: str=';') -> pd.DataFra
     return contacts_compact
 
 
-def extract_phone_number(raw_string: str, sep: str=';') -> dict:
+def split_identifiers(raw_strings: pd.Series, sep: str=';') -> pd.Series:
     """
-    Extract all phone number(s) in a given row. Input format will be...
+    Split separated phone number or email strings, i.e.
 
         (XXX) XXX-XXXX;(XXX) XXX-XXXX;...
 
-    ...with an arbitrary number of phone numbers. Return all phone numbersas a list.
+    ...with an arbitrary number of values, into one row per value. The index of
+    `raw_strings` is repeated for each value, and null or empty values are dropped.
     """
-    if isinstance(raw_string, str):
-        return raw_string.split(sep)
-    elif np.isnan(raw_string):
-        return {}
-    else:
-        return {}
+    identifiers = raw_strings.dropna().str.split(sep).explode()
+    return identifiers[identifiers.str.len() > 0]
 
 
-def extract_email(raw_string: str, sep:str=';') -> dict:
+@functools.lru_cache(maxsize=None)
+def normalize_identifier(identifier: str) -> str:
     """
-    Apply the same extractions as extract_phone_number().
+    Return the canonical form of a chat identifier or contact phone number/email, so that
+    the same person matches however their number was typed: phone numbers are formatted as
+    E.164 (i.e. '(415) 555-0100' -> '+14155550100'), and emails are lowercased. Anything
+    else, such as group chat identifiers ('chat123...') or short codes, is returned
+    stripped but otherwise unchanged. Each distinct value is parsed once per process.
     """
-    return extract_phone_number(raw_string, sep)
+    if not isinstance(identifier, str):
+        return identifier
 
+    identifier = identifier.strip()
 
-def variate_phone_number(phone_number: str) -> list:
-        """
-        Use the phonenumbers package to return a set of phone number variations
-        that can be used to match iMessages with, since the iMessage app can
-        record the contact's phone number in a variety of formats.
-        """
-        pn_obj = phonenumbers.parse(phone_number, 'US')
+    if '@' in identifier:
+        return identifier.lower()
 
-        return [
-            phonenumbers.format_number(pn_obj, phonenumbers.PhoneNumberFormat.E164),
-            phonenumbers.format_number(pn_obj, phonenumbers.PhoneNumberFormat.NATIONAL),
-            phonenumbers.format_number(pn_obj, phonenumbers.PhoneNumberFormat.INTERNATIONAL),
-        ]
+    if phone_number_pattern.match(identifier) and len(re.sub(r'\D', '', identifier)) >= 7:
+        try:
+            pn_obj = phonenumbers.parse(identifier, 'US')
+        except phonenumbers.NumberParseException:
+            return identifier
 
+        if phonenumbers.is_possible_number(pn_obj):
+            return phonenumbers.format_number(pn_obj, phonenumbers.PhoneNumberFormat.E164)
 
-def refresh_contacts(logger: logging.Logger) -> None:
+    return identifier
+
+
+def build_contact_map(df: pd.DataFrame, sep: str=';') -> pd.DataFrame:
+    """
+    Build the contact map from address book records with columns first_name, last_name,
+    email and phone_number, where emails and phone numbers are `sep`-separated strings.
+    Return one row per contact_name and normalized_identifier, along with the identifier
+    as it appears in the address book and its identifier_type.
     """
-    Refresh contacts.csv located in the 'static_tables' directory from the Address Book
-    local database.
+    contact_map_cols = ['contact_name', 'chat_identifier', 'normalized_identifier', 'identifier_type']
 
-    contact_name: chat_identifier
+    # Filter out these values of "Full Name"
+    ignore_full_names = ['Error']
 
-    Where 'contact_name' is the contact's full name (i.e. 'John Smith'), and 'chat_identifier'
-    can be either a phone number or an email address. Split rows in the raw export that are
-    semicolon-separated.
+    df = df.assign(contact_name=df['first_name'] + ' ' + df['last_name'])
+    df = df[~df['contact_name'].isin(ignore_full_names)]
+
+    phone_numbers = split_identifiers(df['phone_number'], sep=sep)
+    emails = split_identifiers(df['email'], sep=sep)
+
+    contact_map_df = pd.concat([
+        pd.DataFrame(dict(contact_name=df['contact_name'].loc[phone_numbers.index], chat_identifier=phone_numbers, identifier_type='phone')),
+        pd.DataFrame(dict(contact_name=df['contact_name'].loc[emails.index], chat_identifier=emails, identifier_type='email')),
+    ], axis=0)
+
+    normalized = pd.Series({x: normalize_identifier(x) for x in contact_map_df['chat_identifier'].unique()}, dtype=object)
+    contact_map_df['normalized_identifier'] = contact_map_df['chat_identifier'].map(normalized)
+    contact_map_df = contact_map_df[contact_map_cols]
+
+    # Ensure only populated contact names remain, and keep one row per way of reaching
+    # each contact
+    contact_map_df = contact_map_df[~contact_map_df['contact_name'].isnull()]
+    contact_map_df = contact_map_df.drop_duplicates(subset=['contact_name', 'normalized_identifier'])
+    return contact_map_df.sort_values('contact_name', kind='stable').reset_index(drop=True)
+
+
+def cache_version() -> str:
     """
-    sep=';'
+    Version of the cached contacts, i.e. a hash of the code in this module that reads and
+    normalizes them (`read_address_book_db()`, `build_contact_map()`,
+    `normalize_identifier()`, etc.), and of the pandas version that pickles them.
+    """
+    with open(__file__, 'rb') as f:
+        return hashlib.md5(f.read() + pd.__version__.encode('utf-8')).hexdigest()
 
-    # Get address boook contacts (first/last name, email, phone number). Where the user
-    # has multiple emails or phone numbers, concatenate into a separated string
-    address_book_home_dpath = expanduser('~/Library/Application Support/AddressBook')
-    address_book_db_fpaths = list_address_book_db_fpaths(address_book_home_dpath)
-
-    contacts_compact_lst = []
-    for db_fpath in address_book_db_fpaths:
-        logger.debug(f'Reading db {path(db_fpath)}', arrow='black')
-        db_con = sqlite3.connect(db_fpath)
-        df = get_contacts_from_db(db_con, sep=sep)
-        contacts_compact_lst.append(df)
-        db_con.close()
-
-    if not len(contacts_compact_lst):
-        raise Exception('Executing application does not have full disk access. Remedy this in System Preferences > Security > Full Disk Access.')
 
-    df = pd.concat(contacts_compact_lst, axis=0)[['first_name', 'last_name', 'email', 'phone_number']].drop_duplicates()
-    n_unique_contacts = df[['first_name', 'last_name']].drop_duplicates().shape[0]
-    logger.info(f'Read {n_unique_contacts} records from Contacts app', arrow='black')
+class AddressBookCache(object):
+    """
+    Cache each address book source's contacts on disk, keyed by the source's fingerprint
+    (see `source_fingerprint()`), so that unchanged sources are not read again. The cache
+    is discarded if the code that parsed it has changed (see `cache_version()`).
+    """
+    def __init__(self, cache_dpath: str, address_book_dpath: str) -> None:
+        # Separate caches for separate address books, i.e. a synthetic one for testing
+        self.dpath = join(cache_dpath, hashlib.md5(address_book_dpath.encode('utf-8')).hexdigest()[:12])
+        self.index_fpath = join(self.dpath, 'index.json')
+        self.contacts_fpath = join(self.dpath, 'contacts.pkl')
+        makedirs(self.dpath, exist_ok=True)
+
+        self.index = dict(version=cache_version(), sources=dict(), contacts_fingerprint=None)
+        if isfile(self.index_fpath):
+            with open(self.index_fpath, 'r') as f:
+                index = json.load(f)
+
+            # Sources cached by a previous version are forgotten, and reread
+            if index.get('version') == self.index['version']:
+                self.index = index
+
+    def source_fpath(self, db_fpath: str) -> str:
+        return join(self.dpath, hashlib.md5(db_fpath.encode('utf-8')).hexdigest() + '.pkl')
+
+    def get(self, db_fpath: str, fingerprint: list) -> pd.DataFrame:
+        """
+        Return the cached contacts for a source, or None if the source has changed.
+        """
+        if self.index['sources'].get(db_fpath) == fingerprint and isfile(self.source_fpath(db_fpath)):
+            return pd.read_pickle(self.source_fpath(db_fpath))
 
-    # Create contact map (output dataframe) in format `chat_identifier`: `contact_name`,
-    # where `chat_identifier` is the contact's phone number or email, and `contact_name`
-    # is the contact's display name in clear text.
-    contact_map_cols = ['contact_name', 'chat_identifier', 'identifier_type']
-    contact_map_df = pd.DataFrame(columns=contact_map_cols)
+    def put(self, db_fpath: str, fingerprint: list, df: pd.DataFrame) -> None:
+        df.to_pickle(self.source_fpath(db_fpath))
+        self.index['sources'][db_fpath] = fingerprint
 
-    #
-    # Iterate over each row in the exported .csv file and process them sequentially
-    #
+    def prune(self, db_fpaths: list) -> None:
+        """
+        Forget sources that no longer exist.
+        """
+        for db_fpath in [x for x in self.index['sources'] if x not in db_fpaths]:
+            del self.index['sources'][db_fpath]
+            if isfile(self.source_fpath(db_fpath)):
+                remove(self.source_fpath(db_fpath))
 
-    # Filter out these values of "Full Name"
-    ignore_full_names = ['Error']
+    def get_contacts(self, fingerprint: list) -> pd.DataFrame:
+        """
+        Return the contact map built from the address book's sources, or None if any source
+        has changed since it was built.
+        """
+        if self.index['contacts_fingerprint'] == fingerprint and isfile(self.contacts_fpath):
+            return pd.read_pickle(self.contacts_fpath)
 
-    n_unique_contacts = 0
-    n_invalid_contacts = 0
-    for i, row in df.iterrows():
-        name = row['first_name'] + ' ' + row['last_name']
+    def put_contacts(self, fingerprint: list, contact_map_df: pd.DataFrame) -> None:
+        contact_map_df.to_pickle(self.contacts_fpath)
+        self.index['contacts_fingerprint'] = fingerprint
 
-        if name in ignore_full_names:
-            n_invalid_contacts += 1
+    def save(self) -> None:
+        with open(self.index_fpath, 'w') as f:
+            json.dump(self.index, f)
 
-        else:
-            n_unique_contacts += 1
-            pn_lst_original = extract_phone_number(row['phone_number'], sep=sep)
-            pn_lst_variated = []
 
-            for pn_string in pn_lst_original:
-                # Get all possible variations of this phone number
-                pn_variations = variate_phone_number(pn_string)
+def refresh_contacts(address_book_dpath: str,
+                     logger: logging.Logger,
+                     cache_dpath: str=default_cache_dpath,
+                     max_workers: int=8,
+                     csv_fpath: str=None) -> pd.DataFrame:
+    """
+    Build the contact map from the Address Book local database(s) found in `address_book_dpath`.
 
-                # Append each variation to a recording dictionary
-                for variation in pn_variations:
-                    if variation not in pn_lst_variated:
-                        pn_lst_variated.append(variation)
+    contact_name: chat_identifier
 
-            phone_number_df = pd.DataFrame(pn_lst_variated)
-            if len(phone_number_df):
-                phone_number_df.columns = ['chat_identifier']
-            else:
-                phone_number_df = pd.DataFrame(columns=['chat_identifier'])
-            phone_number_df['contact_name'] = name
-            phone_number_df['identifier_type'] = 'phone'
-            phone_number_df = phone_number_df[contact_map_cols]
-
-            email_lst = extract_email(row['email'], sep=sep)
-            email_df = pd.DataFrame(email_lst)
-            if len(email_df):
-                email_df.columns = ['chat_identifier']
-            else:
-                email_df = pd.DataFrame(columns=['chat_identifier'])
-            email_df['contact_name'] = name
-            email_df['identifier_type'] = 'email'
-            email_df = email_df[contact_map_cols]
+    Where 'contact_name' is the contact's full name (i.e. 'John Smith'), and 'chat_identifier'
+    can be either a phone number or an email address. Split rows in the raw export that are
+    semicolon-separated.
 
-            contact_df = pd.concat([phone_number_df, email_df], axis=0)[contact_map_cols]
-            contact_map_df = pd.concat([contact_map_df, contact_df], axis=0)
+    Sources are read concurrently, and each is cached in `cache_dpath` until it changes. If
+    no source has changed, the cached contact map is returned as-is. Pass `cache_dpath=None`
+    to always read every source. The contact map is also written to `csv_fpath`, if given.
+    """
+    sep=';'
 
+    # Get address boook contacts (first/last name, email, phone number). Where the user
+    # has multiple emails or phone numbers, concatenate into a separated string
+    address_book_dpath = abspath(expanduser(address_book_dpath))
+    address_book_db_fpaths = list_address_book_db_fpaths(address_book_dpath)
 
-    # Ensure only populated contact names remain
-    contact_map_df = contact_map_df[~contact_map_df['contact_name'].isnull()]
-    contact_map_df = contact_map_df.drop_duplicates().sort_values('contact_name')
+    if not len(address_book_db_fpaths):
+        raise Exception('Executing application does not have full disk access. Remedy this in System Preferences > Security > Full Disk Access.')
 
-    # Output to target destination
-    contact_map_df.to_csv(target_fpath, index=False)
-    logger.info(f'Saved {path(target_fpath)}', arrow='black')
+    fingerprints = {db_fpath: source_fingerprint(db_fpath) for db_fpath in address_book_db_fpaths}
+    contacts_fingerprint = [fingerprints[x] for x in address_book_db_fpaths]
+    cache = AddressBookCache(expanduser(cache_dpath), address_book_dpath) if cache_dpath is not None else None
+
+    contact_map_df = None
+    if cache is not None:
+        cache.prune(address_book_db_fpaths)
+        contact_map_df = cache.get_contacts(contacts_fingerprint)
+        if contact_map_df is not None:
+            logger.info('No changes to Contacts app sources, using cached contacts', arrow='black')
+
+    if contact_map_df is None:
+        contacts_compact = {}
+        changed_db_fpaths = []
+        for db_fpath in address_book_db_fpaths:
+            cached_df = cache.get(db_fpath, fingerprints[db_fpath]) if cache is not None else None
+            if cached_df is not None:
+                logger.debug(f'Using cached contacts for unchanged db {path(db_fpath)}', arrow='black')
+                contacts_compact[db_fpath] = cached_df
+            else:
+                changed_db_fpaths.append(db_fpath)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(changed_db_fpaths)))) as executor:
+            for db_fpath, df in zip(changed_db_fpaths, executor.map(functools.partial(read_address_book_db, sep=sep), changed_db_fpaths)):
+                logger.debug(f'Read db {path(db_fpath)}', arrow='black')
+                contacts_compact[db_fpath] = df
+                if cache is not None:
+                    cache.put(db_fpath, fingerprints[db_fpath], df)
+
+        logger.info(f'Read {len(changed_db_fpaths)} of {len(address_book_db_fpaths)} Contacts app source(s), the rest were unchanged', arrow='black')
+
+        contacts_compact_lst = [contacts_compact[x] for x in address_book_db_fpaths]
+        df = pd.concat(contacts_compact_lst, axis=0)[['first_name', 'last_name', 'email', 'phone_number']].drop_duplicates()
+        df = df.reset_index(drop=True)
+        n_unique_contacts = df[['first_name', 'last_name']].drop_duplicates().shape[0]
+        logger.info(f'Read {n_unique_contacts} records from Contacts app', arrow='black')
+
+        # Create contact map (output dataframe) in format `chat_identifier`: `contact_name`,
+        # where `chat_identifier` is the contact's phone number or email, and `contact_name`
+        # is the contact's display name in clear text.
+        contact_map_df = build_contact_map(df, sep=sep)
+
+        if cache is not None:
+            cache.put_contacts(contacts_fingerprint, contact_map_df)
+            cache.save()
+
+    if csv_fpath is not None:
+        csv_fpath = expanduser(csv_fpath)
+        contact_map_df.to_csv(csv_fpath, index=False)
+        logger.info(f'Saved {path(csv_fpath)}', arrow='black')
+
+    return contact_map_df
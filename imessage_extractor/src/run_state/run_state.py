@@ -0,0 +1,102 @@
+import json
+import logging
+import sqlite3
+import time
+from imessage_extractor.src.chatdb.chatdb import ChatDb
+from imessage_extractor.src.helpers.utils import sqlite_uri
+from imessage_extractor.src.helpers.verbosity import code, path
+from imessage_extractor.src.refresh_contacts.refresh_contacts import source_fingerprint
+from os.path import isfile, expanduser
+
+
+run_table_name = 'meta_run'
+run_state_table_name = 'meta_run_state'
+
+
+def chatdb_fingerprint(native_chatdb_paths: list) -> list:
+    """
+    Return a value that changes whenever any of the native chat.db files is written to.
+    """
+    return [source_fingerprint(expanduser(x)) for x in native_chatdb_paths]
+
+
+def find_resumable_run(db_path: str, fingerprint: list, logger: logging.Logger) -> int:
+    """
+    Return the ID of the last run recorded in the output database at `db_path` if it did not
+    complete and was run against the same chat.db sources (as given by `chatdb_fingerprint()`),
+    or None if there is no such run to resume.
+    """
+    if not isfile(db_path):
+        logger.info(f'No output database at {path(db_path)} to resume, starting over', arrow='black')
+        return None
+
+    sqlite_con = sqlite3.connect(sqlite_uri(db_path, mode='ro'), uri=True)
+
+    try:
+        if sqlite_con.execute(f"SELECT count(*) FROM sqlite_master WHERE type='table' AND name='{run_table_name}'").fetchone()[0] == 0:
+            logger.info('No previous run recorded in the output database, starting over', arrow='black')
+            return None
+
+        run = sqlite_con.execute(f'SELECT run_id, source_fingerprint, completed_at FROM {run_table_name} ORDER BY run_id DESC LIMIT 1').fetchone()
+
+    finally:
+        sqlite_con.close()
+
+    if run is None or run[2] is not None:
+        logger.info('The previous run completed, so there is nothing to resume, starting over', arrow='black')
+        return None
+
+    if json.loads(run[1]) != json.loads(json.dumps(fingerprint)):
+        logger.warning('chat.db has changed since the previous run failed, so it cannot be resumed, starting over', arrow='yellow')
+        return None
+
+    logger.info(f'Resuming run {run[0]}', arrow='black')
+    return run[0]
+
+
+class RunState(object):
+    """
+    Record the progress of a `go` run in the output database: the run itself and the chat.db
+    sources it was run against in `meta_run`, and each completed stage, or object within a
+    stage, in `meta_run_state`. A run that fails can then be resumed from where it stopped.
+    """
+    def __init__(self, chatdb: 'ChatDb', logger: logging.Logger, fingerprint: list, run_id: int=None) -> None:
+        self.chatdb = chatdb
+        self.logger = logger
+
+        self.chatdb.execute(f"""
+            create table if not exists {run_table_name} (run_id integer primary key, source_fingerprint text, started_at real, completed_at real);
+            create table if not exists {run_state_table_name} (run_id integer, stage text, object_name text, completed_at real, primary key (run_id, stage, object_name));
+        """)
+
+        if run_id is None:
+            cursor = self.chatdb.sqlite_con.cursor()
+            cursor.execute(f'INSERT INTO {run_table_name} (source_fingerprint, started_at) VALUES (?, ?)', (json.dumps(fingerprint), time.time()))
+            self.chatdb.sqlite_con.commit()
+            run_id = cursor.lastrowid
+
+        self.run_id = run_id
+
+    def completed(self, stage: str) -> list:
+        """
+        List the objects completed within a stage, where the stage as a whole is recorded
+        with an empty object name.
+        """
+        return [x[0] for x in self.chatdb.sqlite_con.execute(
+            f'SELECT object_name FROM {run_state_table_name} WHERE run_id = ? AND stage = ?', (self.run_id, stage))]
+
+    def is_complete(self, stage: str, object_name: str='') -> bool:
+        return object_name in self.completed(stage)
+
+    def complete(self, stage: str, object_name: str='') -> None:
+        self.chatdb.sqlite_con.execute(
+            f'INSERT OR REPLACE INTO {run_state_table_name} (run_id, stage, object_name, completed_at) VALUES (?, ?, ?, ?)',
+            (self.run_id, stage, object_name, time.time()))
+        self.chatdb.sqlite_con.commit()
+
+        if object_name == '':
+            self.logger.debug(f'Completed stage {code(stage)} of run {self.run_id}')
+
+    def finish(self) -> None:
+        self.chatdb.sqlite_con.execute(f'UPDATE {run_table_name} SET completed_at = ? WHERE run_id = ?', (time.time(), self.run_id))
+        self.chatdb.sqlite_con.commit()
@@ -0,0 +1,269 @@
+import json
+import logging
+import re
+import sqlite3
+import time
+from imessage_extractor.src.chatdb.chatdb import ChatDb
+from imessage_extractor.src.helpers.config import WorkflowConfig
+from imessage_extractor.src.helpers.utils import strip_ws, ensurelist, fmt_seconds, sqlite_uri
+from imessage_extractor.src.helpers.verbosity import code, bold
+from os.path import join
+
+
+sqlite_typeof_arrow_types = dict(integer='int64', real='float64', text='string', blob='binary')
+
+duckdb_sqlite_types = {
+    'BOOLEAN': 'integer',
+    'TINYINT': 'integer',
+    'SMALLINT': 'integer',
+    'INTEGER': 'integer',
+    'BIGINT': 'integer',
+    'HUGEINT': 'integer',
+    'UTINYINT': 'integer',
+    'USMALLINT': 'integer',
+    'UINTEGER': 'integer',
+    'UBIGINT': 'integer',
+    'FLOAT': 'real',
+    'DOUBLE': 'real',
+    'BLOB': 'blob',
+}
+
+
+def list_rollups(cfg: 'WorkflowConfig', only: list=None) -> tuple:
+    """
+    Return the staging objects flagged as rollups in staging_sql_info.json, ordered so that
+    each rollup comes after any rollups it references, along with the objects that those
+    rollups read from. If `only` is given, just the rollups in it are returned, and the
+    others they reference are read as inputs.
+    """
+    with open(cfg.file.staging_sql_info, 'r') as f:
+        staging_sql_info = json.load(f)
+
+    rollups = [k for k, v in staging_sql_info.items() if v.get('rollup', False)]
+
+    ordered = []
+    def visit(rollup_name: str) -> None:
+        if rollup_name not in ordered:
+            for ref in ensurelist(staging_sql_info[rollup_name]['reference']):
+                if ref in rollups:
+                    visit(ref)
+
+            ordered.append(rollup_name)
+
+    for rollup_name in rollups:
+        visit(rollup_name)
+
+    if only is not None:
+        ordered = [x for x in ordered if x in only]
+
+    inputs = []
+    for rollup_name in ordered:
+        for ref in ensurelist(staging_sql_info[rollup_name]['reference']):
+            if ref is not None and ref not in ordered and ref not in inputs:
+                inputs.append(ref)
+
+    return ordered, inputs
+
+
+def extract_select_sql(def_sql: str, table_name: str) -> str:
+    """
+    Return the query body of a staging view definition, i.e. everything after
+    `create view <table_name> as`.
+    """
+    match = re.search(rf'create\s+view\s+`?{table_name}`?\s+as\s', def_sql, flags=re.IGNORECASE)
+    if match is None:
+        raise ValueError(f'Could not find a {code("create view ... as")} statement for {code(table_name)}')
+
+    return def_sql[match.end():].strip().rstrip(';')
+
+
+def sqlite_to_arrow_reader(db_path: str, table_name: str, batch_size: int):
+    """
+    Stream a SQLite table or view as an Arrow RecordBatchReader. Column types are taken
+    from each column's first non-null value, as SQLite views do not reliably declare them.
+    DuckDB pulls batches from its own worker threads, so the reader uses a dedicated
+    read-only connection.
+    """
+    import pyarrow as pa
+
+    sqlite_con = sqlite3.connect(sqlite_uri(db_path, mode='ro'), uri=True, check_same_thread=False)
+    cursor = sqlite_con.cursor()
+    cursor.execute(f'SELECT * FROM `{table_name}` LIMIT 0')
+    columns = [x[0] for x in cursor.description]
+
+    fields = []
+    for col in columns:
+        row = sqlite_con.execute(f'SELECT typeof(`{col}`) FROM `{table_name}` WHERE `{col}` IS NOT NULL LIMIT 1').fetchone()
+        arrow_type = sqlite_typeof_arrow_types[row[0]] if row is not None else 'string'
+        fields.append(pa.field(col, pa.type_for_alias(arrow_type)))
+
+    schema = pa.schema(fields)
+
+    def batches():
+        cursor.execute(f'SELECT * FROM `{table_name}`')
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not len(rows):
+                break
+
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            yield pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+        sqlite_con.close()
+
+    return pa.RecordBatchReader.from_batches(schema, batches())
+
+
+def attach_sqlite(duckdb_con, db_path: str, logger: logging.Logger) -> bool:
+    """
+    Attach the output database to DuckDB with the sqlite extension, returning False if the
+    extension is not available (it is downloaded on first use).
+    """
+    try:
+        duckdb_con.install_extension('sqlite')
+        duckdb_con.load_extension('sqlite')
+        quoted_db_path = db_path.replace("'", "''")
+        duckdb_con.execute(f"ATTACH '{quoted_db_path}' AS sqlite_db (TYPE sqlite, READ_ONLY)")
+        return True
+    except Exception as e:
+        logger.debug(f'DuckDB sqlite extension unavailable ({e}), streaming inputs through Arrow instead')
+        return False
+
+
+def create_rollup_indexes(cursor: sqlite3.Cursor, table_name: str, indexes: list=None) -> None:
+    """
+    Create each of `indexes` (a column, or a list of columns) on a materialized rollup, as
+    declared for the rollup in staging_sql_info.json.
+    """
+    for index_columns in [ensurelist(x) for x in indexes or []]:
+        index_name = '_'.join([table_name] + index_columns)
+        cursor.execute(f'CREATE INDEX `{index_name}` ON `{table_name}` ({", ".join(f"`{x}`" for x in index_columns)})')
+
+
+def run_rollups_sqlite(chatdb: 'ChatDb', cfg: 'WorkflowConfig', logger: logging.Logger, only: list=None) -> None:
+    """
+    Compute the rollup staging objects in SQLite and store each as an indexed table,
+    replacing the SQLite view of the same name. The app filters rollups by contact and date
+    on every page control change, which then reads just the matching rows through an index,
+    rather than aggregating `message_user` again. Rollups that reference other rollups read
+    the table materialized before them. If `only` is given, just the rollups in it are
+    computed.
+    """
+    start_ts = time.time()
+    rollups, _ = list_rollups(cfg, only=only)
+
+    with open(cfg.file.staging_sql_info, 'r') as f:
+        staging_sql_info = json.load(f)
+
+    for rollup_name in rollups:
+        with open(join(cfg.dir.staging_sql, rollup_name + '.sql'), 'r') as f:
+            select_sql = extract_select_sql(f.read(), rollup_name)
+
+        cursor = chatdb.sqlite_con.cursor()
+        cursor.execute(f'DROP VIEW IF EXISTS `{rollup_name}`')
+        cursor.execute(f'DROP TABLE IF EXISTS `{rollup_name}`')
+        cursor.execute(f'CREATE TABLE `{rollup_name}` AS {select_sql}')
+        create_rollup_indexes(cursor, rollup_name, indexes=staging_sql_info[rollup_name].get('indexes'))
+        chatdb.sqlite_con.commit()
+        logger.info(f'Materialized rollup {code(rollup_name)}', arrow='black')
+
+    diff_formatted = fmt_seconds(time.time() - start_ts, units='auto', round_digits=2)
+    elapsed_time = f"{diff_formatted['value']} {diff_formatted['units']}"
+    logger.info(f'Computed {len(rollups)} rollups with SQLite in {bold(elapsed_time)}', arrow='black')
+
+
+def run_rollups_duckdb(chatdb: 'ChatDb',
+                       cfg: 'WorkflowConfig',
+                       logger: logging.Logger,
+                       threads: int=None,
+                       batch_size: int=50000,
+                       only: list=None) -> None:
+    """
+    Compute the rollup staging objects in an embedded DuckDB database and write each result
+    back to the output database as a SQLite table, replacing the SQLite view of the same name.
+
+    Rollups are large scan-and-group queries which SQLite evaluates on a single core. DuckDB
+    runs the same SQL with vectorized, multi-threaded execution. Inputs (the non-rollup objects
+    that rollups reference) are loaded from SQLite once, and rollups that reference other
+    rollups read DuckDB's materialized result rather than recomputing it. If `only` is
+    given, just the rollups in it are computed.
+    """
+    try:
+        import duckdb
+    except ImportError:
+        raise ImportError(strip_ws(
+            f"""The DuckDB engine requires the {code("duckdb")} package, install it with
+            {code("pip install duckdb")} or use {code("--engine sqlite")}"""))
+
+    start_ts = time.time()
+    rollups, inputs = list_rollups(cfg, only=only)
+
+    with open(cfg.file.staging_sql_info, 'r') as f:
+        staging_sql_info = json.load(f)
+
+    # The SQLite connection must see everything staged so far
+    chatdb.sqlite_con.commit()
+
+    duckdb_con = duckdb.connect(':memory:')
+    if threads is not None:
+        duckdb_con.execute(f'SET threads = {int(threads)}')
+
+    attached = attach_sqlite(duckdb_con, chatdb.db_path, logger)
+
+    for input_name in inputs:
+        if attached:
+            duckdb_con.execute(f'CREATE TABLE "{input_name}" AS SELECT * FROM sqlite_db."{input_name}"')
+        else:
+            reader = sqlite_to_arrow_reader(chatdb.db_path, input_name, batch_size)
+            duckdb_con.register('arrow_input', reader)
+            duckdb_con.execute(f'CREATE TABLE "{input_name}" AS SELECT * FROM arrow_input')
+            duckdb_con.unregister('arrow_input')
+
+        logger.debug(f'Loaded rollup input {code(input_name)} into DuckDB')
+
+    for rollup_name in rollups:
+        with open(join(cfg.dir.staging_sql, rollup_name + '.sql'), 'r') as f:
+            select_sql = extract_select_sql(f.read(), rollup_name)
+
+        duckdb_con.execute(f'CREATE TABLE "{rollup_name}" AS {select_sql}')
+        write_duckdb_table_to_sqlite(duckdb_con, chatdb, rollup_name, batch_size, indexes=staging_sql_info[rollup_name].get('indexes'))
+        logger.info(f'Materialized rollup {code(rollup_name)} with DuckDB', arrow='black')
+
+    duckdb_con.close()
+
+    diff_formatted = fmt_seconds(time.time() - start_ts, units='auto', round_digits=2)
+    elapsed_time = f"{diff_formatted['value']} {diff_formatted['units']}"
+    logger.info(f'Computed {len(rollups)} rollups with DuckDB in {bold(elapsed_time)}', arrow='black')
+
+
+def write_duckdb_table_to_sqlite(duckdb_con, chatdb: 'ChatDb', table_name: str, batch_size: int, indexes: list=None) -> None:
+    """
+    Replace the SQLite view or table `table_name` with the contents of the DuckDB table of the
+    same name, in a single transaction. Each of `indexes` (a column, or a list of columns)
+    is then created on the table, as declared for the rollup in staging_sql_info.json.
+    """
+    describe = duckdb_con.execute(f'DESCRIBE "{table_name}"').fetchall()
+    columns = [x[0] for x in describe]
+    column_types = [duckdb_sqlite_types.get(x[1], 'real' if x[1].startswith('DECIMAL') else 'text') for x in describe]
+
+    # Python's sqlite3 cannot bind Decimal values, so DECIMAL columns are read as DOUBLE
+    select_list = ', '.join(f'CAST("{x[0]}" AS DOUBLE)' if x[1].startswith('DECIMAL') else f'"{x[0]}"' for x in describe)
+    result = duckdb_con.execute(f'SELECT {select_list} FROM "{table_name}"')
+
+    columnspec = ', '.join(f'`{col}` {dtype}' for col, dtype in zip(columns, column_types))
+    placeholders = ', '.join(['?'] * len(columns))
+
+    cursor = chatdb.sqlite_con.cursor()
+    cursor.execute(f'DROP VIEW IF EXISTS `{table_name}`')
+    cursor.execute(f'DROP TABLE IF EXISTS `{table_name}`')
+    cursor.execute(f'CREATE TABLE `{table_name}` ({columnspec})')
+
+    while True:
+        rows = result.fetchmany(batch_size)
+        if not len(rows):
+            break
+
+        cursor.executemany(f'INSERT INTO `{table_name}` VALUES ({placeholders})', rows)
+
+    create_rollup_indexes(cursor, table_name, indexes=indexes)
+    chatdb.sqlite_con.commit()
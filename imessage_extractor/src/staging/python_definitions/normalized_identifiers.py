@@ -0,0 +1,40 @@
+import logging
+import pandas as pd
+from imessage_extractor.src.chatdb.chatdb import ChatDb
+from imessage_extractor.src.helpers.verbosity import bold, code
+from imessage_extractor.src.refresh_contacts.refresh_contacts import normalize_identifier
+from imessage_extractor.src.staging.common import columns_match_expectation
+
+
+def refresh_normalized_identifiers(chatdb: 'ChatDb',
+                                   table_name: str,
+                                   columnspec: dict,
+                                   logger: logging.Logger) -> None:
+    """
+    Refresh table normalized_identifiers, which maps each chat_identifier in chat.db and
+    in contacts_manual to its canonical form (see `normalize_identifier()`), so that
+    messages resolve to contacts with a single indexed equality join.
+    """
+    logger.debug(f'Refreshing table "{bold(table_name)}"', arrow='yellow')
+
+    chat_identifiers = pd.read_sql(
+        """select chat_identifier from chat where chat_identifier is not null
+        union
+        select chat_identifier from contacts_manual where chat_identifier is not null""",
+        con=chatdb.sqlite_con)
+
+    chat_identifiers['normalized_identifier'] = chat_identifiers['chat_identifier'].map(normalize_identifier)
+
+    columns_match_expectation(chat_identifiers, table_name, columnspec)
+    chat_identifiers.to_sql(name=table_name,
+                            con=chatdb.sqlite_con,
+                            schema='main',
+                            index=False,
+                            if_exists='replace')
+
+    chatdb.execute(f"""
+        create unique index {table_name}_chat_identifier on {table_name} (chat_identifier);
+        create index {table_name}_normalized_identifier on {table_name} (normalized_identifier);
+    """)
+
+    logger.info(f'Built table {code(table_name)}', arrow='black')
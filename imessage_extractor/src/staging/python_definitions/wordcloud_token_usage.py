@@ -0,0 +1,84 @@
+import logging
+import pandas as pd
+from imessage_extractor.src.chatdb.chatdb import ChatDb
+from imessage_extractor.src.helpers.verbosity import bold, code
+from imessage_extractor.src.staging.common import columns_match_expectation
+
+
+# Number of tokens kept for each contact and sender, i.e. the most words a wordcloud draws
+top_n = 500
+
+# Contractions split off by message_tokens_unnest_vw, which are stopwords once their
+# apostrophes are removed
+contractions = ["i'm", "i'd", "i've", "i'll", "'s"]
+
+
+def clean_tokens(tokens: pd.Series) -> pd.Series:
+    """
+    Lowercase tokens and remove punctuation, leaving an empty string for tokens that are
+    only punctuation or a split-off "'s" or "'d".
+    """
+    return (
+        tokens
+        .str.lower()
+        .str.replace(r'[^\w\s]+', '', regex=True)
+        .str.replace(r'^(s|d)$', '', regex=True)
+    )
+
+
+def rank_top_tokens(token_usage: pd.DataFrame, by: list) -> pd.DataFrame:
+    """
+    Keep the `top_n` most used tokens for each group of `by`, ranked from 1.
+    """
+    token_usage = token_usage.sort_values(by + ['usages', 'token'], ascending=[True] * len(by) + [False, True])
+    token_usage['rank'] = token_usage.groupby(by).cumcount() + 1
+    return token_usage.loc[token_usage['rank'] <= top_n]
+
+
+def refresh_wordcloud_token_usage(chatdb: 'ChatDb',
+                                  table_name: str,
+                                  columnspec: dict,
+                                  logger: logging.Logger) -> None:
+    """
+    Refresh table wordcloud_token_usage, the most used tokens for each contact and sender
+    (`is_from_me`), and for each sender across all contacts (where `contact_name` is null).
+    Tokens are cleaned of punctuation and case, and stopwords are removed, so the app can
+    draw wordclouds from a few hundred rows rather than aggregating all token usage.
+    """
+    logger.debug(f'Refreshing table "{bold(table_name)}"', arrow='yellow')
+
+    token_usage = pd.read_sql(
+        """select contact_name, is_from_me, lower("token") as "token", sum(usages) as usages
+        from contact_token_usage_from_who_vw
+        group by contact_name, is_from_me, lower("token")""",
+        con=chatdb.sqlite_con)
+
+    # Clean each distinct token once, rather than every row
+    distinct_tokens = pd.Series(token_usage['token'].unique())
+    cleaned = pd.Series(clean_tokens(distinct_tokens).values, index=distinct_tokens.values)
+    token_usage['token'] = token_usage['token'].map(cleaned)
+
+    stopwords = pd.read_sql('select stopword from stopwords', con=chatdb.sqlite_con)['stopword'].tolist() + contractions
+    stopwords = set(stopwords) | set(x.replace("'", '') for x in stopwords)
+    token_usage = token_usage.loc[(token_usage['token'] > '') & (~token_usage['token'].isin(stopwords))]
+
+    # Tokens that only differed by case or punctuation are summed
+    contact_token_usage = token_usage.groupby(['contact_name', 'is_from_me', 'token'], as_index=False)['usages'].sum()
+    all_contacts_token_usage = token_usage.groupby(['is_from_me', 'token'], as_index=False)['usages'].sum()
+    all_contacts_token_usage['contact_name'] = None
+
+    wordcloud_token_usage = pd.concat([
+        rank_top_tokens(contact_token_usage, by=['contact_name', 'is_from_me']),
+        rank_top_tokens(all_contacts_token_usage, by=['is_from_me']),
+    ])[list(columnspec.keys())]
+
+    columns_match_expectation(wordcloud_token_usage, table_name, columnspec)
+    wordcloud_token_usage.to_sql(name=table_name,
+                                 con=chatdb.sqlite_con,
+                                 schema='main',
+                                 index=False,
+                                 if_exists='replace')
+
+    chatdb.execute(f'create index {table_name}_contact_name_is_from_me on {table_name} (contact_name, is_from_me);')
+
+    logger.info(f'Built table {code(table_name)}', arrow='black')
@@ -28,7 +28,7 @@ from (
            , sum(n_characters) as n_text_characters
            , sum(n_tokens) as n_text_words
            , row_number() over(partition by contact_name order by count(distinct message_id) desc) as day_rank_by_n_messages_partition_by_contact
-    from message_user
+    from messages
     where is_text = true
       and contact_name is not null
     group by contact_name
@@ -1,28 +1,36 @@
 drop table if exists contacts_user;
 create table contacts_user as
 
-select chat_identifier
+-- Contacts are keyed on the canonical form of their identifier (see normalized_identifiers),
+-- so that a phone number matches however it was formatted in each source
+select normalized_identifier
+       , chat_identifier
        , contact_name
        , source
 from (
-    select chat_identifier,
+    select normalized_identifier,
+        chat_identifier,
         contact_name,
         source,
-        row_number() over (partition by chat_identifier order by priority asc) as rank
+        row_number() over (partition by normalized_identifier order by priority asc) as rank
     from (
-        select chat_identifier, group_name as contact_name, 1 as priority, 'contact_group_names' as source
+        select chat_identifier, chat_identifier as normalized_identifier, group_name as contact_name, 1 as priority, 'contact_group_names' as source
         from contact_group_names
 
         union
 
-        select chat_identifier, contact_name, 2 as priority, 'contacts_manual' as source
-        from contacts_manual
+        select cm.chat_identifier, coalesce(n.normalized_identifier, cm.chat_identifier) as normalized_identifier, cm.contact_name, 2 as priority, 'contacts_manual' as source
+        from contacts_manual cm
+        left join normalized_identifiers n
+          on cm.chat_identifier = n.chat_identifier
 
         union
 
-        select chat_identifier, contact_name, 3 as priority, 'contacts' as source
+        select chat_identifier, normalized_identifier, contact_name, 3 as priority, 'contacts' as source
         from contacts
     ) t1
 ) t2
 where rank = 1
-order by contact_name
+order by contact_name;
+
+create unique index contacts_user_normalized_identifier on contacts_user (normalized_identifier);
@@ -109,8 +109,10 @@ m_join_chat_contacts as (
     ) cm_mapping on c.ROWID = cm_mapping.chat_id
     join m
       on cm_mapping.message_id = m.message_id
+    left join normalized_identifiers ni
+      on c.chat_identifier = ni.chat_identifier
     left join contacts_user n
-      on c.chat_identifier = n.chat_identifier
+      on ni.normalized_identifier = n.normalized_identifier
 ),
 
 m2 as (
@@ -168,4 +170,7 @@ select message_id
        , case when has_attachment = 1 and is_url = 0 and message_special_type is null then 1 else 0 end as has_attachment_image
        , case when has_attachment = 1 and is_url = 0 and message_special_type is null and is_text = 0 then 1 else 0 end as is_attachment_image
 from m2
-order by message_id desc nulls last
+order by message_id desc nulls last;
+
+create index message_user_message_id on message_user (message_id);
+create index message_user_chat_identifier on message_user (chat_identifier);
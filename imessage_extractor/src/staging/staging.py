@@ -1,21 +1,33 @@
+import hashlib
+import inspect
 import json
 import logging
+import re
 import typing
 from collections import OrderedDict
 from imessage_extractor.src.chatdb.chatdb import ChatDb
 from imessage_extractor.src.helpers.config import WorkflowConfig
 from imessage_extractor.src.helpers.verbosity import path, code
 from imessage_extractor.src.helpers.utils import strip_ws, ensurelist
+from imessage_extractor.src.run_state.run_state import RunState
 from imessage_extractor.src.staging.python_definitions.emoji_text_map import refresh_emoji_text_map
+from imessage_extractor.src.staging.python_definitions.normalized_identifiers import refresh_normalized_identifiers
 from imessage_extractor.src.staging.python_definitions.stopwords import refresh_stopwords
+from imessage_extractor.src.staging.python_definitions.wordcloud_token_usage import refresh_wordcloud_token_usage
+from imessage_extractor.src.static_tables.static_tables import read_content_hash
 from os.path import basename, join, isfile
 
 
 python_staging_table_refresh_functions = dict(
     emoji_text_map=refresh_emoji_text_map,
+    normalized_identifiers=refresh_normalized_identifiers,
     stopwords=refresh_stopwords,
+    wordcloud_token_usage=refresh_wordcloud_token_usage,
 )
 
+staging_hash_table_name = 'meta_staging_hash'
+chatdb_version_table_name = 'meta_chatdb_table_version'
+
 
 class StagingTableOrViewSQLDefined(object):
     """
@@ -163,6 +175,10 @@ class StagingTableOrViewSQLDefined(object):
                         references: {str(self.nonexistent_references)}"""))
 
                     for ref in self.nonexistent_references:
+                        if chatdb.table_or_view_exists(ref):
+                            # Created in cascade by an earlier reference in this list
+                            continue
+
                         ref_type = get_reference_type(ref)
 
                         if ref_type == 'staging_sql':
@@ -254,9 +270,12 @@ class StagingTablePythonDefined(object):
                               logger=self.logger)
 
 
-def assemble_staging_order(chatdb: 'ChatDb', cfg: 'WorkflowConfig') -> OrderedDict:
+def assemble_staging_order(chatdb: 'ChatDb', cfg: 'WorkflowConfig', run_state: 'RunState'=None) -> OrderedDict:
     """
     Return a dictionary of staging tables and/or views in the order that they should be created.
+
+    If a `run_state` is given, each staging object is recorded as completed once it, and
+    everything it references, has been created.
     """
     def compute_references_exist() -> dict:
         """
@@ -307,6 +326,7 @@ def assemble_staging_order(chatdb: 'ChatDb', cfg: 'WorkflowConfig') -> OrderedDi
         chatdb_table_info = json.load(f)
 
     staging_object_references = compute_references_exist()
+    completed = run_state.completed('staging') if run_state is not None else []
 
     for obj_name, obj_info in staging_object_references.items():
         if obj_info['staging_type'] == 'staging_sql':
@@ -318,10 +338,250 @@ def assemble_staging_order(chatdb: 'ChatDb', cfg: 'WorkflowConfig') -> OrderedDi
             staging_sql_obj.create(chatdb=chatdb, cascade=True)
 
         elif obj_info['staging_type'] == 'staging_python':
-            staging_python_obj = StagingTablePythonDefined(
-                table_name=obj_name,
-                chatdb=chatdb,
-                logger=chatdb.logger,
-                cfg=cfg
-            )
-            staging_python_obj.refresh()
+            # Like views above, tables that exist were kept as unchanged, or were created
+            # in cascade as a reference of an earlier object
+            if not chatdb.table_exists(obj_name):
+                staging_python_obj = StagingTablePythonDefined(
+                    table_name=obj_name,
+                    chatdb=chatdb,
+                    logger=chatdb.logger,
+                    cfg=cfg
+                )
+                staging_python_obj.refresh()
+
+        if run_state is not None:
+            # Objects are created in cascade, so any that exist at this point are complete
+            for name in [x for x in staging_object_references if x not in completed and chatdb.table_or_view_exists(x)]:
+                run_state.complete('staging', name)
+                completed.append(name)
+
+
+def drop_incomplete_staging_objects(chatdb: 'ChatDb', cfg: 'WorkflowConfig', completed: list) -> list:
+    """
+    Drop staging tables and views that are not in `completed`, i.e. that a failed run may
+    have left partially built, so that resuming the run rebuilds them. Return the names of
+    the dropped objects.
+    """
+    with open(cfg.file.staging_sql_info) as f:
+        staging_object_names = list(json.load(f).keys())
+
+    with open(cfg.file.staging_python_info) as f:
+        staging_object_names += list(json.load(f).keys())
+
+    dropped = []
+    for name in [x for x in staging_object_names if x not in completed]:
+        if chatdb.table_exists(name):
+            chatdb.execute(f'DROP TABLE IF EXISTS `{name}`;')
+            dropped.append(name)
+        elif chatdb.view_exists(name):
+            chatdb.drop_view(name)
+            dropped.append(name)
+
+    chatdb.logger.debug(f'Dropped incomplete staging objects {dropped}')
+    return dropped
+
+
+def staging_dependency_graph(cfg: 'WorkflowConfig') -> OrderedDict:
+    """
+    Return each staging object, in an order in which they can be created, with the list of
+    staging objects it references. References to chat.db and static tables are omitted.
+    """
+    with open(cfg.file.staging_sql_info) as f:
+        references = {k: ensurelist(v['reference']) for k, v in json.load(f).items()}
+
+    with open(cfg.file.staging_python_info) as f:
+        references.update({k: ensurelist(v['reference']) for k, v in json.load(f).items()})
+
+    graph = OrderedDict()
+    def visit(name: str) -> None:
+        if name not in graph:
+            staging_references = [x for x in references[name] if x in references]
+            for ref in staging_references:
+                visit(ref)
+
+            graph[name] = staging_references
+
+    for name in references:
+        visit(name)
+
+    return graph
+
+
+def select_staging_objects(cfg: 'WorkflowConfig', only: list=[], from_: list=[], skip: list=[]) -> list:
+    """
+    Return the staging objects to rebuild, in creation order: the objects in `only`, the
+    objects in `from_` along with every object downstream of them, less the objects in
+    `skip`. If neither `only` nor `from_` is given, every object but those in `skip` is
+    selected.
+    """
+    graph = staging_dependency_graph(cfg)
+
+    unknown = [x for x in list(only) + list(from_) + list(skip) if x not in graph]
+    if len(unknown):
+        raise ValueError(strip_ws(
+            f"""Unknown staging object(s) {unknown}, expected names from
+            {path(cfg.file.staging_sql_info)} or {path(cfg.file.staging_python_info)}"""))
+
+    if not len(only) and not len(from_):
+        selected = set(graph)
+    else:
+        selected = set(only) | set(from_)
+
+        # Graph order puts every object after its references, so one pass finds
+        # everything downstream
+        downstream = set(from_)
+        for name, references in graph.items():
+            if any(ref in downstream for ref in references):
+                downstream.add(name)
+
+        selected |= downstream
+
+    return [x for x in graph if x in selected and x not in skip]
+
+
+def rebuild_staging_objects(chatdb: 'ChatDb', cfg: 'WorkflowConfig', names: list) -> None:
+    """
+    Drop and recreate the staging objects in `names` (as returned by `select_staging_objects()`)
+    in an existing output database. Objects they reference that do not exist yet are
+    created as well, and all other objects are left as they are.
+    """
+    with open(cfg.file.staging_python_info) as f:
+        staging_python_info = json.load(f)
+
+    for name in reversed(names):
+        if chatdb.table_exists(name):
+            chatdb.execute(f'DROP TABLE IF EXISTS `{name}`;')
+        elif chatdb.view_exists(name):
+            chatdb.drop_view(name)
+
+    for name in names:
+        if name in staging_python_info:
+            StagingTablePythonDefined(table_name=name, chatdb=chatdb, logger=chatdb.logger, cfg=cfg).refresh()
+        else:
+            StagingTableOrViewSQLDefined(table_name=name, logger=chatdb.logger, cfg=cfg).create(chatdb=chatdb, cascade=True)
+
+    chatdb.logger.info(f'Rebuilt {len(names)} staging object(s)', arrow='black')
+
+
+def staging_object_hashes(chatdb: 'ChatDb', cfg: 'WorkflowConfig', data_versions: dict, materialized: list=[]) -> OrderedDict:
+    """
+    Return a definition hash for each staging object, in creation order, that changes
+    whenever the object would be built differently.
+
+    A view's hash covers its definition (its .sql file and staging_sql_info.json entry) and
+    the hashes of the staging views and tables it references, as a view reads its inputs
+    whenever it is queried. A table's hash (a python staging table, a .sql file that creates
+    a table, or a view in `materialized`, i.e. rollups computed by DuckDB) also covers the
+    data it is built from: the content hash of each static table and the version of each
+    chat.db table in `data_versions` (as returned by `update_chatdb_table_versions()`) it
+    reads, directly or through views. New chat.db data therefore rebuilds just the tables
+    that read the chat.db tables it was added to, and the tables downstream of them.
+    """
+    with open(cfg.file.staging_sql_info) as f:
+        staging_sql_info = json.load(f)
+
+    with open(cfg.file.staging_python_info) as f:
+        staging_python_info = json.load(f)
+
+    with open(cfg.file.static_table_info) as f:
+        static_table_names = list(json.load(f).keys())
+
+    hashes = OrderedDict()
+
+    # Hashes of each object's definition and the definitions of the objects it references,
+    # and the data each view reads through ({input_name: version}), which tables downstream
+    # of it are built from
+    definition_hashes = dict()
+    view_data_inputs = dict()
+
+    for name in staging_dependency_graph(cfg):
+        if name in staging_python_info:
+            obj_info = staging_python_info[name]
+            with open(inspect.getsourcefile(python_staging_table_refresh_functions[name]), 'r') as f:
+                definition = f.read() + json.dumps([obj_info['columnspec'], obj_info['primary_key']])
+
+            is_table = True
+        else:
+            obj_info = staging_sql_info[name]
+            with open(join(cfg.dir.staging_sql, name + '.sql'), 'r') as f:
+                definition = f.read() + json.dumps(obj_info, sort_keys=True)
+
+            is_table = name in materialized or re.search(r'create\s+table', definition, flags=re.IGNORECASE) is not None
+            definition += json.dumps(name in materialized)
+
+        references = []
+        data_inputs = dict()
+        for ref in [x for x in ensurelist(obj_info['reference']) if x is not None]:
+            if ref in definition_hashes:
+                references.append([ref, definition_hashes[ref]])
+                data_inputs.update(view_data_inputs.get(ref, {ref: hashes[ref]}))
+            elif ref in static_table_names:
+                data_inputs[ref] = read_content_hash(chatdb.sqlite_con, ref)
+            else:
+                data_inputs[ref] = data_versions.get(ref)
+
+        definition_hashes[name] = hashlib.md5((definition + json.dumps(references)).encode('utf-8')).hexdigest()
+
+        if is_table:
+            hashes[name] = hashlib.md5((definition_hashes[name] + json.dumps(sorted(data_inputs.items()))).encode('utf-8')).hexdigest()
+        else:
+            hashes[name] = definition_hashes[name]
+            view_data_inputs[name] = data_inputs
+
+    return hashes
+
+
+def update_chatdb_table_versions(chatdb: 'ChatDb', data_version: str) -> dict:
+    """
+    Record `data_version` (i.e. the fingerprint of the chat.db sources) as the version of
+    each chat.db table whose rows the copy changed (`chatdb.changed_tables`), and return the
+    version of every chat.db table. A table keeps its version from when it last changed.
+    """
+    chatdb.sqlite_con.execute(f'CREATE TABLE IF NOT EXISTS {chatdb_version_table_name} (table_name text PRIMARY KEY, data_version text)')
+    chatdb.sqlite_con.executemany(f'INSERT OR REPLACE INTO {chatdb_version_table_name} (table_name, data_version) VALUES (?, ?)',
+                                  [(x, data_version) for x in chatdb.changed_tables])
+    chatdb.sqlite_con.commit()
+    return dict(chatdb.sqlite_con.execute(f'SELECT table_name, data_version FROM {chatdb_version_table_name}').fetchall())
+
+
+def read_staging_hashes(chatdb: 'ChatDb') -> dict:
+    """
+    Return the definition hash each staging object was last built from.
+    """
+    if not chatdb.table_exists(staging_hash_table_name):
+        return dict()
+
+    return dict(chatdb.sqlite_con.execute(f'SELECT object_name, definition_hash FROM {staging_hash_table_name}').fetchall())
+
+
+def write_staging_hashes(chatdb: 'ChatDb', hashes: dict) -> None:
+    """
+    Record the definition hashes of the staging objects in `hashes` that exist. This happens
+    after they are built, so objects an interrupted run did not build are rebuilt next time.
+    """
+    rows = [(name, definition_hash) for name, definition_hash in hashes.items() if chatdb.table_or_view_exists(name)]
+    chatdb.sqlite_con.execute(f'CREATE TABLE IF NOT EXISTS {staging_hash_table_name} (object_name text PRIMARY KEY, definition_hash text)')
+    chatdb.sqlite_con.executemany(f'INSERT OR REPLACE INTO {staging_hash_table_name} (object_name, definition_hash) VALUES (?, ?)', rows)
+    chatdb.sqlite_con.commit()
+
+
+def drop_stale_staging_objects(chatdb: 'ChatDb', cfg: 'WorkflowConfig', hashes: dict) -> list:
+    """
+    Drop the staging tables and views whose definition hash (as returned by
+    `staging_object_hashes()`) differs from the one they were last built from, so that they
+    are rebuilt. Objects whose hash matches are left in place and skipped when staging.
+    Return the names of the stale objects.
+    """
+    stored_hashes = read_staging_hashes(chatdb)
+    stale = [name for name, definition_hash in hashes.items() if stored_hashes.get(name) != definition_hash]
+
+    # Drop dependents before the objects they reference
+    for name in reversed(stale):
+        if chatdb.table_exists(name):
+            chatdb.execute(f'DROP TABLE IF EXISTS `{name}`;')
+        elif chatdb.view_exists(name):
+            chatdb.drop_view(name)
+
+    chatdb.logger.info(f'{len(hashes) - len(stale)} staging object(s) unchanged, {len(stale)} to rebuild', arrow='black')
+    chatdb.logger.debug(f'Stale staging objects {stale}')
+    return stale
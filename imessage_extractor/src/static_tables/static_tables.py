@@ -1,12 +1,20 @@
+import csv
+import functools
+import hashlib
 import json
 import logging
 import sqlite3
 import pandas as pd
+import typing
 from imessage_extractor.src.helpers.config import WorkflowConfig
-from imessage_extractor.src.helpers.utils import strip_ws
+from imessage_extractor.src.helpers.utils import strip_ws, ensurelist
 from imessage_extractor.src.helpers.verbosity import bold, path, code
-from os import listdir
-from os.path import isfile, join, abspath
+from itertools import islice
+from os import listdir, makedirs
+from os.path import isfile, join
+
+
+hash_table_name = 'meta_static_table_hash'
 
 
 class StaticTable(object):
@@ -29,7 +37,9 @@ class StaticTable(object):
                 f"""static table {bold(table_name)} data .csv file expected at
                 {path(self.csv_fpath)} but not found"""))
         else:
-            self.df = pd.read_csv(self.csv_fpath)
+            # Only the header is read here, rows are streamed by `iter_rows()`
+            with open(self.csv_fpath, 'r', newline='', encoding='utf-8-sig') as f:
+                self.csv_columns = next(csv.reader(f), [])
 
         with open(self.cfg.file.static_table_info, 'r') as json_file:
             schemas = json.load(json_file)
@@ -39,14 +49,19 @@ class StaticTable(object):
                     the table data .csv file exists at "{self.csv_fpath}" but a column
                     specification does not exist in "{self.cfg.file.static_table_info}" for
                     that table. Add a key in that JSON file with the same name as the .csv file
-                    with a corresponding value that is a dictionary with a name: dtype pair
-                    for each column in the .csv file. For example, if the .csv file has
-                    columns ['id', 'message'], then add an entry to that JSON file:
-                    "{table_name}": {{"id": "INTEGER", "message": "TEXT"}}"""))
+                    with a corresponding value that is a dictionary with a "columnspec" name: dtype
+                    pair for each column in the .csv file, and a "primary_key". For example, if the
+                    .csv file has columns ['id', 'message'], then add an entry to that JSON file:
+                    "{table_name}": {{"columnspec": {{"id": "INTEGER", "message": "TEXT"}}, "primary_key": "id"}}"""))
             else:
-                table_schema = schemas[self.table_name]
+                table_info = schemas[self.table_name]
+
+        self.table_info = table_info
+        self.columnspec = table_info['columnspec']
+        self.primary_key = table_info['primary_key']
+        self.indexes = table_info.get('indexes', [])
 
-        self._validate_columns(table_schema)
+        self._validate_columns(self.columnspec)
 
     def _validate_columns(self, table_schema: dict):
         """
@@ -56,12 +71,12 @@ class StaticTable(object):
         """
         for col_name, col_dtype in table_schema.items():
             # Validate that column specified in JSON config actually exists in the .csv file
-            if col_name not in self.df.columns:
+            if col_name not in self.csv_columns:
                 raise KeyError(strip_ws(
                     f'''Column "{col_name}" specified in "{self.cfg.file.static_table_info}"
                     but does not exist in "{self.csv_fpath}"'''))
 
-        for col_name in self.df.columns:
+        for col_name in self.csv_columns:
             # Validate that the column in the .csv file actually exists in the JSON config
             if col_name not in table_schema:
                 raise KeyError(strip_ws(
@@ -69,23 +84,145 @@ class StaticTable(object):
                     has no definition in the key "{self.table_name}" in the configuration file
                     "{self.cfg.file.static_table_info}"'''))
 
-    def save_to_sqlite(self):
+    def content_hash(self) -> str:
         """
-        Save static table to SQLite by overwriting the table if it exists.
+        Hash the .csv file's contents along with the table definition, so that a change
+        to either is picked up.
         """
-        self.df.to_sql(name=self.table_name,
-                       con=self.sqlite_con,
-                       schema='main',
-                       index=False,
-                       if_exists='replace')
+        md5 = hashlib.md5(table_definition_key(self.table_info))
+        with open(self.csv_fpath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                md5.update(chunk)
+
+        return md5.hexdigest()
+
+    def iter_rows(self) -> typing.Iterator[tuple]:
+        """
+        Stream rows from the .csv file as tuples in the order of the columnspec. Empty
+        values are read as NULL, and SQLite converts the rest to each column's declared type.
+        """
+        positions = [self.csv_columns.index(col) for col in self.columnspec]
+        with open(self.csv_fpath, 'r', newline='', encoding='utf-8-sig') as f:
+            reader = csv.reader(f)
+            next(reader)
+            for row in reader:
+                if len(row):
+                    yield tuple(row[i] if i < len(row) and row[i] != '' else None for i in positions)
+
+    def save_to_sqlite(self) -> int:
+        """
+        Save static table to SQLite by overwriting the table if it exists. Return the
+        number of rows written.
+        """
+        return write_typed_table(sqlite_con=self.sqlite_con,
+                                 table_name=self.table_name,
+                                 columnspec=self.columnspec,
+                                 rows=self.iter_rows(),
+                                 primary_key=self.primary_key,
+                                 indexes=self.indexes)
+
+
+def table_definition_key(table_info: dict) -> bytes:
+    """
+    Serialize a static table's definition in static_table_info.json for hashing.
+    """
+    return json.dumps(table_info, sort_keys=True).encode('utf-8')
+
+
+def read_content_hash(sqlite_con: sqlite3.Connection, table_name: str) -> str:
+    """
+    Return the content hash `table_name` was last built from, or None if it has not been
+    built or no longer exists.
+    """
+    cursor = sqlite_con.cursor()
+    table_names = [x[0] for x in cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name IN (?, ?)", (table_name, hash_table_name))]
+    if table_name not in table_names or hash_table_name not in table_names:
+        return None
+
+    row = cursor.execute(f'SELECT content_hash FROM {hash_table_name} WHERE table_name = ?', (table_name,)).fetchone()
+    return row[0] if row is not None else None
+
+
+def write_content_hash(sqlite_con: sqlite3.Connection, table_name: str, content_hash: str) -> None:
+    """
+    Record the content hash `table_name` was built from. This happens after the table
+    itself is committed, so an interrupted build is simply rebuilt next time.
+    """
+    sqlite_con.execute(f'CREATE TABLE IF NOT EXISTS {hash_table_name} (table_name text PRIMARY KEY, content_hash text)')
+    sqlite_con.execute(f'INSERT OR REPLACE INTO {hash_table_name} (table_name, content_hash) VALUES (?, ?)', (table_name, content_hash))
+    sqlite_con.commit()
+
+
+def write_typed_table(sqlite_con: sqlite3.Connection,
+                      table_name: str,
+                      columnspec: dict,
+                      rows: typing.Iterable,
+                      primary_key: typing.Union[str, list]=None,
+                      indexes: list=None,
+                      batch_size: int=10000) -> int:
+    """
+    Replace `table_name` with a table whose columns are declared as in `columnspec`
+    ({column_name: data_type, ...}) with an optional primary key, insert `rows` (tuples
+    in the order of `columnspec`) in batches, and create an index on each of `indexes`,
+    all in a single transaction. Return the number of rows inserted.
+    """
+    columns_sql = ', '.join(f'`{col}` {dtype}' for col, dtype in columnspec.items())
+    if primary_key is not None:
+        columns_sql += ', PRIMARY KEY (' + ', '.join(f'`{col}`' for col in ensurelist(primary_key)) + ')'
+
+    placeholders = ', '.join(['?'] * len(columnspec))
+    rows = iter(rows)
+    n_rows = 0
+
+    # Begin explicitly, so that DDL is part of the transaction as well
+    sqlite_con.commit()
+    cursor = sqlite_con.cursor()
+    cursor.execute('BEGIN')
+
+    try:
+        cursor.execute(f'DROP TABLE IF EXISTS `{table_name}`')
+        cursor.execute(f'CREATE TABLE `{table_name}` ({columns_sql})')
+
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not len(batch):
+                break
+
+            cursor.executemany(f'INSERT INTO `{table_name}` VALUES ({placeholders})', batch)
+            n_rows += len(batch)
+
+        for col in indexes or []:
+            cursor.execute(f'CREATE INDEX `{table_name}_{col}` ON `{table_name}` (`{col}`)')
+
+        sqlite_con.commit()
+
+    except sqlite3.IntegrityError as e:
+        sqlite_con.rollback()
+        raise sqlite3.IntegrityError(strip_ws(
+            f"""Duplicate primary key {code(str(primary_key))} values found while writing
+            table {code(table_name)}, each must be unique ({e})"""))
+
+    except Exception:
+        sqlite_con.rollback()
+        raise
+
+    return n_rows
 
 
 def build_static_tables(sqlite_con: sqlite3.Connection,
                         logger: logging.Logger,
-                        cfg: WorkflowConfig) -> None:
+                        cfg: WorkflowConfig,
+                        contacts_df: pd.DataFrame=None) -> None:
     """
-    Build static, user-maintained tables, the information for which is stored in the
-    'static_tables' folder.
+    Build static, user-maintained tables from the .csv files in the static table data
+    folder (`cfg.dir.static_table_data`, outside of the installed package), defined in
+    static_table_info.json. Empty .csv files are created there for tables without one.
+
+    If `contacts_df` (the contact map returned by `refresh_contacts()`) is given, the
+    `contacts` table is written from it directly, and any contacts.csv is ignored.
+
+    Tables whose data and definition are unchanged since they were last built in this
+    database are skipped.
     """
     expected_contacts_csv_fpath = join(cfg.dir.static_table_data, 'contacts.csv')
     expected_contacts_ignored_csv_fpath = join(cfg.dir.static_table_data, 'contacts_ignored.csv')
@@ -94,22 +231,24 @@ def build_static_tables(sqlite_con: sqlite3.Connection,
     with open(join(cfg.dir.static_tables, 'static_table_info.json')) as f:
         static_table_info = json.load(f)
 
-    if not isfile(expected_contacts_csv_fpath):
-        columns = [k for k, v in static_table_info['contacts'].items()]
+    makedirs(cfg.dir.static_table_data, exist_ok=True)
+
+    if contacts_df is None and not isfile(expected_contacts_csv_fpath):
+        columns = [k for k, v in static_table_info['contacts']['columnspec'].items()]
         with open(expected_contacts_csv_fpath, 'w') as f:
             f.write(','.join(columns))
 
     if not isfile(expected_contacts_ignored_csv_fpath):
-        columns = [k for k, v in static_table_info['contacts_ignored'].items()]
+        columns = [k for k, v in static_table_info['contacts_ignored']['columnspec'].items()]
         with open(expected_contacts_ignored_csv_fpath, 'w') as f:
             f.write(','.join(columns))
 
     if not isfile(expected_contacts_manual_csv_fpath):
-        columns = [k for k, v in static_table_info['contacts_manual'].items()]
+        columns = [k for k, v in static_table_info['contacts_manual']['columnspec'].items()]
         with open(expected_contacts_manual_csv_fpath, 'w') as f:
             f.write(','.join(columns))
 
-    static_table_fpaths = [abspath(x) for x in listdir(cfg.dir.static_table_data) if not x.startswith('.')]
+    static_table_fpaths = [join(cfg.dir.static_table_data, x) for x in listdir(cfg.dir.static_table_data) if not x.startswith('.')]
 
     if len(static_table_fpaths) > 0:
         logger.info('Build Static Tables', bold=True)
@@ -117,13 +256,35 @@ def build_static_tables(sqlite_con: sqlite3.Connection,
             static_table_info = json.load(json_file)
 
             for table_name, table_info in static_table_info.items():
-                table_object = StaticTable(table_name=table_name,
-                                           sqlite_con=sqlite_con,
-                                           logger=logger,
-                                           cfg=cfg)
+                if table_name == 'contacts' and contacts_df is not None:
+                    contacts_df = contacts_df[list(table_info['columnspec'])]
+                    md5 = hashlib.md5(table_definition_key(table_info))
+                    md5.update(pd.util.hash_pandas_object(contacts_df, index=False).values.tobytes())
+                    content_hash = md5.hexdigest()
+                    source = 'the Contacts app'
+                    save_to_sqlite = functools.partial(write_typed_table,
+                                                       sqlite_con=sqlite_con,
+                                                       table_name=table_name,
+                                                       columnspec=table_info['columnspec'],
+                                                       rows=contacts_df.itertuples(index=False, name=None),
+                                                       primary_key=table_info['primary_key'],
+                                                       indexes=table_info.get('indexes'))
+                else:
+                    table_object = StaticTable(table_name=table_name,
+                                               sqlite_con=sqlite_con,
+                                               logger=logger,
+                                               cfg=cfg)
+                    content_hash = table_object.content_hash()
+                    source = path(table_object.csv_fpath)
+                    save_to_sqlite = table_object.save_to_sqlite
+
+                if read_content_hash(sqlite_con, table_name) == content_hash:
+                    logger.info(f'Table {code(table_name)} is unchanged, skipping', arrow='black')
+                    continue
 
-                table_object.save_to_sqlite()
-                logger.info(f'Created table {code(table_name)}', arrow='black')
+                n_rows = save_to_sqlite()
+                write_content_hash(sqlite_con, table_name, content_hash)
+                logger.info(f'Created table {code(table_name)} from {source} ({n_rows} rows)', arrow='black')
 
     else:
         logger.warning(strip_ws(
@@ -131,9 +292,9 @@ def build_static_tables(sqlite_con: sqlite3.Connection,
             okay and does not affect the running of this pipeline, however know that if you'd
             like to add a table to this pipeline, you can manually create a .csv file and
             place it in the {path(cfg.dir.static_table_data)} folder.
-            The resulting table will be dropped and re-created with each run of this pipeline,
+            The resulting table will be dropped and re-created whenever its .csv file changes,
             and will be named identically to how you choose to name the .csv file. NOTE:
             each .csv file must be accompanied by a key:value pair in static_table_info.json
             that specifies the table schema, or else an error will be thrown. That
             table schema should be in the format:
-            {{column_name1: data_type1, column_name2: data_type2, ...}}"""))
+            {{"columnspec": {{column_name1: data_type1, column_name2: data_type2, ...}}, "primary_key": column_name1}}"""))
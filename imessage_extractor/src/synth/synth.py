@@ -0,0 +1,565 @@
+import click
+import hashlib
+import logging
+import random
+import sqlite3
+import time
+import uuid
+from collections import deque
+from imessage_extractor.src.helpers.utils import fmt_seconds, strip_ws
+from imessage_extractor.src.helpers.verbosity import logger_setup, path, code, bold
+from itertools import accumulate
+from os import makedirs, remove
+from os.path import join, dirname, isfile, expanduser
+
+
+# Seconds between the unix epoch and 2001-01-01, the epoch that chat.db timestamps
+# (stored in nanoseconds) are relative to
+apple_epoch_offset = 978307200
+
+# Common words in rough order of frequency, sampled with Zipfian weights so that
+# token distributions in synthetic messages resemble those of real chat history
+vocabulary = strip_ws("""
+    i you the to a it and that is in of my me for so lol be have was on we do what
+    just not are but at with this like no your can if yeah its im ok okay good know
+    get all up out dont he she they will about how go one when too going now see
+    love time there haha think back then want come tonight here really well did got
+    were been had where would an our who make why today tomorrow yes day thanks
+    right still need let some more sure could them home work much call what's lmao
+    omg also night u he's she's should week said oh nice text bad great thing sorry
+    man down take off said wait people over miss anything guys maybe way fun later
+    because us had wow pretty tell year last hope feel cool hey sounds something
+    happy dinner food game home free party weekend morning ready early late soon
+    again did said best new little long lot always never even first next phone
+    movie show car house school class meeting coffee lunch drinks beach gym trip
+""").split(' ')
+
+# Popular emojis in rough order of frequency
+emojis = ['😂', '❤️', '🤣', '👍', '😭', '🙏', '😘', '🥰', '😍', '😊', '🎉', '😁', '💕',
+          '🥺', '😅', '🔥', '☺️', '🤦', '♥️', '🤷', '🙄', '😆', '🤗', '😉', '🎂', '🤔',
+          '👏', '🙂', '😳', '🥳', '😎', '👌', '💜', '😔', '💪', '✨', '💖', '👀', '😋',
+          '😏', '😢', '👉', '💗', '😩', '💯', '🌹', '💞', '🎈', '💙', '😃']
+
+first_names = strip_ws("""
+    James Mary Robert Patricia John Jennifer Michael Linda David Elizabeth William
+    Barbara Richard Susan Joseph Jessica Thomas Sarah Charles Karen Christopher Lisa
+    Daniel Nancy Matthew Betty Anthony Margaret Mark Sandra Donald Ashley Steven
+    Kimberly Paul Emily Andrew Donna Joshua Michelle Kenneth Carol Kevin Amanda Brian
+    Dorothy George Melissa Timothy Deborah Andoni Maria Sofia Nikos Eleni Yuki Priya
+""").split(' ')
+
+last_names = strip_ws("""
+    Smith Johnson Williams Brown Jones Garcia Miller Davis Rodriguez Martinez
+    Hernandez Lopez Gonzalez Wilson Anderson Thomas Taylor Moore Jackson Martin Lee
+    Perez Thompson White Harris Sanchez Clark Ramirez Lewis Robinson Walker Young
+    Allen King Wright Scott Torres Nguyen Hill Flores Green Adams Nelson Baker Hall
+    Rivera Campbell Mitchell Carter Roberts Papadopoulos Tanaka Patel Sooklaris
+""").split(' ')
+
+group_chat_names = ['Family', 'Roommates', 'Book Club', 'Fantasy Football', 'Ski Trip',
+                    'Wedding Party', 'Game Night', 'Work Friends', 'Running Club',
+                    'Vegas 2019', 'Cousins', 'Brunch Crew', 'Hiking', 'Neighbors']
+
+area_codes = ['212', '213', '310', '312', '404', '415', '503', '512', '617', '646',
+              '702', '718', '720', '805', '818', '917', '925', '949']
+
+email_domains = ['gmail.com', 'icloud.com', 'me.com', 'yahoo.com', 'outlook.com']
+
+# Address book phone number formats. Messages records handles in E.164, but contacts
+# are entered by hand and so appear in a variety of formats
+phone_number_formats = ['({a}) {p}-{l}', '{a}-{p}-{l}', '+1 {a} {p} {l}', '+1 ({a}) {p}-{l}', '{a}{p}{l}', '1{a}{p}{l}']
+
+# associated_message_type: verb used by the Messages app in the text of a tapback
+tapback_types = {
+    2000: 'Loved', 2001: 'Liked', 2002: 'Disliked', 2003: 'Laughed at', 2004: 'Emphasized', 2005: 'Questioned',
+    3000: 'Removed a heart from', 3001: 'Removed a like from', 3002: 'Removed a dislike from',
+    3003: 'Removed a laugh from', 3004: 'Removed an exclamation from', 3005: 'Removed a question mark from',
+}
+tapback_cum_weights = list(accumulate([40, 20, 2, 20, 8, 3, 2, 2, 1, 1, 1, 1]))
+
+# (uti, mime_type, file extension, relative frequency) of synthetic attachments
+attachment_types = [
+    ('public.heic', 'image/heic', 'HEIC', 50),
+    ('public.jpeg', 'image/jpeg', 'jpeg', 25),
+    ('public.png', 'image/png', 'png', 8),
+    ('com.apple.quicktime-movie', 'video/quicktime', 'MOV', 10),
+    ('com.apple.coreaudio-format', 'audio/x-caf', 'caf', 4),
+    ('com.adobe.pdf', 'application/pdf', 'pdf', 3),
+]
+attachment_cum_weights = list(accumulate([x[3] for x in attachment_types]))
+
+message_columns = [
+    'ROWID', 'guid', 'text', 'handle_id', 'service', 'account', 'account_guid', 'date',
+    'date_read', 'date_delivered', 'is_delivered', 'is_finished', 'is_from_me', 'is_read',
+    'is_sent', 'cache_has_attachments', 'cache_roomnames', 'item_type', 'group_title',
+    'associated_message_guid', 'associated_message_type', 'balloon_bundle_id', 'reply_to_guid',
+    'thread_originator_guid', 'thread_originator_part', 'is_audio_message',
+]
+
+attachment_columns = [
+    'ROWID', 'guid', 'created_date', 'start_date', 'filename', 'uti', 'mime_type', 'transfer_state',
+    'is_outgoing', 'transfer_name', 'total_bytes', 'original_guid',
+]
+
+
+def zipf_cum_weights(n: int, s: float=1.1) -> list:
+    """
+    Cumulative Zipfian weights for `n` ranked items, for use with random.choices().
+    """
+    return list(accumulate([1 / (rank ** s) for rank in range(1, n + 1)]))
+
+
+def synth_guid(seed: int, kind: str, rowid: int) -> str:
+    """
+    Deterministic, uppercase UUID-formatted guid for the `rowid`-th record of `kind`. Being
+    a pure function of its inputs, guids of earlier records can be recomputed rather than
+    held in memory while generating arbitrarily large databases.
+    """
+    digest = hashlib.md5(f'{seed}:{kind}:{rowid}'.encode('utf-8')).digest()
+    return str(uuid.UUID(bytes=digest)).upper()
+
+
+class SyntheticChatDb(object):
+    """
+    Generate a schema-faithful chat.db and a matching AddressBook .abcddb source populated
+    with synthetic, seeded data, so that the pipeline can be exercised and benchmarked on
+    systems without a native Messages history.
+    """
+    def __init__(self,
+                 n_messages: int,
+                 n_contacts: int,
+                 n_group_chats: int,
+                 n_tapbacks: int,
+                 n_threads: int,
+                 n_attachments: int,
+                 seed: int,
+                 logger: logging.Logger,
+                 years: float=5.0) -> None:
+        self.n_messages = n_messages
+        self.n_contacts = n_contacts
+        self.n_group_chats = n_group_chats
+        self.n_tapbacks = n_tapbacks
+        self.n_threads = n_threads
+        self.n_attachments = n_attachments
+        self.seed = seed
+        self.logger = logger
+        self.years = years
+
+        if n_tapbacks + n_threads + n_attachments > n_messages:
+            raise ValueError(strip_ws(
+                f"""The number of tapbacks ({n_tapbacks}), threaded replies ({n_threads}) and
+                attachments ({n_attachments}) may not exceed the total number of messages
+                ({n_messages})"""))
+
+        if n_contacts < 1:
+            raise ValueError('At least one contact is required')
+
+        self.rng = random.Random(seed)
+        self.vocabulary_cum_weights = zipf_cum_weights(len(vocabulary))
+        self.emoji_cum_weights = zipf_cum_weights(len(emojis), s=1.3)
+
+        self.contacts = self._generate_contacts()
+        self.handles = self._generate_handles()
+        self.chats = self._generate_chats()
+
+    def _generate_contacts(self) -> list:
+        """
+        Generate contacts, each with one or more phone numbers and zero or more emails.
+        Phone numbers are stored in E.164 format.
+        """
+        contacts = []
+        used_numbers = set()
+        for i in range(self.n_contacts):
+            first_name = self.rng.choice(first_names)
+            last_name = self.rng.choice(last_names)
+
+            phone_numbers = []
+            for _ in range(self.rng.choices([1, 2, 3], cum_weights=[80, 95, 100])[0]):
+                while True:
+                    number = f'+1{self.rng.choice(area_codes)}{self.rng.randint(2000000, 9999999)}'
+                    if number not in used_numbers:
+                        used_numbers.add(number)
+                        phone_numbers.append(number)
+                        break
+
+            emails = []
+            for j in range(self.rng.choices([0, 1, 2], cum_weights=[50, 90, 100])[0]):
+                domain = self.rng.choice(email_domains)
+                emails.append(f'{first_name.lower()}.{last_name.lower()}{i}{j or ""}@{domain}')
+
+            contacts.append(dict(first_name=first_name,
+                                 last_name=last_name,
+                                 phone_numbers=phone_numbers,
+                                 emails=emails))
+
+        return contacts
+
+    def _generate_handles(self) -> list:
+        """
+        Generate chat.db handles. Each contact is reachable through their primary phone
+        number and, for some, an email address. Roughly 10% of handles belong to numbers
+        that are not saved in the address book.
+        """
+        handles = []
+        for contact in self.contacts:
+            handles.append(dict(id=contact['phone_numbers'][0], service='iMessage'))
+            if len(contact['emails']) and self.rng.random() < 0.3:
+                handles.append(dict(id=contact['emails'][0], service='iMessage'))
+
+        for _ in range(max(1, len(handles) // 10)):
+            handles.append(dict(id=f'+1{self.rng.choice(area_codes)}{self.rng.randint(2000000, 9999999)}', service='SMS'))
+
+        for rowid, handle in enumerate(handles, start=1):
+            handle['ROWID'] = rowid
+
+        return handles
+
+    def _generate_chats(self) -> list:
+        """
+        Generate one-on-one chats (one per handle) and group chats, and assign each chat
+        a Zipfian share of the total message volume.
+        """
+        chats = []
+        for handle in self.handles:
+            chats.append(dict(
+                guid=f'{handle["service"]};-;{handle["id"]}',
+                style=45,
+                chat_identifier=handle['id'],
+                service_name=handle['service'],
+                display_name='',
+                handle_ids=[handle['ROWID']],
+            ))
+
+        for _ in range(self.n_group_chats):
+            chat_identifier = f'chat{self.rng.randint(10 ** 17, 10 ** 18 - 1)}'
+            n_participants = min(len(self.handles), self.rng.randint(2, 8))
+            chats.append(dict(
+                guid=f'iMessage;+;{chat_identifier}',
+                style=43,
+                chat_identifier=chat_identifier,
+                service_name='iMessage',
+                display_name=self.rng.choice(group_chat_names) if self.rng.random() < 0.7 else '',
+                handle_ids=sorted(self.rng.sample([h['ROWID'] for h in self.handles], n_participants)),
+            ))
+
+        for rowid, chat in enumerate(chats, start=1):
+            chat['ROWID'] = rowid
+            chat['recent_messages'] = deque(maxlen=20)
+
+        # Shuffle chats before assigning Zipfian weights so that the busiest conversations
+        # aren't always the first contacts generated
+        self.chat_order = list(range(len(chats)))
+        self.rng.shuffle(self.chat_order)
+        self.chat_cum_weights = zipf_cum_weights(len(chats), s=1.0)
+
+        return chats
+
+    def _random_text(self) -> str:
+        """
+        Generate the text of a message, with a Zipfian word distribution, lognormal
+        message length and occasional emojis, questions and exclamations.
+        """
+        r = self.rng.random()
+        if r < 0.02:
+            return f'https://www.{self.rng.choice(vocabulary)}{self.rng.choice(vocabulary)}.com/{self.rng.randint(1000, 99999)}'
+        elif r < 0.05:
+            return ''.join(self.rng.choices(emojis, cum_weights=self.emoji_cum_weights, k=self.rng.randint(1, 3)))
+
+        n_words = min(60, int(self.rng.lognormvariate(1.5, 0.8)) + 1)
+        words = self.rng.choices(vocabulary, cum_weights=self.vocabulary_cum_weights, k=n_words)
+        text = ' '.join(words)
+        text = text[0].upper() + text[1:]
+
+        r = self.rng.random()
+        if r < 0.15:
+            text += '?'
+        elif r < 0.25:
+            text += '!'
+        elif r < 0.35:
+            text += '.'
+
+        if self.rng.random() < 0.1:
+            text += ' ' + ''.join(self.rng.choices(emojis, cum_weights=self.emoji_cum_weights, k=self.rng.randint(1, 3)))
+
+        return text
+
+    def write_address_book(self, fpath: str) -> None:
+        """
+        Write contacts to an AddressBook .abcddb SQLite database.
+        """
+        if isfile(fpath):
+            remove(fpath)
+
+        makedirs(dirname(fpath), exist_ok=True)
+        con = sqlite3.connect(fpath)
+        with open(join(dirname(__file__), 'address_book_schema.sql'), 'r') as f:
+            con.executescript(f.read())
+
+        records, phone_numbers, emails = [], [], []
+        for pk, contact in enumerate(self.contacts, start=1):
+            records.append((pk, 22, 1, contact['first_name'], contact['last_name'], str(uuid.UUID(int=self.rng.getrandbits(128))).upper() + ':ABPerson'))
+
+            for i, number in enumerate(contact['phone_numbers']):
+                a, p, l = number[2:5], number[5:8], number[8:]
+                fmt = self.rng.choice(phone_number_formats)
+                phone_numbers.append((len(phone_numbers) + 1, 17, 1, int(i == 0), i, pk, fmt.format(a=a, p=p, l=l), l, '_$!<Mobile>!$_'))
+
+            for i, email in enumerate(contact['emails']):
+                emails.append((len(emails) + 1, 9, 1, int(i == 0), i, pk, email, email.lower(), '_$!<Home>!$_'))
+
+        con.executemany('INSERT INTO ZABCDRECORD (Z_PK, Z_ENT, Z_OPT, ZFIRSTNAME, ZLASTNAME, ZUNIQUEID) VALUES (?, ?, ?, ?, ?, ?)', records)
+        con.executemany('INSERT INTO ZABCDPHONENUMBER (Z_PK, Z_ENT, Z_OPT, ZISPRIMARY, ZORDERINGINDEX, ZOWNER, ZFULLNUMBER, ZLASTFOURDIGITS, ZLABEL) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', phone_numbers)
+        con.executemany('INSERT INTO ZABCDEMAILADDRESS (Z_PK, Z_ENT, Z_OPT, ZISPRIMARY, ZORDERINGINDEX, ZOWNER, ZADDRESS, ZADDRESSNORMALIZED, ZLABEL) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', emails)
+        con.commit()
+        con.close()
+
+        self.logger.info(f'Wrote {len(records)} contacts to {path(fpath)}', arrow='black')
+
+    def write_chatdb(self, fpath: str, batch_size: int=50000) -> None:
+        """
+        Write a synthetic chat.db. Messages are generated and inserted in batches so that
+        memory use is independent of `n_messages`.
+        """
+        if isfile(fpath):
+            remove(fpath)
+
+        makedirs(dirname(fpath), exist_ok=True)
+        con = sqlite3.connect(fpath)
+        con.execute('PRAGMA journal_mode = OFF')
+        con.execute('PRAGMA synchronous = OFF')
+        with open(join(dirname(__file__), 'chatdb_schema.sql'), 'r') as f:
+            con.executescript(f.read())
+
+        con.executemany('INSERT INTO handle (ROWID, id, country, service, uncanonicalized_id) VALUES (?, ?, ?, ?, ?)',
+                        [(h['ROWID'], h['id'], 'us', h['service'], None) for h in self.handles])
+        con.executemany('INSERT INTO chat (ROWID, guid, style, state, account_id, chat_identifier, service_name, room_name, account_login, display_name, group_id) VALUES (?, ?, ?, 3, ?, ?, ?, ?, ?, ?, ?)',
+                        [(c['ROWID'], c['guid'], c['style'], synth_guid(self.seed, 'account', 0), c['chat_identifier'],
+                          c['service_name'], c['chat_identifier'] if c['style'] == 43 else None, 'E:', c['display_name'],
+                          synth_guid(self.seed, 'group', c['ROWID'])) for c in self.chats])
+        con.executemany('INSERT INTO chat_handle_join (chat_id, handle_id) VALUES (?, ?)',
+                        [(c['ROWID'], handle_id) for c in self.chats for handle_id in c['handle_ids']])
+
+        message_insert_sql = f'INSERT INTO message ({", ".join(message_columns)}) VALUES ({", ".join(["?"] * len(message_columns))})'
+        attachment_insert_sql = f'INSERT INTO attachment ({", ".join(attachment_columns)}) VALUES ({", ".join(["?"] * len(attachment_columns))})'
+
+        # Timestamps (seconds since the Apple epoch) are spread evenly over the history
+        # with random jitter, so that ROWID order matches chronological order as it does
+        # in a native chat.db
+        stop_ts = time.time() - apple_epoch_offset
+        start_ts = stop_ts - self.years * 365.25 * 86400
+        step = (stop_ts - start_ts) / max(self.n_messages, 1)
+
+        # Remaining number of each special message kind, drawn without replacement so
+        # that exact counts are produced without materializing an assignment per message
+        remaining = dict(tapback=self.n_tapbacks, thread=self.n_threads, attachment=self.n_attachments)
+        counts = dict(tapback=0, thread=0, attachment=0)
+        group_chats_titled = set()
+
+        message_batch, chat_message_join_batch, attachment_batch, message_attachment_join_batch = [], [], [], []
+        n_attachment = 0
+
+        for rowid in range(1, self.n_messages + 1):
+            chat = self.chats[self.chat_order[self.rng.choices(range(len(self.chats)), cum_weights=self.chat_cum_weights)[0]]]
+            is_group_chat = chat['style'] == 43
+            ts = start_ts + step * (rowid - 1) + self.rng.random() * step
+            date = int(ts * 1e9)
+            is_from_me = int(self.rng.random() < 0.45)
+            handle_id = self.rng.choice(chat['handle_ids']) if not (is_group_chat and is_from_me) else 0
+            service = 'SMS' if chat['service_name'] == 'SMS' else 'iMessage'
+
+            n_remaining = self.n_messages - rowid + 1
+            r = self.rng.random() * n_remaining
+            if r < remaining['tapback']:
+                kind = 'tapback'
+            elif r < remaining['tapback'] + remaining['thread']:
+                kind = 'thread'
+            elif r < remaining['tapback'] + remaining['thread'] + remaining['attachment']:
+                kind = 'attachment'
+            else:
+                kind = 'text'
+
+            if kind in ['tapback', 'thread'] and not len(chat['recent_messages']):
+                # Nothing to react or reply to yet in this chat, so leave this kind of
+                # message to be drawn again for a later message
+                kind = 'text'
+
+            if is_group_chat and chat['display_name'] and chat['ROWID'] not in group_chats_titled:
+                # Group chat naming event, which is where chat.db records a group's title
+                group_chats_titled.add(chat['ROWID'])
+                kind = 'group_title'
+
+            if kind in remaining:
+                remaining[kind] -= 1
+
+            text = None
+            item_type = 0
+            group_title = None
+            associated_message_guid = None
+            associated_message_type = 0
+            balloon_bundle_id = None
+            reply_to_guid = None
+            thread_originator_guid = None
+            thread_originator_part = None
+            cache_has_attachments = 0
+            is_audio_message = 0
+
+            if kind == 'group_title':
+                item_type = 2
+                group_title = chat['display_name']
+
+            elif kind == 'tapback':
+                target_rowid, target_text = self.rng.choice(chat['recent_messages'])
+                associated_message_type = list(tapback_types.keys())[self.rng.choices(range(len(tapback_types)), cum_weights=tapback_cum_weights)[0]]
+                associated_message_guid = f'p:0/{synth_guid(self.seed, "message", target_rowid)}'
+                text = f'{tapback_types[associated_message_type]} “{target_text}”'
+
+            elif kind == 'thread':
+                target_rowid, target_text = self.rng.choice(chat['recent_messages'])
+                thread_originator_guid = synth_guid(self.seed, 'message', target_rowid)
+                thread_originator_part = f'0:0:{len(target_text)}'
+                reply_to_guid = thread_originator_guid
+                text = self._random_text()
+
+            elif kind == 'attachment':
+                n_attachment += 1
+                cache_has_attachments = 1
+                text = '￼'
+                uti, mime_type, ext, _ = attachment_types[self.rng.choices(range(len(attachment_types)), cum_weights=attachment_cum_weights)[0]]
+                is_audio_message = int(mime_type.startswith('audio'))
+                attachment_guid = synth_guid(self.seed, 'attachment', n_attachment)
+                transfer_name = f'IMG_{self.rng.randint(1000, 9999)}.{ext}'
+                attachment_batch.append((
+                    n_attachment, attachment_guid, int(ts), 0,
+                    f'~/Library/Messages/Attachments/{attachment_guid[:2].lower()}/{attachment_guid[2:4]}/{attachment_guid}/{transfer_name}',
+                    uti, mime_type, 5, is_from_me, transfer_name, self.rng.randint(20000, 5000000), attachment_guid,
+                ))
+                message_attachment_join_batch.append((rowid, n_attachment))
+
+            else:
+                text = self._random_text()
+                if text.startswith('https://'):
+                    balloon_bundle_id = 'com.apple.messages.URLBalloonProvider'
+
+            if kind in counts:
+                counts[kind] += 1
+
+            if kind in ['text', 'thread']:
+                chat['recent_messages'].append((rowid, text[:40]))
+
+            message_batch.append((
+                rowid, synth_guid(self.seed, 'message', rowid), text, handle_id, service,
+                'E:' if service == 'iMessage' else None, synth_guid(self.seed, 'account', 0), date,
+                0 if is_from_me else date + int(self.rng.random() * 3.6e12), date + int(1e9), 1, 1, is_from_me, 1,
+                is_from_me, cache_has_attachments, chat['chat_identifier'] if is_group_chat else None, item_type,
+                group_title, associated_message_guid, associated_message_type, balloon_bundle_id, reply_to_guid,
+                thread_originator_guid, thread_originator_part, is_audio_message,
+            ))
+            chat_message_join_batch.append((chat['ROWID'], rowid, date))
+
+            if len(message_batch) >= batch_size or rowid == self.n_messages:
+                con.executemany(message_insert_sql, message_batch)
+                con.executemany('INSERT INTO chat_message_join (chat_id, message_id, message_date) VALUES (?, ?, ?)', chat_message_join_batch)
+                con.executemany(attachment_insert_sql, attachment_batch)
+                con.executemany('INSERT INTO message_attachment_join (message_id, attachment_id) VALUES (?, ?)', message_attachment_join_batch)
+                con.commit()
+                message_batch, chat_message_join_batch, attachment_batch, message_attachment_join_batch = [], [], [], []
+                self.logger.debug(f'Wrote {rowid} of {self.n_messages} messages', arrow='black')
+
+        self._write_auxiliary_tables(con)
+        con.execute('ANALYZE')
+        con.commit()
+        con.close()
+
+        self.logger.info(strip_ws(
+            f"""Wrote {bold(self.n_messages)} messages ({counts["tapback"]} tapbacks,
+            {counts["thread"]} threaded replies, {counts["attachment"]} attachments) across
+            {len(self.chats)} chats to {path(fpath)}"""), arrow='black')
+
+    def _write_auxiliary_tables(self, con: sqlite3.Connection) -> None:
+        """
+        Populate the chat.db tables that carry bookkeeping rather than message data.
+        """
+        con.executemany('INSERT INTO _SqliteDatabaseProperties (key, value) VALUES (?, ?)', [
+            ('_ClientVersion', '15001'),
+            ('__CSDBRecordSequenceNumber', str(self.n_messages)),
+            ('counter_in_all', '0'),
+            ('counter_out_all', '0'),
+            ('counter_last_all', '0'),
+        ])
+        con.executemany('INSERT INTO kvtable (key, value) VALUES (?, ?)', [
+            ('lastFailedMessageDate', b'\x00'),
+            ('lastFailedMessageRowID', b'\x00'),
+        ])
+
+        n_deleted = max(1, self.n_messages // 1000)
+        deleted_guids = [(synth_guid(self.seed, 'deleted', i),) for i in range(n_deleted)]
+        con.executemany('INSERT INTO deleted_messages (guid) VALUES (?)', deleted_guids)
+        con.executemany('INSERT INTO sync_deleted_messages (guid, recordID) VALUES (?, NULL)', deleted_guids)
+        con.executemany('INSERT INTO sync_deleted_chats (guid, recordID, timestamp) VALUES (?, NULL, 0)',
+                        [(synth_guid(self.seed, 'deleted_chat', 0),)])
+        con.executemany('INSERT INTO sync_deleted_attachments (guid, recordID) VALUES (?, NULL)',
+                        [(synth_guid(self.seed, 'deleted_attachment', 0),)])
+
+
+@click.option('--output-dpath', type=str, required=True, default=expanduser('~/Desktop/imessage_extractor_synth'),
+              help='Directory to write the synthetic chat.db and AddressBook folder to.')
+@click.option('--messages', 'n_messages', type=int, default=10000, show_default=True,
+              help='Total number of messages, including tapbacks, threaded replies and attachments.')
+@click.option('--contacts', 'n_contacts', type=int, default=100, show_default=True,
+              help='Number of address book contacts.')
+@click.option('--group-chats', 'n_group_chats', type=int, default=10, show_default=True,
+              help='Number of group chats.')
+@click.option('--tapbacks', 'n_tapbacks', type=int, default=None,
+              help='Number of tapback messages. Defaults to 5% of messages.')
+@click.option('--threads', 'n_threads', type=int, default=None,
+              help='Number of threaded replies. Defaults to 1% of messages.')
+@click.option('--attachments', 'n_attachments', type=int, default=None,
+              help='Number of attachment messages. Defaults to 3% of messages.')
+@click.option('--years', type=float, default=5.0, show_default=True,
+              help='Number of years of history the messages span.')
+@click.option('--seed', type=int, default=0, show_default=True,
+              help='Random seed. The same seed and scale always produce the same databases.')
+@click.option('-v', '--verbose', is_flag=True, default=False,
+              help='Set logging level to INFO.')
+@click.option('-d', '--debug', is_flag=True, default=False,
+              help='Set logging level to DEBUG.')
+
+@click.command()
+def synth(output_dpath, n_messages, n_contacts, n_group_chats, n_tapbacks, n_threads, n_attachments, years, seed, verbose, debug) -> None:
+    """
+    Generate a synthetic chat.db and AddressBook database.
+    """
+    if debug:
+        logging_level = logging.DEBUG
+    elif verbose:
+        logging_level = logging.INFO
+    else:
+        logging_level = logging.ERROR
+
+    logger = logger_setup(name='imessage-extractor', level=logging_level)
+    start_ts = time.time()
+
+    n_tapbacks = n_messages // 20 if n_tapbacks is None else n_tapbacks
+    n_threads = n_messages // 100 if n_threads is None else n_threads
+    n_attachments = n_messages * 3 // 100 if n_attachments is None else n_attachments
+
+    logger.info('Generate Synthetic Data', bold=True)
+    synthetic_chatdb = SyntheticChatDb(n_messages=n_messages,
+                                       n_contacts=n_contacts,
+                                       n_group_chats=n_group_chats,
+                                       n_tapbacks=n_tapbacks,
+                                       n_threads=n_threads,
+                                       n_attachments=n_attachments,
+                                       seed=seed,
+                                       logger=logger,
+                                       years=years)
+
+    output_dpath = expanduser(output_dpath)
+    address_book_source_uuid = synth_guid(seed, 'address_book_source', 0)
+    synthetic_chatdb.write_address_book(join(output_dpath, 'AddressBook', 'Sources', address_book_source_uuid, 'AddressBook-v22.abcddb'))
+    synthetic_chatdb.write_chatdb(join(output_dpath, 'chat.db'))
+
+    diff_formatted = fmt_seconds(time.time() - start_ts, units='auto', round_digits=2)
+    elapsed_time = f"{diff_formatted['value']} {diff_formatted['units']}"
+    go_command = f"imessage-extractor go --chatdb-path {join(output_dpath, 'chat.db')} --address-book-dpath {join(output_dpath, 'AddressBook')}"
+    logger.info(f'Synthetic data generated in {bold(elapsed_time)}, run {code(go_command)} to process it')
@@ -0,0 +1,144 @@
+import click
+import logging
+import sqlite3
+import time
+from imessage_extractor.src.go import go
+from imessage_extractor.src.helpers.utils import sqlite_uri, strip_ws
+from imessage_extractor.src.helpers.verbosity import logger_setup, path, code, bold
+from os.path import expanduser, isfile, getmtime
+
+
+class ChatDbChangeMonitor(object):
+    """
+    Detect writes to the native chat.db without reading any of its data. SQLite's
+    `PRAGMA data_version` changes on a connection whenever another connection commits,
+    and the mtime of the -wal file changes with each write Messages.app makes in WAL mode.
+    """
+    def __init__(self, native_chatdb_path: str) -> None:
+        self.native_chatdb_path = native_chatdb_path
+        self.wal_path = native_chatdb_path + '-wal'
+        self.sqlite_con = sqlite3.connect(sqlite_uri(native_chatdb_path, mode='ro'), uri=True)
+
+    def fingerprint(self) -> tuple:
+        """
+        Return a value that changes whenever chat.db is written to.
+        """
+        data_version = self.sqlite_con.execute('PRAGMA data_version').fetchone()[0]
+        db_mtime = getmtime(self.native_chatdb_path)
+        wal_mtime = getmtime(self.wal_path) if isfile(self.wal_path) else None
+        return (data_version, db_mtime, wal_mtime)
+
+    def wait_for_change(self, last_fingerprint: tuple, interval: float, debounce: float, max_delay: float) -> tuple:
+        """
+        Block until chat.db changes from `last_fingerprint`, then until it has been quiet for
+        `debounce` seconds (or `max_delay` seconds have passed since the first change), so
+        that a burst of writes triggers a single refresh. Return the new fingerprint.
+        """
+        fingerprint = last_fingerprint
+        while fingerprint == last_fingerprint:
+            time.sleep(interval)
+            fingerprint = self.fingerprint()
+
+        first_change_ts = last_change_ts = time.time()
+        while time.time() - last_change_ts < debounce and time.time() - first_change_ts < max_delay:
+            time.sleep(min(interval, debounce))
+            new_fingerprint = self.fingerprint()
+            if new_fingerprint != fingerprint:
+                fingerprint = new_fingerprint
+                last_change_ts = time.time()
+
+        return fingerprint
+
+    def close(self) -> None:
+        self.sqlite_con.close()
+
+
+@click.option('--chatdb-path', type=str, default=expanduser('~/Library/Messages/chat.db'), required=True,
+              help='Path to working chat.db, should be in ~/Library/Messages.')
+@click.option('--output-db-path', type=str, required=True, default=expanduser('~/Desktop/imessage_extractor_chat.db'),
+              help='Desired path to output .db SQLite database file.')
+@click.option('--address-book-dpath', type=str, default=expanduser('~/Library/Application Support/AddressBook'), required=True,
+              help='Path to the Contacts app AddressBook folder, searched for .abcddb files.')
+@click.option('--static-table-dpath', type=str, default=None,
+              help='Folder of user-maintained static table .csv files, as for `go`.')
+@click.option('--engine', type=click.Choice(['sqlite', 'duckdb']), default='sqlite', show_default=True,
+              help='Engine for the rollup staging objects.')
+@click.option('--interval', type=float, default=2.0, show_default=True,
+              help='Seconds between checks of chat.db for changes.')
+@click.option('--debounce', type=float, default=5.0, show_default=True,
+              help='Seconds chat.db must be quiet after a change before refreshing.')
+@click.option('--max-delay', type=float, default=60.0, show_default=True,
+              help='Refresh at most this many seconds after a change, even if writes continue.')
+@click.option('--resync-every', type=float, default=1.0, show_default=True,
+              help=strip_ws("""Recopy every chat.db table that changed, picking up edited, read, unsent and deleted
+              messages, if the last full copy is older than this many hours."""))
+@click.option('-v', '--verbose', is_flag=True, default=False,
+              help='Set logging level to INFO.')
+@click.option('-d', '--debug', is_flag=True, default=False,
+              help='Set logging level to DEBUG.')
+
+@click.command()
+@click.pass_context
+def watch(ctx, chatdb_path, output_db_path, address_book_dpath, static_table_dpath, engine, interval, debounce, max_delay, resync_every, verbose, debug) -> None:
+    """
+    Keep the output database current, refreshing it incrementally when chat.db changes.
+    Each refresh copies new chat.db rows, then rebuilds only the staging tables that read
+    the chat.db tables those rows were added to, and the tables downstream of them.
+
+    Only the chat.db copy is incremental. A new message still rebuilds message_user,
+    contacts_user, contact_group_names, wordcloud_token_usage and the rollups in full, and
+    each refresh reads contacts and checks static tables and quality control again, so a
+    refresh takes time in proportion to the whole message history, not to the new messages.
+    """
+    if debug:
+        logging_level = logging.DEBUG
+    elif verbose:
+        logging_level = logging.INFO
+    else:
+        logging_level = logging.ERROR
+
+    chatdb_path = expanduser(chatdb_path)
+    if not isfile(chatdb_path):
+        raise FileNotFoundError(f'chat.db not found at {path(chatdb_path)}')
+
+    def refresh() -> None:
+        ctx.invoke(go,
+                   chatdb_path=(chatdb_path,),
+                   output_db_path=output_db_path,
+                   address_book_dpath=address_book_dpath,
+                   static_table_dpath=static_table_dpath,
+                   engine=engine,
+                   incremental=True,
+                   resync_every=resync_every,
+                   verbose=verbose,
+                   debug=debug)
+
+    monitor = ChatDbChangeMonitor(chatdb_path)
+    fingerprint = monitor.fingerprint()
+
+    # Bring the output database up to date before waiting for changes
+    refresh()
+
+    logger = logger_setup(name='imessage-extractor', level=logging_level)
+    logger.info(f'Watching {path(chatdb_path)} for changes (Ctrl+C to stop)', bold=True)
+
+    try:
+        while True:
+            fingerprint = monitor.wait_for_change(fingerprint, interval=interval, debounce=debounce, max_delay=max_delay)
+            logger.info('Change detected in chat.db, refreshing', arrow='black')
+            refresh_start_ts = time.time()
+
+            try:
+                refresh()
+            except Exception as e:
+                # Keep watching, the next change retries the refresh
+                logger.error(f'Refresh failed: {e}', arrow='red')
+                continue
+
+            logger.info(f'Refreshed output database in {bold(round(time.time() - refresh_start_ts, 2))} seconds', arrow='black')
+
+    except KeyboardInterrupt:
+        logger.info(f'Stopped watching {code("chat.db")}')
+
+    finally:
+        monitor.close()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+"""Tests for refreshing the app's data in the background."""
+
+import logging
+
+import pytest
+
+pytest.importorskip('streamlit')
+pytest.importorskip('send2trash')
+
+from imessage_extractor.src.app.data import extract  # noqa: E402
+
+
+class StubRefreshWorker(object):
+    """
+    Stand-in for RefreshWorker that finishes when told to, without running the workflow.
+    """
+    started = []
+
+    def __init__(self, chatdb_fpath: str, db_fpath: str, logger: logging.Logger) -> None:
+        self.returncode = None
+        self.swapped = False
+
+    def start(self) -> 'StubRefreshWorker':
+        StubRefreshWorker.started.append(self)
+        return self
+
+    def finish(self, returncode: int) -> None:
+        self.returncode = returncode
+
+    @property
+    def done(self) -> bool:
+        return self.returncode is not None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.returncode == 0
+
+    def swap(self) -> None:
+        self.swapped = True
+
+
+@pytest.fixture
+def data(tmp_path, monkeypatch):
+    StubRefreshWorker.started = []
+    monkeypatch.setattr(extract, 'RefreshWorker', StubRefreshWorker)
+    return extract.iMessageDataExtract(str(tmp_path / 'imessage_extractor.db'), logging.getLogger('test'))
+
+
+def test_finished_refresh_is_swapped_not_replaced(data):
+    """A refresh that finished between reruns is returned to be swapped in, rather than replaced by a new one."""
+    worker = data.extract_data(wait=False)
+    assert data.extract_data(wait=False) is worker
+
+    worker.finish(0)
+    assert data.extract_data(wait=False) is worker
+    assert data.extract_data(wait=False, restart=True) is worker
+    assert data.swap_refreshed_data() and worker.swapped
+    assert data.refresh_worker is None
+
+    assert data.extract_data(wait=False) is not worker
+    assert len(StubRefreshWorker.started) == 2
+
+
+def test_failed_refresh_is_only_restarted_on_request(data):
+    """A failed refresh is kept to be reported, until a refresh is asked for again."""
+    worker = data.extract_data(wait=False)
+    worker.finish(1)
+    assert not data.swap_refreshed_data() and not worker.swapped
+    assert data.extract_data(wait=False) is worker
+
+    restarted = data.extract_data(wait=False, restart=True)
+    assert restarted is not worker and data.refresh_worker is restarted
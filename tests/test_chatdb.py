@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+"""Tests for copying chat.db to the output database."""
+
+import logging
+import shutil
+import sqlite3
+
+from imessage_extractor.src.chatdb.chatdb import ChatDb
+from imessage_extractor.src.synth.synth import SyntheticChatDb
+
+
+def build(tmp_path):
+    """Generate a small synthetic chat.db in `tmp_path`."""
+    synthetic_chatdb = SyntheticChatDb(n_messages=500,
+                                       n_contacts=10,
+                                       n_group_chats=2,
+                                       n_tapbacks=20,
+                                       n_threads=10,
+                                       n_attachments=15,
+                                       seed=0,
+                                       logger=logging.getLogger(__name__))
+    synthetic_chatdb.write_chatdb(str(tmp_path / 'chat.db'))
+    return str(tmp_path / 'chat.db')
+
+
+def test_incremental_copy_appends_new_rows(tmp_path):
+    """An incremental copy picks up new source rows and keeps staging tables in the target."""
+    logger = logging.getLogger(__name__)
+    chatdb_fpath = build(tmp_path)
+    output_fpath = str(tmp_path / 'out' / 'out.db')
+
+    chatdb = ChatDb(native_chatdb_path=chatdb_fpath, imessage_extractor_db_path=output_fpath, logger=logger)
+    chatdb.execute('CREATE TABLE message_user (message_id INTEGER);')
+    chatdb.disconnect()
+
+    source_con = sqlite3.connect(chatdb_fpath)
+    source_con.execute("INSERT INTO message (guid, text, handle_id, date) SELECT guid || '-new', text, handle_id, date FROM message WHERE ROWID <= 5")
+    source_con.execute("DELETE FROM deleted_messages")
+    source_con.execute("INSERT INTO deleted_messages (guid) VALUES ('A'), ('B')")
+    source_con.commit()
+
+    chatdb = ChatDb(native_chatdb_path=chatdb_fpath, imessage_extractor_db_path=output_fpath, logger=logger, copy_mode='incremental')
+
+    for table_name in ['message', 'deleted_messages']:
+        query = f'SELECT * FROM {table_name} ORDER BY ROWID'
+        assert chatdb.sqlite_con.execute(query).fetchall() == source_con.execute(query).fetchall()
+
+    assert chatdb.table_exists('message_user')
+    assert chatdb.changed_tables == ['deleted_messages', 'message']
+    chatdb.disconnect()
+
+
+def test_incremental_copy_resyncs_changed_rows(tmp_path):
+    """Edited and deleted rows are picked up once the last full copy is older than the resync interval."""
+    logger = logging.getLogger(__name__)
+    chatdb_fpath = build(tmp_path)
+    output_fpath = str(tmp_path / 'out' / 'out.db')
+    ChatDb(native_chatdb_path=chatdb_fpath, imessage_extractor_db_path=output_fpath, logger=logger).disconnect()
+
+    source_con = sqlite3.connect(chatdb_fpath)
+    source_con.execute("UPDATE message SET text = 'edited', is_read = 1 WHERE ROWID = 1")
+    source_con.execute('DELETE FROM message WHERE ROWID = 2')
+    source_con.commit()
+    query = 'SELECT * FROM message ORDER BY ROWID'
+
+    chatdb = ChatDb(native_chatdb_path=chatdb_fpath, imessage_extractor_db_path=output_fpath, logger=logger, copy_mode='incremental')
+    assert chatdb.changed_tables == []
+    assert chatdb.sqlite_con.execute(query).fetchall() != source_con.execute(query).fetchall()
+    chatdb.disconnect()
+
+    chatdb = ChatDb(native_chatdb_path=chatdb_fpath, imessage_extractor_db_path=output_fpath, logger=logger, copy_mode='incremental', resync_hours=0)
+    assert chatdb.changed_tables == ['message']
+    assert chatdb.sqlite_con.execute(query).fetchall() == source_con.execute(query).fetchall()
+    chatdb.disconnect()
+
+
+def message_links(con):
+    """Each message's guid with its sender and chat, independent of ROWIDs."""
+    return set(con.execute("""
+        SELECT m.guid, h.id, c.guid
+        FROM message m
+        LEFT JOIN handle h ON m.handle_id = h.ROWID
+        LEFT JOIN chat_message_join cmj ON m.ROWID = cmj.message_id
+        LEFT JOIN chat c ON cmj.chat_id = c.ROWID
+    """).fetchall())
+
+
+def test_merge_multiple_sources(tmp_path):
+    """Overlapping sources merge into one history, deduplicated by guid with ROWIDs remapped."""
+    logger = logging.getLogger(__name__)
+    first_fpath = build(tmp_path)
+    second_fpath = str(tmp_path / 'second.db')
+
+    # The second source shares the first's older history, drops its first 100 messages,
+    # and adds messages from a handle the first source does not have
+    con = sqlite3.connect(first_fpath)
+    con.execute(f"VACUUM INTO '{second_fpath}'")
+    con.close()
+
+    con = sqlite3.connect(second_fpath)
+    con.execute('DELETE FROM chat_message_join WHERE message_id <= 100')
+    con.execute('DELETE FROM message WHERE ROWID <= 100')
+    con.execute('DELETE FROM handle WHERE ROWID = 1')
+    con.execute("INSERT INTO handle (ROWID, id, service) VALUES (1, '+15550000000', 'iMessage')")
+    con.execute("INSERT INTO message (guid, text, handle_id, date) VALUES ('NEW-1', 'hi', 1, 0), ('NEW-2', 'there', 0, 0)")
+    con.execute("INSERT INTO chat_message_join (chat_id, message_id, message_date) SELECT 1, ROWID, 0 FROM message WHERE guid LIKE 'NEW-%'")
+    con.commit()
+
+    chatdb = ChatDb(native_chatdb_path=[first_fpath, second_fpath],
+                    imessage_extractor_db_path=str(tmp_path / 'out' / 'out.db'),
+                    logger=logger)
+
+    first_links = message_links(sqlite3.connect(first_fpath))
+    second_links = message_links(con)
+    merged_links = message_links(chatdb.sqlite_con)
+
+    assert chatdb.sqlite_con.execute('SELECT count(*) FROM message').fetchone()[0] == 502
+    assert first_links <= merged_links
+    assert {x for x in second_links if x[0].startswith('NEW-')} <= merged_links
+    chatdb.disconnect()
+
+
+def test_full_copy_keeps_pipeline_tables(tmp_path):
+    """A full copy into an existing output database replaces chat.db tables and keeps the rest."""
+    logger = logging.getLogger(__name__)
+    chatdb_fpath = build(tmp_path)
+    output_fpath = str(tmp_path / 'out' / 'out.db')
+
+    chatdb = ChatDb(native_chatdb_path=chatdb_fpath, imessage_extractor_db_path=output_fpath, logger=logger)
+    chatdb.execute("CREATE TABLE meta_static_table_hash (table_name text PRIMARY KEY, content_hash text); INSERT INTO meta_static_table_hash VALUES ('contacts', 'a');")
+    chatdb.execute('DELETE FROM message WHERE ROWID <= 5;')
+    chatdb.disconnect()
+
+    chatdb = ChatDb(native_chatdb_path=chatdb_fpath, imessage_extractor_db_path=output_fpath, logger=logger)
+    source_con = sqlite3.connect(chatdb_fpath)
+
+    query = 'SELECT * FROM message ORDER BY ROWID'
+    assert chatdb.sqlite_con.execute(query).fetchall() == source_con.execute(query).fetchall()
+
+    assert chatdb.sqlite_con.execute('SELECT * FROM meta_static_table_hash').fetchall() == [('contacts', 'a')]
+    chatdb.disconnect()
+
+
+def test_copy_with_uri_characters_in_paths(tmp_path):
+    """Paths containing '?', '#' and '%', which are legal on macOS, are opened as given rather than read as URI syntax."""
+    logger = logging.getLogger(__name__)
+    dpath = tmp_path / 'Messages?backup#1 100%'
+    dpath.mkdir()
+    chatdb_fpath = str(dpath / 'chat.db')
+    shutil.copyfile(build(tmp_path), chatdb_fpath)
+    output_fpath = str(dpath / 'out?mode=ro#%41.db')
+
+    ChatDb(native_chatdb_path=chatdb_fpath, imessage_extractor_db_path=output_fpath, logger=logger).disconnect()
+    chatdb = ChatDb(native_chatdb_path=chatdb_fpath, imessage_extractor_db_path=output_fpath, logger=logger, copy_mode='incremental')
+
+    query = 'SELECT count(*) FROM message'
+    assert chatdb.sqlite_con.execute(query).fetchone() == sqlite3.connect(chatdb_fpath).execute(query).fetchone()
+    chatdb.disconnect()
+
+    assert sorted(x.name for x in dpath.iterdir()) == ['chat.db', 'out?mode=ro#%41.db']
+    assert sorted(x.name for x in tmp_path.iterdir()) == ['Messages?backup#1 100%', 'chat.db']
@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""Tests for the DuckDB rollup engine."""
+
+import logging
+
+import pytest
+
+from imessage_extractor.src.chatdb.chatdb import ChatDb
+from imessage_extractor.src.helpers.config import WorkflowConfig
+from imessage_extractor.src.refresh_contacts.refresh_contacts import refresh_contacts
+from imessage_extractor.src.staging import duckdb_engine
+from imessage_extractor.src.staging.staging import assemble_staging_order
+from imessage_extractor.src.static_tables.static_tables import build_static_tables
+from imessage_extractor.src.synth.synth import SyntheticChatDb
+
+pytest.importorskip('duckdb')
+
+
+def sorted_rows(chatdb, table_name):
+    """All rows of a table or view, in a deterministic order."""
+    rows = chatdb.sqlite_con.execute(f'SELECT * FROM `{table_name}`').fetchall()
+    return sorted(rows, key=lambda row: [(x is None, str(x)) for x in row])
+
+
+def test_duckdb_rollups_match_sqlite(tmp_path):
+    """Every rollup computed by DuckDB matches the SQLite view it replaces, row for row."""
+    logger = logging.getLogger(__name__)
+    synthetic_chatdb = SyntheticChatDb(n_messages=3000,
+                                       n_contacts=30,
+                                       n_group_chats=3,
+                                       n_tapbacks=150,
+                                       n_threads=30,
+                                       n_attachments=90,
+                                       seed=1,
+                                       logger=logger)
+    synthetic_chatdb.write_address_book(str(tmp_path / 'AddressBook' / 'Sources' / 'A' / 'AddressBook-v22.abcddb'))
+    synthetic_chatdb.write_chatdb(str(tmp_path / 'chat.db'))
+
+    cfg = WorkflowConfig(params=dict(static_table_dpath=str(tmp_path / 'static_tables')), logger=logger)
+    contacts_df = refresh_contacts(address_book_dpath=str(tmp_path / 'AddressBook'), logger=logger, cache_dpath=None)
+    chatdb = ChatDb(native_chatdb_path=str(tmp_path / 'chat.db'), imessage_extractor_db_path=str(tmp_path / 'out.db'), logger=logger)
+    build_static_tables(sqlite_con=chatdb.sqlite_con, logger=logger, cfg=cfg, contacts_df=contacts_df)
+    assemble_staging_order(chatdb=chatdb, cfg=cfg)
+
+    rollups, _ = duckdb_engine.list_rollups(cfg)
+    expected = {rollup_name: sorted_rows(chatdb, rollup_name) for rollup_name in rollups}
+
+    duckdb_engine.run_rollups_duckdb(chatdb=chatdb, cfg=cfg, logger=logger, batch_size=500)
+
+    for rollup_name in rollups:
+        assert chatdb.table_exists(rollup_name)
+        assert sorted_rows(chatdb, rollup_name) == expected[rollup_name], rollup_name
+
+    # Indexes declared for a rollup are created on its table
+    indexes = [x[1] for x in chatdb.sqlite_con.execute('PRAGMA index_list(daily_summary_contact_from_who_vw)')]
+    assert 'daily_summary_contact_from_who_vw_contact_name_dt' in indexes
+
+    # Views that reference a rollup resolve to the materialized table
+    assert chatdb.sqlite_con.execute('SELECT count(*) FROM daily_summary_vw').fetchone()[0] > 0
+
+    chatdb.disconnect()
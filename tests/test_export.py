@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+"""Tests for the streaming export command."""
+
+import json
+import logging
+import sqlite3
+
+import pyarrow.parquet as pq
+
+from imessage_extractor.src.export.export import export_table
+
+
+def build(tmp_path):
+    """Create a small output database with a `dt`-bearing table and one without."""
+    con = sqlite3.connect(str(tmp_path / 'out.db'))
+    con.execute('CREATE TABLE message_user (message_id INTEGER, dt TEXT, text TEXT, body BLOB)')
+    con.executemany('INSERT INTO message_user VALUES (?, ?, ?, ?)',
+                    [(i, f'{2019 + i % 3}-01-01', None if i < 7 else f'msg {i}', b'\x00\x01') for i in range(25)])
+    con.execute('CREATE TABLE emoji_text_map (emoji TEXT, plain_text TEXT)')
+    con.execute("INSERT INTO emoji_text_map VALUES ('x', 'y')")
+    con.commit()
+    return con
+
+
+def test_export_partitions_by_year(tmp_path):
+    """Rows are streamed in small batches and split into one file per year."""
+    con = build(tmp_path)
+    logger = logging.getLogger(__name__)
+
+    n = export_table(con, 'message_user', str(tmp_path / 'export'), 'jsonl', 4, True, logger)
+    assert n == 25
+
+    years = sorted(x.name for x in (tmp_path / 'export' / 'message_user').iterdir())
+    assert years == ['year=2019', 'year=2020', 'year=2021']
+
+    rows = []
+    for year in years:
+        with open(tmp_path / 'export' / 'message_user' / year / 'part-0.jsonl') as f:
+            rows.extend(json.loads(line) for line in f)
+
+    assert sorted(x['message_id'] for x in rows) == list(range(25))
+    assert rows[0]['body'] == 'AAE='
+
+
+def test_export_parquet_schema_from_nulls(tmp_path):
+    """A column that is all-null in the first batch still accepts later values."""
+    con = build(tmp_path)
+    logger = logging.getLogger(__name__)
+
+    export_table(con, 'message_user', str(tmp_path / 'export'), 'parquet', 2, False, logger)
+    table = pq.read_table(tmp_path / 'export' / 'message_user' / 'part-0.parquet')
+    assert table.num_rows == 25
+    assert table.column('text').to_pylist()[-1] == 'msg 24'
+
+
+def test_export_table_without_dt(tmp_path):
+    """Tables without a `dt` column are written to a single file."""
+    con = build(tmp_path)
+    export_table(con, 'emoji_text_map', str(tmp_path / 'export'), 'csv', 10, True, logging.getLogger(__name__))
+    assert (tmp_path / 'export' / 'emoji_text_map' / 'part-0.csv').read_text().splitlines() == ['emoji,plain_text', 'x,y']
+
+
+def test_export_parquet_schema_from_declared_types(tmp_path):
+    """An integer column whose leading run of nulls is longer than a batch keeps its declared type."""
+    con = sqlite3.connect(str(tmp_path / 'out.db'))
+    con.execute('CREATE TABLE message_user (message_id INTEGER, thread_original_message_id INTEGER, score REAL)')
+    con.executemany('INSERT INTO message_user VALUES (?, ?, ?)', [(i, None if i < 10 else i - 10, None if i < 10 else 0.5) for i in range(25)])
+    con.execute('CREATE VIEW message_user_vw AS SELECT message_id, thread_original_message_id + 0 AS thread_id FROM message_user')
+    con.commit()
+    logger = logging.getLogger(__name__)
+
+    export_table(con, 'message_user', str(tmp_path / 'export'), 'parquet', 3, False, logger)
+    table = pq.read_table(tmp_path / 'export' / 'message_user' / 'part-0.parquet')
+    assert str(table.schema.field('thread_original_message_id').type) == 'int64'
+    assert str(table.schema.field('score').type) == 'double'
+    assert table.column('thread_original_message_id').to_pylist()[-1] == 14
+
+    # View columns computed from expressions have no declared type
+    export_table(con, 'message_user_vw', str(tmp_path / 'export'), 'parquet', 3, False, logger)
+    table = pq.read_table(tmp_path / 'export' / 'message_user_vw' / 'part-0.parquet')
+    assert str(table.schema.field('thread_id').type) == 'int64'
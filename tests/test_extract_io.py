@@ -0,0 +1,28 @@
+#!/usr/bin/env python
+
+"""Tests for reading and writing the app's data extract files."""
+
+import pandas as pd
+
+from imessage_extractor.src.app.data.extract_io import read_extract_dataset, write_extract_dataset
+
+
+def test_extract_dataset_round_trip(tmp_path):
+    """Datasets read back with their MultiIndex, categoricals and nullable integers, in full or by column."""
+    dataset = pd.DataFrame(dict(
+        contact_name=pd.Categorical(['Jane Doe', 'John Doe', 'Jane Doe']),
+        is_from_me=[True, False, False],
+        token=['hi', 'hello', 'hey'],
+        length=pd.array([2, 5, 3], dtype='int16'),
+        usages=pd.array([10, None, 3], dtype='Int32'),
+        is_stopword=pd.array([True, None, False], dtype='boolean'),
+        dt=pd.to_datetime(['2021-01-01', '2021-01-02', '2021-01-03']),
+    )).set_index(['contact_name', 'is_from_me']).sort_index()
+
+    fpath = str(tmp_path / 'contact_token_usage_from_who_vw.arrow')
+    write_extract_dataset(dataset, fpath)
+
+    pd.testing.assert_frame_equal(read_extract_dataset(fpath), dataset)
+    pd.testing.assert_frame_equal(read_extract_dataset(fpath, columns=['usages', 'token']), dataset[['usages', 'token']])
+
+    assert isinstance(read_extract_dataset(fpath).index.levels[0].dtype, pd.CategoricalDtype)
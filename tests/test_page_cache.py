@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""Tests for the app's page data cache."""
+
+import datetime
+
+import pandas as pd
+
+from imessage_extractor.src.app.data.cache import PageDataCache, estimate_size, make_key
+
+
+def test_page_data_cache():
+    """Values are computed once per key, and evicted least recently used first once over the memory cap."""
+    df = pd.DataFrame(dict(x=range(1000)))
+    size = estimate_size(dict(df=df))
+    cache = PageDataCache(max_bytes=size * 2)
+    calls = []
+
+    def compute(key):
+        calls.append(key)
+        return dict(df=df.copy())
+
+    pdata = cache.get('a', lambda: compute('a'))
+    pdata['added_by_page'] = df
+    assert 'added_by_page' not in cache.get('a', lambda: compute('a'))
+    assert calls == ['a'] and cache.hits == 1
+
+    cache.get('b', lambda: compute('b'))
+    cache.get('a', lambda: compute('a'))
+    cache.get('c', lambda: compute('c'))
+    assert list(cache.entries) == ['a', 'c']
+    assert cache.total_bytes <= cache.max_bytes
+
+    cache.clear()
+    cache.get('a', lambda: compute('a'))
+    assert calls == ['a', 'b', 'c', 'a']
+
+
+def test_estimate_size():
+    """Dataframes are sized as a deep measure would, counting the strings in object columns."""
+    df = pd.DataFrame(dict(
+        x=range(1000),
+        dt=pd.date_range('2021-01-01', periods=1000),
+        contact_name=pd.Categorical(['Jane Doe', 'John Doe'] * 500),
+        token=pd.array(['hello', 'hi'] * 500, dtype=object),
+    )).set_index('dt')
+    assert estimate_size(df) == df.memory_usage(index=True, deep=True).sum()
+    assert estimate_size(df['token']) == df['token'].memory_usage(index=True, deep=True)
+
+
+def test_make_key():
+    """Equal page inputs make equal keys, whatever the types of their widgets' values."""
+    assert make_key(dict(dt=datetime.date(2021, 1, 1), columns=['a', 'b'])) == make_key(dict(columns=('a', 'b'), dt=pd.Timestamp('2021-01-01')))
+    hash(make_key(dict(dt=datetime.date(2021, 1, 1), columns=['a', 'b'])))
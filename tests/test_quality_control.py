@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+"""Tests for the quality control engine."""
+
+import json
+import logging
+
+from imessage_extractor.src.chatdb.chatdb import SQLiteDb
+from imessage_extractor.src.helpers.config import WorkflowConfig
+from imessage_extractor.src.helpers.verbosity import logger_setup
+from imessage_extractor.src.quality_control.quality_control import create_qc_views, run_quality_control
+
+
+def test_run_quality_control_counts_and_reports(tmp_path):
+    """Checks count issues against their threshold, keep a bounded sample, and are reported as JSON."""
+    logger = logger_setup(name=__name__, level=logging.ERROR)
+    cfg = WorkflowConfig(params=dict(static_table_dpath=str(tmp_path / 'static_tables')), logger=logger)
+    cfg.dir.qc_views = str(tmp_path / 'views')
+    cfg.file.qc_info = str(tmp_path / 'qc_info.json')
+
+    (tmp_path / 'views').mkdir()
+    (tmp_path / 'views' / 'qc_negative_values.sql').write_text('create view qc_negative_values as select * from t where x < 0')
+    (tmp_path / 'views' / 'qc_large_values.sql').write_text('create view qc_large_values as select * from t where x > 90')
+    (tmp_path / 'views' / 'qc_odd_values.sql').write_text('create view qc_odd_values as select * from t where x % 2 = 1')
+    (tmp_path / 'qc_info.json').write_text(json.dumps(dict(
+        qc_large_values=dict(threshold=20, severity='error', sample_size=5),
+        qc_odd_values=dict(threshold=0, severity='info', sample_size=3),
+    )))
+
+    chatdb = SQLiteDb(db_path=str(tmp_path / 'out.db'), logger=logger)
+    chatdb.sqlite_con = chatdb.connect()
+    chatdb.execute('create table t (x integer); ' + ' '.join(f'insert into t values ({x});' for x in range(100)))
+    create_qc_views(chatdb=chatdb, cfg=cfg, logger=logger)
+
+    report_fpath = tmp_path / 'qc_report.json'
+    total_warnings = run_quality_control(chatdb=chatdb, cfg=cfg, logger=logger, report_fpath=str(report_fpath))
+    chatdb.disconnect()
+
+    checks = {x['name']: x for x in json.loads(report_fpath.read_text())['checks']}
+
+    # Only failed checks above info severity count as warnings
+    assert total_warnings == 0
+    assert checks['qc_negative_values']['n_issues'] == 0 and not checks['qc_negative_values']['failed']
+    assert checks['qc_large_values']['n_issues'] == 9 and not checks['qc_large_values']['failed']
+    assert checks['qc_odd_values']['n_issues'] == 50 and checks['qc_odd_values']['failed']
+    assert len(checks['qc_odd_values']['sample']) == 3
+    assert checks['qc_large_values']['sample'][0] == dict(x=91)
+
+
+def test_incremental_quality_control_checks_new_messages(tmp_path):
+    """Scoped checks only count messages added since the previous run, unless a full sweep is due or requested."""
+    logger = logger_setup(name=__name__, level=logging.ERROR)
+    cfg = WorkflowConfig(params=dict(static_table_dpath=str(tmp_path / 'static_tables')), logger=logger)
+    cfg.dir.qc_views = str(tmp_path / 'views')
+    cfg.file.qc_info = str(tmp_path / 'qc_info.json')
+
+    (tmp_path / 'views').mkdir()
+    (tmp_path / 'views' / 'qc_null_text.sql').write_text('create view qc_null_text as select * from message_user where text is null')
+    (tmp_path / 'views' / 'qc_null_text_chats.sql').write_text(
+        'create view qc_null_text_chats as select chat_identifier, count(*) as n from message_user where text is null group by chat_identifier')
+    (tmp_path / 'qc_info.json').write_text(json.dumps(dict(
+        qc_null_text=dict(scope_key='message_id'),
+        qc_null_text_chats=dict(scope_key='chat_identifier'),
+    )))
+
+    chatdb = SQLiteDb(db_path=str(tmp_path / 'out.db'), logger=logger)
+    chatdb.sqlite_con = chatdb.connect()
+    chatdb.execute("""create table message_user (message_id integer, chat_identifier text, text text);
+                      insert into message_user values (1, 'a', null), (2, 'b', 'hi'), (3, 'c', null);""")
+    create_qc_views(chatdb=chatdb, cfg=cfg, logger=logger)
+
+    def run(**kwargs) -> dict:
+        report_fpath = tmp_path / 'qc_report.json'
+        run_quality_control(chatdb=chatdb, cfg=cfg, logger=logger, report_fpath=str(report_fpath), **kwargs)
+        return {x['name']: x['n_issues'] for x in json.loads(report_fpath.read_text())['checks']}
+
+    assert run(incremental=True) == dict(qc_null_text=2, qc_null_text_chats=2)
+
+    chatdb.execute("insert into message_user values (4, 'b', null), (5, 'd', 'hey');")
+    assert run(incremental=True) == dict(qc_null_text=1, qc_null_text_chats=1)
+    assert run(incremental=True) == dict(qc_null_text=0, qc_null_text_chats=0)
+    assert run(incremental=True, full_sweep=True) == dict(qc_null_text=3, qc_null_text_chats=3)
+    assert run(incremental=True, full_sweep_hours=0) == dict(qc_null_text=3, qc_null_text_chats=3)
+    assert run(incremental=False) == dict(qc_null_text=3, qc_null_text_chats=3)
+
+    chatdb.disconnect()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""Tests for the app's SQL query layer."""
+
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from imessage_extractor.src.app.data.query import PageDataQuery
+
+
+@pytest.fixture
+def query(tmp_path):
+    db_path = str(tmp_path / 'out.db')
+    rows = [
+        ('2021-01-01', 'Alice', 0, 2, 1),
+        ('2021-01-02', 'Alice', 1, 3, 0),  # Saturday, in the week ending Sunday 2021-01-03
+        ('2021-01-04', 'Alice', 1, 1, 1),
+        ('2021-02-10', 'Alice', 0, 5, 2),
+        ('2021-01-01', 'Bob', 0, 7, 0),
+    ]
+    con = sqlite3.connect(db_path)
+    con.execute('CREATE TABLE daily_summary_contact_from_who_vw (dt text, contact_name text, is_from_me integer, text_messages integer, emotes integer)')
+    con.executemany('INSERT INTO daily_summary_contact_from_who_vw VALUES (?, ?, ?, ?, ?)', rows)
+    con.commit()
+    con.close()
+
+    query = PageDataQuery(db_path)
+    yield query
+    query.close()
+
+
+def test_daily_summary(query):
+    """Rows are filtered by contact and date and summed by date granularity in SQL."""
+    df = query.daily_summary('daily_summary_contact_from_who_vw', '2021-01-01', '2021-01-31', ['text_messages', 'emotes'],
+                             dt_gran='Month', by='contact_name', contact_name='Alice')
+    assert df.to_dict('records') == [dict(dt=pd.Timestamp('2021-01-01'), contact_name='Alice', text_messages=6, emotes=2, display_message_count=8)]
+
+    df = query.daily_summary('daily_summary_contact_from_who_vw', '2021-01-01', '2021-12-31', ['text_messages'], dt_gran='Week')
+    assert list(df['dt'].dt.strftime('%Y-%m-%d')) == ['2021-01-03', '2021-01-10', '2021-01-17', '2021-01-24', '2021-01-31', '2021-02-07', '2021-02-14']
+    assert list(df['display_message_count']) == [12, 1, 0, 0, 0, 0, 5]
+
+    # Periods without messages are filled with zeros for each contact, between its first and last period
+    df = query.daily_summary('daily_summary_contact_from_who_vw', '2021-01-01', '2021-12-31', ['text_messages'], dt_gran='Day', by='contact_name')
+    assert df.loc[df['contact_name'] == 'Alice', 'dt'].tolist() == list(pd.date_range('2021-01-01', '2021-02-10'))
+    assert df.loc[df['contact_name'] == 'Bob', 'dt'].tolist() == [pd.Timestamp('2021-01-01')]
+    assert df.loc[(df['contact_name'] == 'Alice') & (df['dt'] == '2021-01-03'), 'display_message_count'].tolist() == [0]
+
+    assert query.date_range('daily_summary_contact_from_who_vw', contact_name='Bob') == (pd.Timestamp('2021-01-01'), pd.Timestamp('2021-01-01'))
+
+    with pytest.raises(ValueError):
+        query.daily_summary('daily_summary_contact_from_who_vw', '2021-01-01', '2021-12-31', ['not_a_column'])
+
+
+def test_top_tokens(tmp_path):
+    """Top tokens are read for one contact, or for all contacts where contact_name is null."""
+    db_path = str(tmp_path / 'out.db')
+    con = sqlite3.connect(db_path)
+    con.execute('CREATE TABLE wordcloud_token_usage (contact_name text, is_from_me integer, token text, usages integer, rank integer)')
+    con.executemany('INSERT INTO wordcloud_token_usage VALUES (?, ?, ?, ?, ?)', [
+        ('Alice', 1, 'lol', 3, 1),
+        ('Alice', 0, 'hey', 2, 1),
+        (None, 1, 'haha', 9, 2),
+        (None, 1, 'lol', 10, 1),
+    ])
+    con.commit()
+    con.close()
+
+    query = PageDataQuery(db_path)
+    assert query.top_tokens('wordcloud_token_usage', is_from_me=True).to_dict('records') == [dict(token='lol', usages=10), dict(token='haha', usages=9)]
+    assert list(query.top_tokens('wordcloud_token_usage', is_from_me=False, contact_name='Alice')['token']) == ['hey']
+    query.close()
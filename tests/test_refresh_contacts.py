@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""Tests for building the contact map from address book records."""
+
+import logging
+import sqlite3
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+
+from imessage_extractor.src.refresh_contacts.refresh_contacts import (build_contact_map, normalize_identifier, read_address_book_db,
+                                                                      refresh_contacts)
+from imessage_extractor.src.synth.synth import SyntheticChatDb
+
+
+def test_build_contact_map():
+    """One row per contact and normalized identifier, keeping the address book's formatting."""
+    df = pd.DataFrame(dict(
+        first_name=['Jane', 'John'],
+        last_name=['Doe', 'Smith'],
+        email=['Jane@Example.com;jd@example.com', np.nan],
+        phone_number=['(415) 555-0100;+1 415-555-0100', '2125550199'],
+    ))
+
+    contact_map_df = build_contact_map(df)
+    jane_df = contact_map_df[contact_map_df['contact_name'] == 'Jane Doe']
+
+    assert set(contact_map_df['contact_name']) == {'Jane Doe', 'John Smith'}
+    assert set(jane_df['normalized_identifier']) == {'+14155550100', 'jane@example.com', 'jd@example.com'}
+    assert set(jane_df['chat_identifier']) == {'(415) 555-0100', 'Jane@Example.com', 'jd@example.com'}
+    assert set(contact_map_df.loc[contact_map_df['contact_name'] == 'John Smith', 'identifier_type']) == {'phone'}
+
+
+def test_normalize_identifier():
+    """Phones become E.164, emails are lowercased, everything else is left alone."""
+    assert normalize_identifier('(415) 555-0100') == '+14155550100'
+    assert normalize_identifier('415.555.0100') == '+14155550100'
+    assert normalize_identifier('+44 20 7946 0958') == '+442079460958'
+    assert normalize_identifier(' Jane@Example.com ') == 'jane@example.com'
+    assert normalize_identifier('chat123456789012345678') == 'chat123456789012345678'
+    assert normalize_identifier('24273') == '24273'
+    assert normalize_identifier(None) is None
+
+
+def test_normalize_identifier_is_cached():
+    """Repeated identifiers are parsed once."""
+    normalize_identifier.cache_clear()
+    for _ in range(3):
+        normalize_identifier('(415) 555-0100')
+
+    assert normalize_identifier.cache_info().hits == 2
+
+
+def test_refresh_contacts_skips_unchanged_sources(tmp_path):
+    """A second refresh with no source changes is a no-op, and only changed sources are reread."""
+    synthetic_chatdb = SyntheticChatDb(n_messages=100, n_contacts=20, n_group_chats=1, n_tapbacks=0,
+                                       n_threads=0, n_attachments=0, seed=0, logger=logging.getLogger(__name__))
+    for source in ['A', 'B']:
+        synthetic_chatdb.write_address_book(str(tmp_path / 'AddressBook' / 'Sources' / source / 'AddressBook-v22.abcddb'))
+
+    kwargs = dict(address_book_dpath=str(tmp_path / 'AddressBook'), logger=logging.getLogger(__name__), cache_dpath=str(tmp_path / 'cache'))
+
+    contact_map_df = refresh_contacts(**kwargs)
+    with patch('imessage_extractor.src.refresh_contacts.refresh_contacts.read_address_book_db') as reader:
+        pd.testing.assert_frame_equal(refresh_contacts(**kwargs), contact_map_df)
+
+    assert not reader.called
+
+    db_fpath = tmp_path / 'AddressBook' / 'Sources' / 'B' / 'AddressBook-v22.abcddb'
+    con = sqlite3.connect(str(db_fpath))
+    con.execute("UPDATE ZABCDRECORD SET ZFIRSTNAME = 'Renamed' WHERE Z_PK = (SELECT min(Z_PK) FROM ZABCDRECORD)")
+    con.commit()
+    con.close()
+
+    with patch('imessage_extractor.src.refresh_contacts.refresh_contacts.read_address_book_db', wraps=read_address_book_db) as reader:
+        contact_map_df = refresh_contacts(**kwargs, csv_fpath=str(tmp_path / 'contacts.csv'))
+
+    assert [call.args[0] for call in reader.call_args_list] == [str(db_fpath)]
+    assert 'Renamed' in contact_map_df['contact_name'].str.split(' ').str[0].tolist()
+    pd.testing.assert_frame_equal(pd.read_csv(tmp_path / 'contacts.csv'), contact_map_df)
+
+
+def test_refresh_contacts_cache_is_versioned(tmp_path):
+    """Contacts cached by a different version of the parsing code are read again."""
+    synthetic_chatdb = SyntheticChatDb(n_messages=100, n_contacts=5, n_group_chats=1, n_tapbacks=0,
+                                       n_threads=0, n_attachments=0, seed=0, logger=logging.getLogger(__name__))
+    synthetic_chatdb.write_address_book(str(tmp_path / 'AddressBook' / 'Sources' / 'A' / 'AddressBook-v22.abcddb'))
+    kwargs = dict(address_book_dpath=str(tmp_path / 'AddressBook'), logger=logging.getLogger(__name__), cache_dpath=str(tmp_path / 'cache'))
+
+    refresh_contacts(**kwargs)
+    with patch('imessage_extractor.src.refresh_contacts.refresh_contacts.cache_version', return_value='changed'), \
+         patch('imessage_extractor.src.refresh_contacts.refresh_contacts.read_address_book_db', wraps=read_address_book_db) as reader:
+        refresh_contacts(**kwargs)
+
+    assert reader.called
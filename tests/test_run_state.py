@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+"""Tests for recording and resuming pipeline runs."""
+
+import functools
+import logging
+import sqlite3
+from unittest.mock import patch
+
+from click.testing import CliRunner
+
+from imessage_extractor.src.chatdb.chatdb import ChatDb
+from imessage_extractor.src.go import go
+from imessage_extractor.src.refresh_contacts.refresh_contacts import refresh_contacts
+from imessage_extractor.src.synth.synth import SyntheticChatDb
+
+
+def test_go_resumes_failed_run(tmp_path):
+    """A run that fails during staging resumes without recopying chat.db or rebuilding completed objects."""
+    synthetic_chatdb = SyntheticChatDb(n_messages=500, n_contacts=10, n_group_chats=2, n_tapbacks=20,
+                                       n_threads=10, n_attachments=15, seed=0, logger=logging.getLogger(__name__))
+    synthetic_chatdb.write_address_book(str(tmp_path / 'AddressBook' / 'Sources' / 'A' / 'AddressBook-v22.abcddb'))
+    synthetic_chatdb.write_chatdb(str(tmp_path / 'chat.db'))
+
+    args = ['--chatdb-path', str(tmp_path / 'chat.db'),
+            '--output-db-path', str(tmp_path / 'out.db'),
+            '--address-book-dpath', str(tmp_path / 'AddressBook')]
+
+    def fail(**kwargs):
+        raise RuntimeError('stopwords unavailable')
+
+    with patch('imessage_extractor.src.go.refresh_contacts', functools.partial(refresh_contacts, cache_dpath=None)):
+        with patch.dict('imessage_extractor.src.staging.staging.python_staging_table_refresh_functions', stopwords=fail):
+            result = CliRunner().invoke(go, args)
+
+        assert isinstance(result.exception, RuntimeError)
+
+        con = sqlite3.connect(str(tmp_path / 'out.db'))
+        completed_before = {x[0] for x in con.execute("SELECT object_name FROM meta_run_state WHERE stage = 'staging'")}
+        con.close()
+        assert 'message_user' in completed_before and 'stopwords' not in completed_before
+
+        with patch.object(ChatDb, 'copy') as copy, patch.object(ChatDb, 'copy_incremental') as copy_incremental:
+            result = CliRunner().invoke(go, args + ['--resume'])
+
+        assert result.exit_code == 0, result.output
+        assert not copy.called and not copy_incremental.called
+
+    con = sqlite3.connect(str(tmp_path / 'out.db'))
+    assert con.execute('SELECT count(*), count(completed_at) FROM meta_run').fetchone() == (1, 1)
+    assert con.execute('SELECT count(*) FROM stopwords').fetchone()[0] > 0
+    assert con.execute('SELECT count(*) FROM message_user').fetchone()[0] > 0
+    con.close()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+"""Tests for selecting and ordering staging objects."""
+
+import json
+import logging
+import shutil
+from unittest.mock import patch
+
+import pytest
+
+from imessage_extractor.src.chatdb.chatdb import ChatDb, SQLiteDb
+from imessage_extractor.src.helpers.config import WorkflowConfig
+from imessage_extractor.src.helpers.verbosity import logger_setup
+from imessage_extractor.src.refresh_contacts.refresh_contacts import refresh_contacts
+from imessage_extractor.src.staging.duckdb_engine import list_rollups, run_rollups_sqlite
+from imessage_extractor.src.staging.python_definitions.normalized_identifiers import refresh_normalized_identifiers
+from imessage_extractor.src.staging.staging import drop_stale_staging_objects, select_staging_objects, staging_dependency_graph
+from imessage_extractor.src.staging.staging import assemble_staging_order, staging_object_hashes, write_staging_hashes
+from imessage_extractor.src.static_tables.static_tables import build_static_tables
+from imessage_extractor.src.synth.synth import SyntheticChatDb
+
+
+@pytest.fixture
+def cfg(tmp_path):
+    return WorkflowConfig(params=dict(static_table_dpath=str(tmp_path / 'static_tables')), logger=logging.getLogger(__name__))
+
+
+def test_dependency_graph_order(cfg):
+    """Every staging object comes after the staging objects it references."""
+    graph = staging_dependency_graph(cfg)
+    order = list(graph)
+
+    for name, references in graph.items():
+        assert all(order.index(ref) < order.index(name) for ref in references)
+
+    assert graph['message_user'] == ['contacts_user', 'normalized_identifiers']
+
+
+def test_select_staging_objects(cfg):
+    """--only selects exactly the named objects, --from adds everything downstream, --skip removes."""
+    assert select_staging_objects(cfg, only=['message_user_text_vw']) == ['message_user_text_vw']
+
+    selected = select_staging_objects(cfg, from_=['daily_summary_contact_from_who_vw'], skip=['summary_vw'])
+    assert selected[0] == 'daily_summary_contact_from_who_vw'
+    assert {'daily_summary_vw', 'summary_contact_vw'} <= set(selected)
+    assert 'summary_vw' not in selected and 'message_user' not in selected
+
+    assert 'stopwords' not in select_staging_objects(cfg, skip=['stopwords'])
+    assert len(select_staging_objects(cfg, skip=['stopwords'])) == len(staging_dependency_graph(cfg)) - 1
+
+    with pytest.raises(ValueError):
+        select_staging_objects(cfg, only=['not_a_staging_object'])
+
+
+def test_list_rollups_only(cfg):
+    """Rollups outside the selection are read as inputs."""
+    rollups, inputs = list_rollups(cfg, only=['summary_vw'])
+    assert rollups == ['summary_vw']
+    assert inputs == ['daily_summary_contact_from_who_vw']
+
+
+def test_staging_object_hashes(cfg, tmp_path):
+    """Editing a view changes its hash and its dependents', and only stale objects are dropped."""
+    chatdb = SQLiteDb(db_path=str(tmp_path / 'out.db'), logger=logger_setup(name=__name__, level=logging.ERROR))
+    chatdb.sqlite_con = chatdb.connect()
+
+    with open(cfg.file.chatdb_table_info) as f:
+        data_versions = dict.fromkeys(json.load(f), 'v1')
+
+    hashes = staging_object_hashes(chatdb, cfg, data_versions=data_versions)
+    assert list(hashes) == list(staging_dependency_graph(cfg))
+
+    # Only tables that read a changed chat.db table, directly or through views, depend on
+    # its version. Views read their inputs when queried, so are kept, unless DuckDB
+    # materializes them
+    new_data_versions = dict(data_versions, message='v2')
+    new_data_hashes = staging_object_hashes(chatdb, cfg, data_versions=new_data_versions)
+    changed = [x for x in hashes if new_data_hashes[x] != hashes[x]]
+    assert {'message_user', 'wordcloud_token_usage'} <= set(changed)
+    assert 'stopwords' not in changed and 'normalized_identifiers' not in changed
+    assert 'summary_vw' not in changed and 'contact_token_usage_from_who_vw' not in changed
+
+    rollups, _ = list_rollups(cfg)
+    materialized_hashes = staging_object_hashes(chatdb, cfg, data_versions=data_versions, materialized=rollups)
+    new_data_materialized_hashes = staging_object_hashes(chatdb, cfg, data_versions=new_data_versions, materialized=rollups)
+    assert all(materialized_hashes[x] != new_data_materialized_hashes[x] for x in rollups)
+
+    staging_sql_dpath = tmp_path / 'sql_definitions'
+    shutil.copytree(cfg.dir.staging_sql, staging_sql_dpath)
+    cfg.dir.staging_sql = str(staging_sql_dpath)
+    with open(staging_sql_dpath / 'daily_summary_contact_from_who_vw.sql', 'a') as f:
+        f.write('\n-- edited\n')
+
+    edited_hashes = staging_object_hashes(chatdb, cfg, data_versions=data_versions)
+    changed = [x for x in hashes if edited_hashes[x] != hashes[x]]
+    assert changed == select_staging_objects(cfg, from_=['daily_summary_contact_from_who_vw'])
+
+    for name in ['stopwords', 'summary_vw']:
+        chatdb.execute(f'CREATE TABLE `{name}` (x integer);')
+
+    write_staging_hashes(chatdb, hashes)
+    stale = drop_stale_staging_objects(chatdb, cfg, edited_hashes)
+    assert 'summary_vw' in stale and not chatdb.table_exists('summary_vw')
+    assert 'stopwords' not in stale and chatdb.table_exists('stopwords')
+
+    chatdb.disconnect()
+
+
+def test_python_staging_tables_built_once(cfg, tmp_path):
+    """A Python-defined table referenced by several objects is built once per run."""
+    logger = logger_setup(name=__name__, level=logging.ERROR)
+    synthetic_chatdb = SyntheticChatDb(n_messages=300, n_contacts=8, n_group_chats=2, n_tapbacks=10,
+                                       n_threads=5, n_attachments=10, seed=0, logger=logger)
+    synthetic_chatdb.write_address_book(str(tmp_path / 'AddressBook' / 'Sources' / 'A' / 'AddressBook-v22.abcddb'))
+    synthetic_chatdb.write_chatdb(str(tmp_path / 'chat.db'))
+
+    contacts_df = refresh_contacts(address_book_dpath=str(tmp_path / 'AddressBook'), logger=logger, cache_dpath=None)
+    chatdb = ChatDb(native_chatdb_path=str(tmp_path / 'chat.db'), imessage_extractor_db_path=str(tmp_path / 'out.db'), logger=logger)
+    build_static_tables(sqlite_con=chatdb.sqlite_con, logger=logger, cfg=cfg, contacts_df=contacts_df)
+
+    calls = []
+    def counted(**kwargs):
+        calls.append(kwargs['table_name'])
+        refresh_normalized_identifiers(**kwargs)
+
+    with patch.dict('imessage_extractor.src.staging.staging.python_staging_table_refresh_functions', normalized_identifiers=counted):
+        assemble_staging_order(chatdb=chatdb, cfg=cfg)
+
+    assert calls == ['normalized_identifiers']
+    chatdb.disconnect()
+
+
+def test_rollups_materialized_with_sqlite(cfg, tmp_path):
+    """Rollups computed by SQLite are indexed tables with the rows of the views they replace."""
+    logger = logger_setup(name=__name__, level=logging.ERROR)
+    synthetic_chatdb = SyntheticChatDb(n_messages=300, n_contacts=8, n_group_chats=2, n_tapbacks=10,
+                                       n_threads=5, n_attachments=10, seed=0, logger=logger)
+    synthetic_chatdb.write_address_book(str(tmp_path / 'AddressBook' / 'Sources' / 'A' / 'AddressBook-v22.abcddb'))
+    synthetic_chatdb.write_chatdb(str(tmp_path / 'chat.db'))
+
+    contacts_df = refresh_contacts(address_book_dpath=str(tmp_path / 'AddressBook'), logger=logger, cache_dpath=None)
+    chatdb = ChatDb(native_chatdb_path=str(tmp_path / 'chat.db'), imessage_extractor_db_path=str(tmp_path / 'out.db'), logger=logger)
+    build_static_tables(sqlite_con=chatdb.sqlite_con, logger=logger, cfg=cfg, contacts_df=contacts_df)
+    assemble_staging_order(chatdb=chatdb, cfg=cfg)
+
+    rollups, _ = list_rollups(cfg)
+    expected = {x: sorted(chatdb.sqlite_con.execute(f'SELECT * FROM `{x}`').fetchall(), key=str) for x in rollups}
+
+    run_rollups_sqlite(chatdb=chatdb, cfg=cfg, logger=logger)
+
+    for rollup_name in rollups:
+        assert chatdb.table_exists(rollup_name)
+        assert sorted(chatdb.sqlite_con.execute(f'SELECT * FROM `{rollup_name}`').fetchall(), key=str) == expected[rollup_name], rollup_name
+
+    indexes = [x[1] for x in chatdb.sqlite_con.execute('PRAGMA index_list(daily_summary_contact_vw)')]
+    assert 'daily_summary_contact_vw_contact_name_dt' in indexes
+
+    chatdb.disconnect()
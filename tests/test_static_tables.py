@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""Tests for building static tables."""
+
+import json
+import logging
+import sqlite3
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from imessage_extractor.src.helpers.config import WorkflowConfig
+from imessage_extractor.src.static_tables.static_tables import StaticTable, build_static_tables
+
+
+def test_contacts_written_from_dataframe(tmp_path):
+    """The contact map is written as a typed, indexed table without a contacts.csv."""
+    logger = logging.getLogger(__name__)
+    cfg = WorkflowConfig(params=dict(static_table_dpath=str(tmp_path / 'static_tables')), logger=logger)
+    contacts_df = pd.DataFrame(dict(
+        contact_name=['Jane Doe', 'Jane Doe'],
+        chat_identifier=['(415) 555-0100', 'Jane@Example.com'],
+        normalized_identifier=['+14155550100', 'jane@example.com'],
+        identifier_type=['phone', 'email'],
+    ))
+
+    sqlite_con = sqlite3.connect(str(tmp_path / 'out.db'))
+    build_static_tables(sqlite_con=sqlite_con, logger=logger, cfg=cfg, contacts_df=contacts_df)
+
+    column_types = {x[1]: x[2] for x in sqlite_con.execute('PRAGMA table_info(contacts)')}
+    assert column_types == dict(contact_name='TEXT', chat_identifier='TEXT', normalized_identifier='TEXT', identifier_type='TEXT')
+    assert pd.read_sql('SELECT * FROM contacts', sqlite_con).equals(contacts_df)
+    assert 'contacts_normalized_identifier' in [x[1] for x in sqlite_con.execute('PRAGMA index_list(contacts)')]
+
+    # Empty .csv files for user-maintained tables are created in the static table data
+    # folder, outside of the installed package
+    assert sorted(x.name for x in (tmp_path / 'static_tables').iterdir()) == ['contacts_ignored.csv', 'contacts_manual.csv']
+
+    sqlite_con.close()
+
+
+def test_csv_loaded_with_declared_types_and_skipped_when_unchanged(tmp_path):
+    """Static tables use the declared types and primary key, and are only rebuilt when their .csv changes."""
+    logger = logging.getLogger(__name__)
+    cfg = WorkflowConfig(params=dict(static_table_dpath=str(tmp_path / 'data')), logger=logger)
+    cfg.dir.static_tables = str(tmp_path)
+    cfg.file.static_table_info = str(tmp_path / 'static_table_info.json')
+
+    (tmp_path / 'data').mkdir()
+    (tmp_path / 'static_table_info.json').write_text(json.dumps(dict(
+        contacts_ignored=dict(columnspec=dict(chat_identifier='text', notes='text'), primary_key='chat_identifier'),
+        contacts_manual=dict(columnspec=dict(chat_identifier='text', contact_name='text'), primary_key='chat_identifier'),
+        contacts=dict(columnspec=dict(contact_name='text', chat_identifier='text', normalized_identifier='text', identifier_type='text'),
+                      primary_key=['contact_name', 'normalized_identifier']),
+        spam_scores=dict(columnspec=dict(chat_identifier='text', score='integer'), primary_key='chat_identifier'),
+    )))
+    (tmp_path / 'data' / 'spam_scores.csv').write_text('score,chat_identifier\n10,+14155550100\n,24273\n')
+
+    sqlite_con = sqlite3.connect(str(tmp_path / 'out.db'))
+    build_static_tables(sqlite_con=sqlite_con, logger=logger, cfg=cfg)
+
+    assert sqlite_con.execute('SELECT chat_identifier, score, typeof(score) FROM spam_scores ORDER BY chat_identifier').fetchall() == \
+        [('+14155550100', 10, 'integer'), ('24273', None, 'null')]
+    assert [x[5] for x in sqlite_con.execute('PRAGMA table_info(spam_scores)')] == [1, 0]
+
+    with patch.object(StaticTable, 'save_to_sqlite') as save_to_sqlite:
+        build_static_tables(sqlite_con=sqlite_con, logger=logger, cfg=cfg)
+
+    assert not save_to_sqlite.called
+
+    (tmp_path / 'data' / 'spam_scores.csv').write_text('score,chat_identifier\n10,+14155550100\n10,+14155550100\n')
+    with pytest.raises(sqlite3.IntegrityError):
+        build_static_tables(sqlite_con=sqlite_con, logger=logger, cfg=cfg)
+
+    # The failed build is rolled back, leaving the previous table in place
+    assert sqlite_con.execute('SELECT count(*) FROM spam_scores').fetchone()[0] == 2
+
+    sqlite_con.close()
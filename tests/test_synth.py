@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+"""Tests for the synthetic chat.db generator."""
+
+import json
+import logging
+import sqlite3
+from os.path import dirname, join
+
+from imessage_extractor.src.synth.synth import SyntheticChatDb
+
+
+chatdb_table_info_fpath = join(dirname(dirname(__file__)), 'imessage_extractor', 'src', 'chatdb', 'chatdb_table_info.json')
+
+
+def build(tmp_path, seed=0):
+    """Generate a small synthetic chat.db and address book in `tmp_path`."""
+    synthetic_chatdb = SyntheticChatDb(n_messages=2000,
+                                       n_contacts=25,
+                                       n_group_chats=3,
+                                       n_tapbacks=100,
+                                       n_threads=40,
+                                       n_attachments=60,
+                                       seed=seed,
+                                       logger=logging.getLogger(__name__))
+    synthetic_chatdb.write_address_book(str(tmp_path / 'AddressBook' / 'Sources' / 'A' / 'AddressBook-v22.abcddb'))
+    synthetic_chatdb.write_chatdb(str(tmp_path / 'chat.db'))
+    return str(tmp_path / 'chat.db')
+
+
+def test_synthetic_chatdb_covers_configured_tables(tmp_path):
+    """Every table in chatdb_table_info.json exists, and nothing else."""
+    con = sqlite3.connect(build(tmp_path))
+    tables = {x[0] for x in con.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+    with open(chatdb_table_info_fpath, 'r') as f:
+        assert tables == set(json.load(f).keys())
+
+
+def test_synthetic_chatdb_scale(tmp_path):
+    """Messages, joins and special message kinds are generated at the requested scale."""
+    con = sqlite3.connect(build(tmp_path))
+
+    assert con.execute('SELECT count(*) FROM message').fetchone()[0] == 2000
+    assert con.execute('SELECT count(*) FROM chat_message_join').fetchone()[0] == 2000
+    assert con.execute('SELECT count(*) FROM chat WHERE style = 43').fetchone()[0] == 3
+    assert con.execute('SELECT count(*) FROM attachment').fetchone()[0] == 60
+    assert con.execute('SELECT count(*) FROM message WHERE associated_message_type >= 2000').fetchone()[0] <= 100
+    assert con.execute('SELECT count(*) FROM message WHERE thread_originator_guid IS NOT NULL').fetchone()[0] <= 40
+
+
+def test_synthetic_chatdb_is_deterministic(tmp_path):
+    """The same seed produces the same message history."""
+    query = 'SELECT guid, text, handle_id FROM message ORDER BY ROWID'
+    first = sqlite3.connect(build(tmp_path / 'first')).execute(query).fetchall()
+    second = sqlite3.connect(build(tmp_path / 'second')).execute(query).fetchall()
+    assert first == second
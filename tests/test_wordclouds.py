@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+"""Tests for the app's content-addressed wordcloud cache."""
+
+import logging
+from os.path import dirname, isfile
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('stylecloud')
+pytest.importorskip('send2trash')
+pytest.importorskip('humanize')
+
+from imessage_extractor.src.app import wordclouds  # noqa: E402
+
+
+style = dict(icon_name='fas fa-comment', size=64)
+
+
+def word_counts(usages: list) -> pd.DataFrame:
+    return pd.DataFrame(dict(token=['hello', 'lol', 'dinner'][:len(usages)], usages=usages))
+
+
+@pytest.fixture
+def home(tmp_path, monkeypatch):
+    """Cache wordclouds under a temporary home directory, also seen by render worker processes."""
+    monkeypatch.setenv('HOME', str(tmp_path))
+    return tmp_path
+
+
+def test_wordcloud_key():
+    """Equal token counts and options make equal keys, and a change to either makes a new key."""
+    key = wordclouds.wordcloud_key(word_counts([3, 2]), style)
+    assert wordclouds.wordcloud_key(word_counts([3, 2]), dict(reversed(list(style.items())))) == key
+    assert wordclouds.wordcloud_key(word_counts([3, 1]), style) != key
+    assert wordclouds.wordcloud_key(word_counts([3, 2]), dict(style, icon_name='fas fa-heart')) != key
+
+
+def test_get_wordclouds_renders_once_per_content(home, monkeypatch):
+    """Wordclouds are rendered in parallel on first use, then read from the cache until their token counts change."""
+    logger = logging.getLogger(__name__)
+    fpaths = wordclouds.get_wordclouds([word_counts([3, 2]), word_counts([1, 5, 2])], style, logger)
+    assert all(isfile(x) for x in fpaths) and len(set(fpaths)) == 2
+    assert dirname(fpaths[0]).startswith(str(home))
+
+    rendered = []
+    def render_wordcloud(df_word_counts, style, fpath):
+        rendered.append(fpath)
+        with open(fpath, 'wb') as f:
+            f.write(b'png')
+
+        return fpath
+
+    monkeypatch.setattr(wordclouds, 'render_wordcloud', render_wordcloud)
+
+    assert wordclouds.get_wordclouds([word_counts([3, 2]), word_counts([1, 5, 2])], style, logger) == fpaths
+    assert rendered == []
+
+    [changed_fpath] = wordclouds.get_wordclouds([word_counts([3, 1])], style, logger)
+    assert rendered == [changed_fpath] and changed_fpath not in fpaths
+    assert all(isfile(x) for x in fpaths + [changed_fpath])
+
+    # Empty token counts are not rendered
+    assert wordclouds.get_wordclouds([word_counts([])], style, logger) == [None]